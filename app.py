@@ -1,12 +1,28 @@
-from flask import Flask, send_from_directory, jsonify, request
+from flask import Flask, send_from_directory, jsonify, request, Response, abort, render_template_string
 from flask_cors import CORS
+from flask_sock import Sock
 from dotenv import load_dotenv
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+from werkzeug.serving import WSGIRequestHandler, make_server
 import os
-import subprocess
+import sys
 import signal
 import atexit
-import time
+import json
 import logging
+import threading
+import time
+
+from edge import (EdgeCache, JobRelays, RelayedFragments, RelayedPtzState, RelayedStatus, SupervisorProxy,
+                  ViewerReporter)
+from llhls import BlockingRequestError
+from probe import ProbeCache
+from segment_store import CachedFile
+from ptz import PtzClient, PtzError
+from pipeline import DEFAULT_SETTINGS, PipelineRegistry, load_camera_config, v380_stream_url
+from stream_status import StatusBroadcaster
+from stream_watchdog import Watchdog
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -17,15 +33,91 @@ load_dotenv()
 ONVIF_USERNAME = os.getenv('ONVIF_USERNAME')
 ONVIF_PASSWORD = os.getenv('ONVIF_PASSWORD')
 ONVIF_IP = os.getenv('ONVIF_IP')
+# Optional JSON file describing several cameras, see README
+CAMERAS_CONFIG = os.getenv('CAMERAS_CONFIG')
 
-if not all([ONVIF_USERNAME, ONVIF_PASSWORD, ONVIF_IP]):
+if not CAMERAS_CONFIG and not all([ONVIF_USERNAME, ONVIF_PASSWORD, ONVIF_IP]):
     logger.error("Missing required environment variables!")
     raise ValueError("Missing required environment variables!")
 
-auth = f"{ONVIF_USERNAME}:{ONVIF_PASSWORD}@{ONVIF_IP}"
-stream_url = f"rtsp://{auth}:554/ch01/0"
+HTTP_PORT = int(os.getenv('HTTP_PORT', '8083'))
+BIND_HOST = os.getenv('BIND_HOST', '0.0.0.0')
+# 'standalone' runs everything in this process. Under gunicorn (see
+# gunicorn.conf.py) a single 'supervisor' process owns the FFmpeg pipelines and
+# the 'edge' workers serve disk segments themselves and forward the rest to it
+APP_ROLE = os.getenv('APP_ROLE', 'standalone')
+SUPERVISOR_URL = os.getenv('SUPERVISOR_URL', 'http://127.0.0.1:8084')
+# Use a tmpfs such as /dev/shm/hls to serve disk segments from memory
+HLS_ROOT = os.getenv('HLS_ROOT', os.path.join('static', 'hls'))
+# Motion detection on a small grayscale side output (needs numpy); per-camera keys can tune it
+MOTION = os.getenv('MOTION', 'false').lower() in ('1', 'true', 'yes')
+MOTION_FPS = float(os.getenv('MOTION_FPS', '5'))
+# Rolling recording: where it lives, and how much of it is kept per camera
+RECORD = os.getenv('RECORD', 'false').lower() in ('1', 'true', 'yes')
+DVR_ROOT = os.getenv('DVR_ROOT', os.path.join('static', 'dvr'))
+DVR_RETENTION_HOURS = float(os.getenv('DVR_RETENTION_HOURS', '168'))
+DVR_MAX_MB = float(os.getenv('DVR_MAX_MB', '0'))
+DVR_CHUNK_MINUTES = float(os.getenv('DVR_CHUNK_MINUTES', '60'))
+# Longest time range a single DVR playlist may cover
+DVR_MAX_RANGE_HOURS = float(os.getenv('DVR_MAX_RANGE_HOURS', '6'))
+# Loopback port FFmpeg uploads its output to (0 = HTTP_PORT). Under gunicorn
+# the supervisor serves it from a listener of its own; see serve_ingest()
+INGEST_PORT = int(os.getenv('INGEST_PORT', '0')) or HTTP_PORT
+INGEST_BASE = f"http://127.0.0.1:{INGEST_PORT}/ingest"
+# Defaults for every camera; the cameras file can override them per camera.
+# 'memory' keeps segments in an in-process ring fed by FFmpeg's HTTP PUTs,
+# 'disk' writes them to static/hls/<camera> like before
+HLS_STORAGE = os.getenv('HLS_STORAGE', 'memory')
+HLS_RING_SIZE = int(os.getenv('HLS_RING_SIZE', '8'))
+# 'standard' keeps the plain HLS pipeline, 'll' serves Low-Latency HLS with
+# partial segments and blocking playlist reloads on /llhls (memory only)
+HLS_MODE = os.getenv('HLS_MODE', 'standard')
+LL_PART_TARGET = float(os.getenv('LL_PART_TARGET', '0.2'))
+LL_SEGMENT_TARGET = float(os.getenv('LL_SEGMENT_TARGET', '1.0'))
+# 'encode' always re-encodes with libx264, 'copy' always remuxes, 'auto'
+# probes the camera and remuxes when its H.264 stream is browser compatible
+STREAM_MODE = os.getenv('STREAM_MODE', 'encode')
+MAX_PASSTHROUGH_GOP = float(os.getenv('MAX_PASSTHROUGH_GOP', '2.0'))
+# Kept out of static/, which Flask serves publicly: entries name every camera's
+# host and RTSP path
+PROBE_CACHE = os.getenv('PROBE_CACHE', os.path.join('cache', 'probe_cache.json'))
+PROBE_CACHE_TTL = int(os.getenv('PROBE_CACHE_TTL', '86400'))
+# Simultaneous libx264 encoders (defaults to the number of cores) and the
+# spacing between FFmpeg spawns when many cameras start together
+ENCODER_LIMIT = int(os.getenv('ENCODER_LIMIT', '0')) or os.cpu_count()
+ENCODER_WAIT = float(os.getenv('ENCODER_WAIT', '0'))
+STARTUP_STAGGER = float(os.getenv('STARTUP_STAGGER', '0.5'))
+# Server-side supervision: how often pipelines are checked, how long media may
+# stall before a restart, the restart backoff range and the minimum spacing
+# between client-requested restarts
+WATCHDOG_INTERVAL = float(os.getenv('WATCHDOG_INTERVAL', '2'))
+STALL_TIMEOUT = float(os.getenv('STALL_TIMEOUT', '10'))
+RESTART_BACKOFF = float(os.getenv('RESTART_BACKOFF', '1'))
+RESTART_BACKOFF_MAX = float(os.getenv('RESTART_BACKOFF_MAX', '60'))
+RESTART_COOLDOWN = float(os.getenv('RESTART_COOLDOWN', '15'))
+# On-demand cameras start with the first playlist request and stop after
+# IDLE_TIMEOUT seconds without viewers; a waking request waits COLD_START_WAIT
+ON_DEMAND = os.getenv('ON_DEMAND', 'false').lower() in ('1', 'true', 'yes')
+IDLE_TIMEOUT = float(os.getenv('IDLE_TIMEOUT', '60'))
+COLD_START_WAIT = float(os.getenv('COLD_START_WAIT', '10'))
+# Optional ABR ladder encoded from a single decode, "name:height:bitrate,..."
+ABR_LADDER = os.getenv('ABR_LADDER', '')
+# Also push fragmented MP4 over WebSockets (/ws/<cam>, player at /push/<cam>)
+WEBSOCKET_PUSH = os.getenv('WEBSOCKET_PUSH', 'false').lower() in ('1', 'true', 'yes')
+# PTZ state polling: seconds between GetStatus calls while moving / at rest
+PTZ_POLL_FAST = float(os.getenv('PTZ_POLL_FAST', '0.25'))
+PTZ_POLL_IDLE = float(os.getenv('PTZ_POLL_IDLE', '5'))
+# Seconds between health polls behind the /stream/events SSE streams
+STATUS_INTERVAL = float(os.getenv('STATUS_INTERVAL', '1'))
+# How long a CDN, proxy or edge worker may reuse a playlist; segment names are
+# never reused, so segments may be kept for a year
+HLS_PLAYLIST_MAX_AGE = int(os.getenv('HLS_PLAYLIST_MAX_AGE', '1'))
+SEGMENT_MAX_AGE = 365 * 24 * 3600
+# Memory each edge worker may use for supervisor responses it shares between viewers
+EDGE_CACHE_MB = float(os.getenv('EDGE_CACHE_MB', '64'))
 
 app = Flask(__name__)
+sock = Sock(app)
 # Configure CORS to allow requests from your domain
 CORS(app, resources={
     r"/*": {
@@ -36,7 +128,19 @@ CORS(app, resources={
     }
 })
 
-# Add CORS headers for HLS files
+def hls_cache_control(response):
+    if response.status_code not in (200, 206, 304):
+        # 404s and "stream is starting" answers must not outlive the moment
+        return 'no-store'
+    if request.endpoint == 'dvr_chunk':
+        # The newest recorded chunk still grows; revalidate against its ETag
+        return 'no-cache'
+    if request.path.endswith('.ts'):
+        # Segment and part names carry the FFmpeg run id, so their content never changes
+        return f'public, max-age={SEGMENT_MAX_AGE}, immutable'
+    return f'public, max-age={HLS_PLAYLIST_MAX_AGE}'
+
+# Add CORS and caching headers for HLS files
 @app.after_request
 def after_request(response):
     response.headers.add('Access-Control-Allow-Origin', 'https://onvif.uratmangun.ovh')
@@ -44,160 +148,495 @@ def after_request(response):
     response.headers.add('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
     response.headers.add('Access-Control-Allow-Credentials', 'true')
     if request.path.endswith(('.m3u8', '.ts')):
-        response.headers.add('Cache-Control', 'no-cache, no-store, must-revalidate')
-        response.headers.add('Pragma', 'no-cache')
-        response.headers.add('Expires', '0')
+        response.headers['Cache-Control'] = hls_cache_control(response)
     return response
 
-# Global variable for FFmpeg process
-ffmpeg_process = None
-
-def start_ffmpeg():
-    global ffmpeg_process
-    if ffmpeg_process is None:
-        try:
-            logger.info("Starting FFmpeg process...")
-            
-            # Ensure the hls directory exists and has proper permissions
-            os.makedirs('static/hls', exist_ok=True)
-            os.chmod('static/hls', 0o777)
-            
-            # Clean up any existing HLS files
-            for file in os.listdir('static/hls'):
-                file_path = os.path.join('static/hls', file)
-                try:
-                    os.remove(file_path)
-                    logger.info(f"Cleaned up {file_path}")
-                except Exception as e:
-                    logger.error(f"Error cleaning up {file_path}: {e}")
-            
-            command = [
-                'ffmpeg',
-                '-y',
-                '-fflags', 'nobuffer+genpts+igndts+discardcorrupt+flush_packets',
-                '-flags', 'low_delay',
-                '-rtsp_transport', 'tcp',
-                '-rtsp_flags', 'prefer_tcp',
-                '-probesize', '32',
-                '-analyzeduration', '0',
-                '-timeout', '5000000',
-                '-use_wallclock_as_timestamps', '1',
-                '-i', stream_url,
-                '-c:v', 'libx264',
-                '-preset', 'ultrafast',
-                '-tune', 'zerolatency',
-                '-profile:v', 'baseline',
-                '-level', '3.0',
-                '-fps_mode', 'cfr',
-                '-r', '30',
-                '-g', '30',
-                '-keyint_min', '30',
-                '-sc_threshold', '0',
-                '-bufsize', '2000k',
-                '-maxrate', '2000k',
-                '-crf', '28',
-                '-pix_fmt', 'yuv420p',
-                '-x264-params', 'no-scenecut=1:rc-lookahead=0:sync-lookahead=0:ref=1:bframes=0:b-adapt=0:force-cfr=1',
-                '-max_muxing_queue_size', '1024',
-                '-f', 'hls',
-                '-method', 'PUT',
-                '-hls_time', '1',
-                '-hls_init_time', '1',
-                '-hls_list_size', '3',
-                '-hls_flags', 'delete_segments+discont_start+omit_endlist+independent_segments',
-                '-hls_segment_type', 'mpegts',
-                '-hls_allow_cache', '0',
-                '-start_number', '0',
-                '-hls_segment_filename', 'static/hls/segment_%03d.ts',
-                'static/hls/playlist.m3u8'
-            ]
-            
-            logger.info("FFmpeg command: %s", ' '.join(command))
-            
-            # Start ffmpeg process and capture output
-            ffmpeg_process = subprocess.Popen(
-                command,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                universal_newlines=True
-            )
-            
-            # Wait for the playlist file to be created
-            max_wait = 10  # Maximum wait time in seconds
-            start_time = time.time()
-            
-            while time.time() - start_time < max_wait:
-                if ffmpeg_process.poll() is not None:
-                    error = ffmpeg_process.stderr.read() if ffmpeg_process.stderr else "No error output"
-                    logger.error(f"FFmpeg process died: {error}")
-                    return False
-                
-                if os.path.exists('static/hls/playlist.m3u8'):
-                    logger.info("Playlist file created successfully")
-                    return True
-                
-                time.sleep(0.5)
-            
-            logger.error("Timeout waiting for playlist file")
-            stop_ffmpeg()
-            return False
-            
-        except Exception as e:
-            logger.error(f"Error starting FFmpeg: {e}")
-            if ffmpeg_process:
-                stop_ffmpeg()
-            return False
-    return True  # Return True if process is already running
-
-def stop_ffmpeg():
-    global ffmpeg_process
-    if ffmpeg_process:
-        try:
-            logger.info("Stopping FFmpeg process...")
-            ffmpeg_process.send_signal(signal.SIGTERM)
-            try:
-                ffmpeg_process.wait(timeout=5)
-            except subprocess.TimeoutExpired:
-                logger.warning("FFmpeg process did not terminate within timeout, forcing kill")
-                ffmpeg_process.kill()
-                ffmpeg_process.wait()
-            finally:
-                ffmpeg_process = None
-                logger.info("FFmpeg process stopped")
-                return True
-        except Exception as e:
-            logger.error(f"Error stopping FFmpeg: {e}")
+# One managed FFmpeg pipeline per camera
+pipelines = PipelineRegistry(
+    ProbeCache(PROBE_CACHE, ttl=PROBE_CACHE_TTL),
+    INGEST_BASE,
+    encoder_limit=ENCODER_LIMIT,
+    encoder_wait=ENCODER_WAIT,
+    startup_stagger=STARTUP_STAGGER,
+    restart_backoff=RESTART_BACKOFF,
+    restart_backoff_max=RESTART_BACKOFF_MAX,
+    restart_cooldown=RESTART_COOLDOWN,
+    hls_root=HLS_ROOT,
+    dvr_root=DVR_ROOT,
+    dvr_max_age=DVR_RETENTION_HOURS * 3600,
+    dvr_max_bytes=int(DVR_MAX_MB * 1024 * 1024),
+    dvr_chunk_seconds=DVR_CHUNK_MINUTES * 60
+)
+watchdog = Watchdog(pipelines, interval=WATCHDOG_INTERVAL, stall_timeout=STALL_TIMEOUT)
+status_broadcaster = StatusBroadcaster(pipelines, interval=STATUS_INTERVAL)
+camera_defaults = {
+    'storage': HLS_STORAGE,
+    'hls_mode': HLS_MODE,
+    'ring_size': HLS_RING_SIZE,
+    'll_part_target': LL_PART_TARGET,
+    'll_segment_target': LL_SEGMENT_TARGET,
+    'stream_mode': STREAM_MODE,
+    'max_passthrough_gop': MAX_PASSTHROUGH_GOP,
+    'on_demand': ON_DEMAND,
+    'idle_timeout': IDLE_TIMEOUT,
+    'ladder': ABR_LADDER,
+    'push': WEBSOCKET_PUSH,
+    'record': RECORD,
+    'motion': MOTION,
+    'motion_fps': MOTION_FPS,
+}
+if CAMERAS_CONFIG:
+    for cam, entry in load_camera_config(CAMERAS_CONFIG).items():
+        overrides = {k: v for k, v in entry.items() if k in DEFAULT_SETTINGS}
+        pipelines.add(cam, entry['url'], config=entry, **{**camera_defaults, **overrides})
+else:
+    stream_url = v380_stream_url(ONVIF_USERNAME, ONVIF_PASSWORD, ONVIF_IP)
+    pipelines.add('default', stream_url, config={
+        'username': ONVIF_USERNAME, 'password': ONVIF_PASSWORD, 'ip': ONVIF_IP
+    }, **camera_defaults)
+# One keep-alive ONVIF PTZ connection per camera, owned by the supervisor
+ptz_clients = {
+    name: client for name, client in (
+        (pipeline.name, PtzClient.from_config(pipeline.config, pipeline.url,
+                                              fast_interval=PTZ_POLL_FAST, idle_interval=PTZ_POLL_IDLE))
+        for pipeline in pipelines.pipelines.values()
+    ) if client is not None
+}
+
+def get_pipeline(cam):
+    pipeline = pipelines.get(cam)
+    if pipeline is None:
+        abort(404)
+    return pipeline
+
+def start_ffmpeg(cam=None):
+    """Start a camera and block until its first playlist exists."""
+    pipeline = pipelines.get(cam) if cam else pipelines.default
+    ok, _ = pipeline.start()
+    return ok
+
+def stop_ffmpeg(cam=None):
+    pipeline = pipelines.get(cam) if cam else pipelines.default
+    return pipeline.stop()
+
+LOOPBACK = ('127.0.0.1', '::1')
+
+def viewer_key():
+    address = request.remote_addr
+    if APP_ROLE == 'supervisor' and address in LOOPBACK:
+        # Forwarded by an edge worker, which appends the real peer
+        address = request.headers.get('X-Forwarded-For', address).split(',')[-1].strip()
+    return f"{address}|{request.headers.get('User-Agent', '')}"
+
+if APP_ROLE == 'edge':
+    supervisor = SupervisorProxy(SUPERVISOR_URL)
+    viewer_reporter = ViewerReporter(supervisor)
+    edge_cache = EdgeCache(supervisor, max_bytes=int(EDGE_CACHE_MB * 1024 * 1024))
+    # SSE clients of this worker share one upstream stream per topic
+    status_broadcaster = RelayedStatus(supervisor)
+    for name, client in ptz_clients.items():
+        client.state = RelayedPtzState(client, supervisor, f"/ptz/{name}/events")
+    job_relays = JobRelays(supervisor)
+    push_relays = {name: RelayedFragments(supervisor, f"/ws/{name}")
+                   for name, pipeline in pipelines.pipelines.items() if pipeline.push}
+
+    @app.before_request
+    def edge_routing():
+        # Segments already on disk are sent from this worker with sendfile;
+        # control routes, playlists, in-memory/LL-HLS output and cold starts
+        # are answered by the supervisor, which owns every pipeline
+        if request.endpoint in ('index', 'push_page', 'push_stream', 'static'):
+            return None
+        if request.endpoint in ('stream_events', 'all_stream_events', 'ptz_events', 'stream_job_events'):
+            # Fanned out here from one relayed supervisor stream each
+            return None
+        if request.endpoint in ('ingest_hls', 'report_viewers'):
+            # Loopback-only on the supervisor; never relay them from outside
+            abort(403)
+        if request.endpoint == 'serve_hls':
+            cam = request.view_args['cam']
+            pipeline = pipelines.get(cam)
+            # A stopped camera leaves its last playlist on disk; only the
+            # supervisor knows whether it is live or must be woken first
+            filename = request.view_args['filename']
+            if pipeline and pipeline.storage == 'disk' and not filename.endswith('.m3u8'):
+                path = safe_join(pipeline.hls_dir, filename)
+                if path and os.path.isfile(path):
+                    viewer_reporter.touch(cam, viewer_key())
+                    return send_from_directory(pipeline.hls_dir, filename)
+        if request.endpoint == 'dvr_chunk':
+            # Recorded chunks are plain files too; byte ranges come from sendfile
+            pipeline = pipelines.get(request.view_args['cam'])
+            if pipeline and pipeline.dvr is not None:
+                return send_from_directory(pipeline.dvr.root, f"{request.view_args['chunk']}.ts")
+        if request.endpoint in ('serve_hls', 'serve_llhls') and request.method == 'GET':
+            # Playlists and in-memory segments: one upstream request per URL,
+            # shared by every viewer of this worker. Viewers answered from the
+            # cache are reported, since the supervisor does not see them
+            viewer_reporter.touch(request.view_args['cam'], viewer_key())
+            return edge_cache.get(request)
+        return supervisor.forward(request)
+else:
+    # Register cleanup function
+    atexit.register(pipelines.stop_all)
+
+@app.route('/ingest/<cam>/<path:filename>', methods=['PUT', 'POST', 'DELETE'])
+def ingest_hls(cam, filename):
+    # Only the local FFmpeg processes may publish segments
+    if request.remote_addr not in LOOPBACK:
+        abort(403)
+    get_pipeline(cam).ingest(filename, request.method, request.get_data())
+    return '', 204
+
+class IngestRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        # Several uploads a second per camera; failures are still logged
+        pass
+
+def ingest_only(environ, start_response):
+    if not environ.get('PATH_INFO', '').startswith('/ingest/'):
+        return NotFound()(environ, start_response)
+    return app(environ, start_response)
+
+def serve_ingest():
+    """Accept FFmpeg's uploads on INGEST_PORT when it is not HTTP_PORT.
+
+    Each upload connection gets a thread of its own there, so SSE streams,
+    long-polls and WebSockets filling the main server's threads never hold
+    up a camera's segments.
+    """
+    if INGEST_PORT == HTTP_PORT:
+        return None
+    server = make_server('127.0.0.1', INGEST_PORT, ingest_only, threaded=True,
+                         request_handler=IngestRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="ingest").start()
+    return server
+
+def cached_response(item):
+    response = Response(item.data, mimetype=item.content_type)
+    response.headers['ETag'] = item.etag
+    response.headers['Content-Length'] = str(len(item.data))
+    # 304 Not Modified when a cache revalidates with If-None-Match
+    return response.make_conditional(request)
+
+def sse_response(read, wait, done=lambda data: False):
+    """Server-sent events stream of `state` events.
+
+    `read()` gives the first event. Each `wait(data, timeout)` then gets the
+    next one, or None when nothing changed within `timeout`, until `done` is
+    true for the last event sent.
+    """
+    def events():
+        data = read()
+        yield f"event: state\ndata: {json.dumps(data)}\n\n"
+        while not done(data):
+            update = wait(data, 15)
+            if update is None:
+                # A comment line keeps proxies from closing an idle stream
+                yield ": keepalive\n\n"
+                continue
+            data = update
+            yield f"event: state\ndata: {json.dumps(data)}\n\n"
+
+    return Response(events(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+def wake_pipeline(pipeline):
+    # A new viewer wakes an on-demand camera
+    if pipeline.settings['on_demand'] and (not pipeline.is_running() or pipeline.ready_at is None):
+        pipeline.start_async().wait(COLD_START_WAIT)
+
+def track_viewer(pipeline, filename):
+    pipeline.viewers.touch(viewer_key())
+    if filename.endswith('.m3u8'):
+        wake_pipeline(pipeline)
+
+def not_found(pipeline):
+    if pipeline.starting():
+        # Still waking up: tell the player to retry shortly
+        abort(Response("Stream is starting", status=503, headers={'Retry-After': '1'}))
+    abort(404)
+
+@app.route('/hls/<cam>/<path:filename>')
+def serve_hls(cam, filename):
+    pipeline = get_pipeline(cam)
+    track_viewer(pipeline, filename)
+    if filename == 'master.m3u8' and pipeline.ladder:
+        if not pipeline.has_playlist():
+            not_found(pipeline)
+        return cached_response(pipeline.master_playlist())
+    if pipeline.hls_mode == 'll':
+        ll_playlist = pipeline.ll_playlist
+        item = ll_playlist.playlist() if filename.endswith('.m3u8') else ll_playlist.get(filename)
+    elif pipeline.storage != 'memory':
+        return send_from_directory(pipeline.hls_dir, filename)
+    else:
+        item = pipeline.ring.get(filename)
+    if item is None:
+        not_found(pipeline)
+    return cached_response(item)
+
+@app.route('/llhls/<cam>/<path:filename>')
+def serve_llhls(cam, filename):
+    pipeline = get_pipeline(cam)
+    if pipeline.hls_mode != 'll':
+        abort(404)
+    track_viewer(pipeline, filename)
+    ll_playlist = pipeline.ll_playlist
+    # Hold blocking requests for up to three target durations
+    timeout = 3 * ll_playlist.segment_target
+    if filename.endswith('.m3u8'):
+        msn = request.args.get('_HLS_msn', type=int)
+        part = request.args.get('_HLS_part', type=int)
+        if part is not None and msn is None:
+            abort(400)
+        if msn is not None:
             try:
-                if ffmpeg_process:
-                    ffmpeg_process.kill()
-                    ffmpeg_process = None
-            except:
-                pass
-            return True  # Return True even if we had to force kill
-    logger.info("No FFmpeg process was running")
-    return True  # Return True when there's no process to stop
-
-# Register cleanup function
-atexit.register(stop_ffmpeg)
-
-@app.route('/hls/<path:filename>')
-def serve_hls(filename):
-    return send_from_directory('static/hls', filename)
-
-@app.route('/stream/start', methods=['POST'])
-def start_stream():
+                if not ll_playlist.wait_for(msn, part, timeout=timeout):
+                    abort(503)
+            except BlockingRequestError:
+                abort(400)
+        if not ll_playlist.ready:
+            not_found(pipeline)
+        return cached_response(ll_playlist.playlist())
+    item = ll_playlist.get(filename)
+    if item is None:
+        # Preload hint: wait until FFmpeg delivers the advertised part
+        item = ll_playlist.wait_for_part(filename, timeout=timeout)
+    if item is None:
+        abort(404)
+    return cached_response(item)
+
+def get_dvr(cam):
+    pipeline = get_pipeline(cam)
+    if pipeline.dvr is None:
+        abort(404)
+    return pipeline.dvr
+
+@app.route('/dvr/<cam>')
+def dvr_info(cam):
+    dvr = get_dvr(cam)
+    try:
+        return jsonify({"camera": cam, **dvr.info()})
+    except Exception as e:
+        logger.exception("Error in dvr_info route")
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+@app.route('/dvr/<cam>/playlist.m3u8')
+def dvr_playlist(cam):
+    dvr = get_dvr(cam)
+    # ?start=<unix time>&end=<unix time>; the end defaults to now
+    start = request.args.get('start', type=float)
+    end = request.args.get('end', time.time(), type=float)
+    if start is None or end <= start or end - start > DVR_MAX_RANGE_HOURS * 3600:
+        abort(400)
+    text = dvr.playlist(start, end, lambda chunk: f'chunks/{chunk}.ts')
+    if text is None:
+        abort(404)
+    return cached_response(CachedFile('playlist.m3u8', text.encode()))
+
+@app.route('/dvr/<cam>/chunks/<int:chunk>.ts')
+def dvr_chunk(cam, chunk):
+    dvr = get_dvr(cam)
+    # Players fetch EXT-X-BYTERANGE slices; send_from_directory answers Range requests
+    return send_from_directory(dvr.root, f'{chunk}.ts')
+
+@app.route('/motion/<cam>')
+def motion_events(cam):
+    pipeline = get_pipeline(cam)
+    if pipeline.motion is None:
+        abort(404)
+    # ?since=<unix time> returns only events that were still going on after it
+    since = request.args.get('since', type=float)
+    return jsonify({"camera": cam, **pipeline.motion.snapshot(since)})
+
+@app.route('/internal/viewers', methods=['POST'])
+def report_viewers():
+    # Edge workers report the viewers whose segments they served themselves
+    if request.remote_addr not in LOOPBACK:
+        abort(403)
+    for cam, viewers in (request.get_json(silent=True) or {}).items():
+        pipeline = pipelines.get(cam)
+        if pipeline is not None:
+            for viewer in viewers:
+                pipeline.viewers.touch(viewer)
+    return '', 204
+
+@sock.route('/ws/<cam>')
+def push_stream(ws, cam):
+    pipeline = pipelines.get(cam)
+    if pipeline is None or not pipeline.push:
+        ws.close(reason=1008, message="WebSocket push is not enabled for this camera")
+        return
+    viewer = viewer_key()
+    if APP_ROLE == 'edge':
+        # One upstream socket per camera feeds every client of this worker
+        fragments = push_relays[cam]
+        client = fragments.join(COLD_START_WAIT)
+        touch = lambda: viewer_reporter.touch(cam, viewer)
+    else:
+        fragments = pipeline.fragments
+        # Edge workers report the viewers behind their shared socket themselves
+        touch = (lambda: None) if APP_ROLE == 'supervisor' else (lambda: pipeline.viewers.touch(viewer))
+        touch()
+        wake_pipeline(pipeline)
+        # The init segment follows the first playlist closely
+        deadline = time.time() + COLD_START_WAIT
+        client = fragments.subscribe()
+        while client is None and pipeline.is_running() and time.time() < deadline:
+            time.sleep(0.1)
+            client = fragments.subscribe()
+    if client is None:
+        ws.close(reason=1013, message="Stream is not running")
+        return
+    try:
+        # The MSE player needs the codec before the init segment
+        ws.send(json.dumps({"codec": fragments.codec}))
+        while True:
+            data = client.get(timeout=15)
+            if data is None:
+                # Fell behind, or FFmpeg restarted with a new init segment
+                break
+            if data:
+                ws.send(data)
+            touch()
+    finally:
+        fragments.unsubscribe(client)
+
+@app.route('/snapshot/<cam>.jpg')
+def snapshot(cam):
+    pipeline = get_pipeline(cam)
+    # Thumbnails may ask for a smaller width; the height keeps the aspect ratio
+    width = max(0, min(request.args.get('width', 0, type=int), 1920))
+    try:
+        item = pipeline.snapshot(width)
+    except Exception as e:
+        logger.exception("Error in snapshot route")
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+    if item is None:
+        not_found(pipeline)
+    response = cached_response(item)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def get_ptz(cam):
+    client = ptz_clients.get(cam)
+    if client is None:
+        abort(404)
+    return client
+
+def ptz_vector():
+    """x, y and optional zoom from the JSON body, for the move routes."""
+    data = request.get_json(silent=True) or {}
+    try:
+        zoom = data.get('zoom')
+        return float(data.get('x', 0)), float(data.get('y', 0)), None if zoom is None else float(zoom)
+    except (TypeError, ValueError):
+        abort(400)
+
+def ptz_response(route, action):
+    try:
+        return jsonify({"status": "success", **(action() or {})})
+    except PtzError as e:
+        logger.warning(f"{route}: {e}")
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 502
+    except Exception as e:
+        logger.exception(f"Error in {route} route")
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+@app.route('/ptz/<cam>/move', methods=['POST'])
+def ptz_move(cam):
+    client = get_ptz(cam)
+    x, y, zoom = ptz_vector()
+    # Held joysticks send bursts; a velocity superseded before it was sent
+    # answers with "coalesced": true instead of waiting its turn
+    return ptz_response('ptz_move', lambda: client.continuous_move(x, y, zoom).result(timeout=client.timeout * 2 + 1))
+
+@app.route('/ptz/<cam>/stop', methods=['POST'])
+def ptz_stop(cam):
+    client = get_ptz(cam)
+    return ptz_response('ptz_stop', client.stop)
+
+@app.route('/ptz/<cam>/absolute', methods=['POST'])
+def ptz_absolute_move(cam):
+    client = get_ptz(cam)
+    x, y, zoom = ptz_vector()
+    return ptz_response('ptz_absolute_move', lambda: client.absolute_move(x, y, zoom))
+
+@app.route('/ptz/<cam>/relative', methods=['POST'])
+def ptz_relative_move(cam):
+    client = get_ptz(cam)
+    x, y, zoom = ptz_vector()
+    return ptz_response('ptz_relative_move', lambda: client.relative_move(x, y, zoom))
+
+def ptz_state(client):
+    """Cached PTZ state; 502 while the camera has never answered a poll."""
+    state = client.state.read(timeout=client.timeout)
+    if state['position'] is None and state['presets'] is None:
+        raise PtzError(state['error'] or "PTZ state is not available yet")
+    return state
+
+@app.route('/ptz/<cam>/status')
+def ptz_status(cam):
+    client = get_ptz(cam)
+    # Served from the poller's cache; concurrent readers never reach the camera
+    return ptz_response('ptz_status', lambda: {
+        k: v for k, v in ptz_state(client).items() if k != 'presets'
+    })
+
+@app.route('/ptz/<cam>/presets')
+def ptz_presets(cam):
+    client = get_ptz(cam)
+    return ptz_response('ptz_presets', lambda: {"presets": ptz_state(client)['presets']})
+
+@app.route('/ptz/<cam>/events')
+def ptz_events(cam):
+    client = get_ptz(cam)
+
+    def wait(state, timeout):
+        update = client.state.wait(state['version'], timeout)
+        return update if update['version'] != state['version'] else None
+
+    return sse_response(lambda: client.state.read(timeout=client.timeout), wait)
+
+@app.route('/ptz/<cam>/presets', methods=['POST'])
+def ptz_set_preset(cam):
+    client = get_ptz(cam)
+    name = (request.get_json(silent=True) or {}).get('name')
+    if not name:
+        abort(400)
+    return ptz_response('ptz_set_preset', lambda: {"token": client.set_preset(name)})
+
+@app.route('/ptz/<cam>/presets/<token>/goto', methods=['POST'])
+def ptz_goto_preset(cam, token):
+    client = get_ptz(cam)
+    return ptz_response('ptz_goto_preset', lambda: client.goto_preset(token))
+
+@app.route('/stream/<cam>/start', methods=['POST'])
+def start_stream(cam):
+    pipeline = get_pipeline(cam)
     try:
-        if ffmpeg_process and ffmpeg_process.poll() is None:
-            return jsonify({"status": "success", "message": "Stream already running"})
-        
-        if start_ffmpeg():
-            return jsonify({"status": "success", "message": "Stream started"})
-        else:
-            logger.error("Failed to start FFmpeg process")
-            return jsonify({
-                "status": "error",
-                "message": "Failed to start stream. Please check server logs for details."
-            }), 500
+        # Returns at once; readiness is reported through the job endpoints
+        job = pipeline.start_async()
+        data = job.to_dict()
+        data.update({
+            "status": "success",
+            "message": "Stream already running" if job.state == 'ready' else "Stream starting",
+            "wait_url": f"/stream/jobs/{job.id}?wait=20",
+            "events_url": f"/stream/jobs/{job.id}/events"
+        })
+        return jsonify(data), 200 if job.state == 'ready' else 202
     except Exception as e:
         logger.exception("Error in start_stream route")
         return jsonify({
@@ -205,10 +644,33 @@ def start_stream():
             "message": str(e)
         }), 500
 
-@app.route('/stream/stop', methods=['POST'])
-def stop_stream():
+@app.route('/stream/jobs/<job_id>')
+def stream_job(job_id):
+    job = pipelines.get_job(job_id)
+    if job is None:
+        abort(404)
+    # Long-poll: hold the request until the job finishes or `wait` expires
+    wait = min(request.args.get('wait', 0, type=float), 30.0)
+    data = job.wait(wait) if wait > 0 else job.to_dict()
+    return jsonify(data), 500 if data['state'] == 'failed' else 200
+
+@app.route('/stream/jobs/<job_id>/events')
+def stream_job_events(job_id):
+    job = job_relays.get(job_id) if APP_ROLE == 'edge' else pipelines.get_job(job_id)
+    if job is None:
+        abort(404)
+
+    def wait(data, timeout):
+        update = job.wait(timeout)
+        return update if update['state'] != 'starting' else None
+
+    return sse_response(job.to_dict, wait, done=lambda data: data['state'] != 'starting')
+
+@app.route('/stream/<cam>/stop', methods=['POST'])
+def stop_stream(cam):
+    pipeline = get_pipeline(cam)
     try:
-        stop_ffmpeg()  # Always returns True now
+        pipeline.stop()  # Always returns True now
         return jsonify({"status": "success", "message": "Stream stopped or was not running"})
     except Exception as e:
         logger.exception("Error in stop_stream route")
@@ -217,18 +679,27 @@ def stop_stream():
             "message": str(e)
         }), 500
 
-@app.route('/stream/status')
-def stream_status():
+@app.route('/stream/<cam>/restart', methods=['POST'])
+def restart_stream(cam):
+    pipeline = get_pipeline(cam)
     try:
-        is_running = ffmpeg_process and ffmpeg_process.poll() is None
-        has_playlist = os.path.exists('static/hls/playlist.m3u8')
-        
-        status = "running" if is_running and has_playlist else "stopped"
+        # Idempotent: viewers reporting the same stall share one incident
+        incident = pipeline.request_restart("requested by client", source='client')
+        if incident.get('throttled'):
+            return jsonify({"status": "success", "message": "Stream was restarted recently", **incident})
+        return jsonify({"status": "success", "message": "Restart scheduled", **incident}), 202
+    except Exception as e:
+        logger.exception("Error in restart_stream route")
         return jsonify({
-            "status": status,
-            "has_playlist": has_playlist,
-            "process_running": is_running
-        })
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+@app.route('/stream/<cam>/status')
+def stream_status(cam):
+    pipeline = get_pipeline(cam)
+    try:
+        return jsonify(pipeline.status())
     except Exception as e:
         logger.exception("Error in stream_status route")
         return jsonify({
@@ -236,12 +707,170 @@ def stream_status():
             "message": str(e)
         }), 500
 
+@app.route('/stream/<cam>/events')
+def stream_events(cam):
+    pipeline = get_pipeline(cam)
+
+    def wait(state, timeout):
+        update = status_broadcaster.wait(pipeline.name, state['version'], timeout)
+        return update if update['version'] != state['version'] else None
+
+    # Every page shares the broadcaster's poll instead of polling /status
+    return sse_response(lambda: status_broadcaster.read(pipeline.name), wait)
+
+@app.route('/stream/events')
+def all_stream_events():
+    # One connection for a multi-camera dashboard; only changed cameras are sent
+    sent = {'version': 0, 'cameras': {}}
+
+    def changes(version, states):
+        changed = {name: state for name, state in states.items()
+                   if sent['cameras'].get(name) != state['version']}
+        sent['version'] = version
+        sent['cameras'].update((name, state['version']) for name, state in changed.items())
+        return changed
+
+    return sse_response(lambda: changes(*status_broadcaster.read_all()),
+                        lambda data, timeout: changes(*status_broadcaster.wait_all(sent['version'], timeout)) or None)
+
+@app.route('/stream/metrics')
+def all_stream_metrics():
+    try:
+        return jsonify({
+            pipeline.name: pipeline.metrics.summary() for pipeline in pipelines.pipelines.values()
+        })
+    except Exception as e:
+        logger.exception("Error in all_stream_metrics route")
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+@app.route('/stream/<cam>/metrics')
+def stream_metrics(cam):
+    pipeline = get_pipeline(cam)
+    try:
+        # ?since=<unix time> returns only newer samples for incremental polling
+        since = request.args.get('since', type=float)
+        return jsonify({
+            "camera": cam,
+            "summary": pipeline.metrics.summary(),
+            "series": pipeline.metrics.series(since)
+        })
+    except Exception as e:
+        logger.exception("Error in stream_metrics route")
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+@app.route('/stream/cameras')
+def list_cameras():
+    try:
+        return jsonify({
+            "cameras": [pipeline.status() for pipeline in pipelines.pipelines.values()],
+            "encoder_limit": pipelines.encoder_limit
+        })
+    except Exception as e:
+        logger.exception("Error in list_cameras route")
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
 @app.route('/')
-def index():
-    return """
+@app.route('/view/<cam>')
+def index(cam=None):
+    pipeline = get_pipeline(cam) if cam else pipelines.default
+    prefix = 'llhls' if pipeline.hls_mode == 'll' else 'hls'
+    playlist = 'master.m3u8' if pipeline.ladder else 'playlist.m3u8'
+    playlist_url = f'/{prefix}/{pipeline.name}/{playlist}'
+    return render_template_string(INDEX_HTML, cam=pipeline.name, playlist_url=playlist_url)
+
+@app.route('/push/<cam>')
+def push_page(cam):
+    pipeline = get_pipeline(cam)
+    if not pipeline.push:
+        abort(404)
+    return render_template_string(PUSH_HTML, cam=pipeline.name)
+
+PUSH_HTML = """
+    <html>
+        <head>
+            <title>WebSocket Stream - {{ cam }}</title>
+            <style>
+                body { margin: 0; background: #000; display: flex; justify-content: center; align-items: center; height: 100vh; }
+                #player { width: 100%; max-width: 1280px; aspect-ratio: 16/9; }
+            </style>
+        </head>
+        <body>
+            <video id="player" autoplay muted playsinline></video>
+            <script>
+                const WS_URL = (location.protocol === 'https:' ? 'wss://' : 'ws://') + location.host + '/ws/{{ cam }}';
+                const video = document.getElementById('player');
+
+                function connect() {
+                    const ws = new WebSocket(WS_URL);
+                    ws.binaryType = 'arraybuffer';
+                    let sourceBuffer = null;
+                    const pending = [];
+
+                    function appendNext() {
+                        if (!sourceBuffer || sourceBuffer.updating || !pending.length) {
+                            return;
+                        }
+                        sourceBuffer.appendBuffer(pending.shift());
+                    }
+
+                    function followLiveEdge() {
+                        const buffered = video.buffered;
+                        if (!buffered.length) {
+                            return;
+                        }
+                        const end = buffered.end(buffered.length - 1);
+                        // Jump forward when playback drifts behind the newest fragment
+                        if (end - video.currentTime > 1.5) {
+                            video.currentTime = end - 0.3;
+                        }
+                        // Keep only a few seconds behind the playhead
+                        if (!sourceBuffer.updating && video.currentTime - buffered.start(0) > 10) {
+                            sourceBuffer.remove(0, video.currentTime - 5);
+                        }
+                    }
+
+                    ws.onmessage = (event) => {
+                        if (typeof event.data === 'string') {
+                            // Codec announcement: start a fresh MediaSource
+                            const info = JSON.parse(event.data);
+                            const mediaSource = new MediaSource();
+                            video.src = URL.createObjectURL(mediaSource);
+                            mediaSource.addEventListener('sourceopen', () => {
+                                sourceBuffer = mediaSource.addSourceBuffer(`video/mp4; codecs="${info.codec}"`);
+                                sourceBuffer.addEventListener('updateend', () => {
+                                    followLiveEdge();
+                                    appendNext();
+                                });
+                                appendNext();
+                            });
+                            return;
+                        }
+                        pending.push(event.data);
+                        appendNext();
+                    };
+                    // Dropped for being slow, or the encoder restarted: rejoin at the latest keyframe
+                    ws.onclose = () => setTimeout(connect, 1000);
+                }
+
+                connect();
+            </script>
+        </body>
+    </html>
+"""
+
+INDEX_HTML = """
     <html>
         <head>
-            <title>RTSP Stream</title>
+            <title>RTSP Stream - {{ cam }}</title>
             <style>
                 body { 
                     margin: 0; 
@@ -298,8 +927,9 @@ def index():
             </div>
             <div id="status"></div>
             <script>
+                const PLAYLIST_URL = '{{ playlist_url }}';
                 var player = new Clappr.Player({
-                    source: '/hls/playlist.m3u8',
+                    source: PLAYLIST_URL,
                     parentId: '#player',
                     width: '100%',
                     height: '100%',
@@ -361,30 +991,42 @@ def index():
                                 fragLoadingRetryDelay: 500
                             }
                         });
-                        player.load('/hls/playlist.m3u8');
+                        player.load(PLAYLIST_URL);
                     }, 1000);
                 });
 
-                // Update the stall detection in the HTML/JavaScript section
-                let lastPosition = 0;
-                let lastStallCheck = Date.now();
-                const STALL_THRESHOLD = 3000; // 3 seconds
-                const MIN_MOVEMENT = 0.1; // Minimum movement threshold
-
-                // Function to check if player is in loading state
-                function isPlayerLoading() {
-                    const loadingElement = document.querySelector('.player-loading');
-                    const bufferingElement = document.querySelector('.spinner-three-bounce');
-                    return (loadingElement && loadingElement.style.display !== 'none') || 
-                           (bufferingElement && bufferingElement.style.display !== 'none');
+                // Server-side health pushed over SSE: process state, newest segment
+                // and its age, encoder speed and viewers
+                let health = null;
+                let healthReceivedAt = 0;
+                let playerNote = '';
+                const STALE_SEGMENT_AGE = 5; // seconds
+
+                function segmentAge() {
+                    if (!health || health.segment_age === null) {
+                        return Infinity;
+                    }
+                    return health.segment_age + (Date.now() - healthReceivedAt) / 1000;
                 }
 
-                // Function to check if player is actually playing
-                function isActuallyPlaying() {
-                    return player && 
-                           player.isPlaying() && 
-                           !isPlayerLoading() && 
-                           player.getCurrentTime() > 0;
+                function renderStatus() {
+                    const status = document.getElementById('status');
+                    if (!health) {
+                        status.textContent = 'Stream status: connecting...';
+                        return;
+                    }
+                    const parts = [`Stream status: ${health.state}`];
+                    if (health.segment !== null) {
+                        parts.push(`segment ${health.segment} (${segmentAge().toFixed(1)} s ago)`);
+                    }
+                    if (health.speed !== null) {
+                        parts.push(`encoder ${health.speed}x` + (health.behind_realtime ? ' (behind real time)' : ''));
+                    }
+                    parts.push(`${health.viewers} viewer${health.viewers === 1 ? '' : 's'}`);
+                    if (playerNote) {
+                        parts.push(playerNote);
+                    }
+                    status.textContent = parts.join(', ');
                 }
 
                 let bufferingCount = 0;
@@ -393,99 +1035,90 @@ def index():
                 const MAX_BUFFERING_COUNT = 3; // Maximum allowed buffering occurrences
 
                 async function handleExcessiveBuffering() {
-                    console.log('Excessive buffering detected, restarting stream...');
-                    await controlStream('stop');
-                    setTimeout(async () => {
-                        await controlStream('start');
-                    }, 2000);
                     bufferingCount = 0;
-                }
-
-                setInterval(() => {
-                    // Reset buffering count if enough time has passed
-                    if (Date.now() - lastBufferingTime > BUFFERING_RESET_INTERVAL) {
-                        bufferingCount = 0;
+                    if (health && health.state === 'running' && segmentAge() < STALE_SEGMENT_AGE) {
+                        // The server is producing segments, so the problem is on this side
+                        console.log('Excessive buffering with fresh segments, reloading the player...');
+                        player.load(PLAYLIST_URL);
+                        return;
                     }
-
-                    if (isActuallyPlaying()) {
-                        const currentPosition = player.getCurrentTime();
-                        const currentTime = Date.now();
-                        const timeDiff = currentTime - lastStallCheck;
-                        
-                        if (timeDiff >= STALL_THRESHOLD) {
-                            if (Math.abs(currentPosition - lastPosition) < MIN_MOVEMENT) {
-                                document.getElementById('status').textContent = 'Stream status: Stream stopped or buffering';
-                            } else {
-                                document.getElementById('status').textContent = 'Stream status: running';
-                            }
-                            lastPosition = currentPosition;
-                            lastStallCheck = currentTime;
+                    console.log('Excessive buffering detected, asking the server to restart the stream...');
+                    try {
+                        // The server de-duplicates restarts across viewers
+                        const response = await fetch('/stream/{{ cam }}/restart', { method: 'POST' });
+                        const incident = await response.json();
+                        if (response.status === 202) {
+                            setTimeout(() => player.load(PLAYLIST_URL), 2000);
                         }
-                    } else if (player && !player.isPlaying()) {
-                        document.getElementById('status').textContent = 'Stream status: Stream stopped';
-                    } else if (isPlayerLoading()) {
-                         bufferingCount++;
-                    lastBufferingTime = Date.now();
-                    console.log('Buffering count:', bufferingCount);
-                    
-                    if (bufferingCount >= MAX_BUFFERING_COUNT) {
-                        document.getElementById('status').textContent = `Stream status: Buffering (Count: ${bufferingCount}) - Restarting stream due to excessive buffering...`;
-                        handleExcessiveBuffering();
-                    } else {
-                        document.getElementById('status').textContent = `Stream status: Buffering (Count: ${bufferingCount})`;
-                    }
+                        console.log('Restart incident:', incident);
+                    } catch (error) {
+                        console.error('Error:', error);
                     }
-                }, 1000);
-
-                player.on(Clappr.Events.PLAYBACK_PLAY, function() {
-                    lastPosition = player.getCurrentTime();
-                });
+                }
 
                 player.on(Clappr.Events.PLAYBACK_BUFFERING, function() {
+                    if (Date.now() - lastBufferingTime > BUFFERING_RESET_INTERVAL) {
+                        bufferingCount = 0;
+                    }
                     bufferingCount++;
                     lastBufferingTime = Date.now();
                     console.log('Buffering count:', bufferingCount);
-                    
+                    playerNote = `buffering (count: ${bufferingCount})`;
+                    renderStatus();
                     if (bufferingCount >= MAX_BUFFERING_COUNT) {
-                        document.getElementById('status').textContent = `Stream status: Buffering (Count: ${bufferingCount}) - Restarting stream due to excessive buffering...`;
                         handleExcessiveBuffering();
-                    } else {
-                        document.getElementById('status').textContent = `Stream status: Buffering (Count: ${bufferingCount})`;
                     }
                 });
 
                 player.on(Clappr.Events.PLAYBACK_BUFFERFULL, function() {
-                    document.getElementById('status').textContent = 'Stream status: running';
+                    playerNote = '';
+                    renderStatus();
                 });
 
                 player.on(Clappr.Events.PLAYBACK_STOP, function() {
-                    document.getElementById('status').textContent = 'Stream status: Stream stopped';
+                    playerNote = 'player stopped';
+                    renderStatus();
+                });
+
+                player.on(Clappr.Events.PLAYBACK_PLAY, function() {
+                    playerNote = '';
+                    renderStatus();
                 });
 
-                function updateButtons(status) {
-                    document.getElementById('startBtn').disabled = status === 'running';
-                    document.getElementById('stopBtn').disabled = status === 'stopped';
-                    document.getElementById('status').textContent = `Stream status: ${status}`;
+                function updateButtons(state) {
+                    document.getElementById('startBtn').disabled = state === 'running' || state === 'starting';
+                    document.getElementById('stopBtn').disabled = state === 'stopped';
+                }
+
+                async function waitForJob(url) {
+                    for (let attempt = 0; attempt < 3; attempt++) {
+                        const response = await fetch(url);
+                        const job = await response.json();
+                        if (job.state !== 'starting') {
+                            return job;
+                        }
+                    }
+                    throw new Error('Stream did not become ready');
                 }
 
                 async function controlStream(action) {
                     try {
-                        const response = await fetch(`/stream/${action}`, {
+                        const response = await fetch(`/stream/{{ cam }}/${action}`, {
                             method: 'POST'
                         });
                         const data = await response.json();
                         
                         if (response.ok) {
                             if (action === 'start') {
-                                // Wait for FFmpeg to start and create the playlist
-                                setTimeout(() => {
-                                    player.load('/hls/playlist.m3u8');
-                                }, 3000);
+                                // Wait until the server reports the first playlist
+                                if (data.state !== 'ready') {
+                                    await waitForJob(data.wait_url);
+                                }
+                                player.load(PLAYLIST_URL);
                             } else if (action === 'stop') {
                                 player.stop();
                             }
-                            // Only check status after successful response
-                            checkStatus();
+                            // The new state arrives on the event stream
                         } else {
                             console.error('Server error:', data.message);
                         }
@@ -494,29 +1127,36 @@ def index():
                     }
                 }
 
-                async function checkStatus() {
-                    try {
-                        const response = await fetch('/stream/status');
-                        const data = await response.json();
-                        updateButtons(data.status);
-                        
-                        // If stream is running but player is stopped, try to restart
-                        if (data.status === 'running' && !player.isPlaying()) {
-                            player.load('/hls/playlist.m3u8');
-                        }
-                    } catch (error) {
-                        console.error('Error:', error);
+                const events = new EventSource('/stream/{{ cam }}/events');
+                events.addEventListener('state', function(event) {
+                    const previous = health;
+                    health = JSON.parse(event.data);
+                    healthReceivedAt = Date.now();
+                    updateButtons(health.state);
+                    // Load the player whenever the stream (re)appears
+                    if (health.state === 'running' && (!previous || previous.state !== 'running') && !player.isPlaying()) {
+                        player.load(PLAYLIST_URL);
                     }
-                }
-
-                // Check status more frequently initially, then less frequently
-                checkStatus();
-                setInterval(checkStatus, 5000);
+                    renderStatus();
+                });
+                // EventSource reconnects on its own
+                events.onerror = function() {
+                    document.getElementById('status').textContent = 'Stream status: reconnecting...';
+                };
+                // Only ages the segment shown; no requests
+                setInterval(renderStatus, 1000);
+                renderStatus();
             </script>
         </body>
     </html>
-    """
+"""
 
 if __name__ == '__main__':
-    start_ffmpeg()
-    app.run(host='0.0.0.0', port=8083)
+    # Bind the sockets before FFmpeg starts so its first PUT to /ingest succeeds
+    server = make_server(BIND_HOST, HTTP_PORT, app, threaded=True)
+    serve_ingest()
+    # Exit cleanly on SIGTERM (docker stop) so atexit stops FFmpeg
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    pipelines.start_all()
+    watchdog.start()
+    server.serve_forever()
@@ -0,0 +1,97 @@
+"""Build a 7-day DVR index and time range lookups against it.
+
+Appends `--days` of `--segment`-second segments to a DvrStore in a scratch
+directory (tiny payloads, so the index dominates), reopens it the way a
+restarted server would, then times VOD playlist lookups for random ranges.
+A linear scan over every record is timed alongside for comparison.
+
+    python benchmarks/dvr_index.py --days 7 --segment 1 --lookups 1000
+"""
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dvr import RECORD, DvrStore  # noqa: E402
+
+
+def linear_lookup(store, start, end):
+    start_ms, end_ms = round(start * 1000), round(end * 1000)
+    found = []
+    for chunk in store._chunks:
+        for i in range(chunk.count):
+            record = chunk.record(i)
+            if record[0] < end_ms and record[0] + record[1] > start_ms:
+                found.append(record)
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--days', type=float, default=7)
+    parser.add_argument('--segment', type=float, default=1.0, help='segment duration, s')
+    parser.add_argument('--payload', type=int, default=188, help='bytes per segment')
+    parser.add_argument('--lookups', type=int, default=1000)
+    parser.add_argument('--linear', type=int, default=5, help='linear-scan lookups to compare against')
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='dvr-bench-')
+    try:
+        span = args.days * 86400
+        origin = time.time() - span
+        count = int(span / args.segment)
+        payload = b'\x47' * args.payload
+        store = DvrStore(root, max_age=span + 3600)
+        started = time.perf_counter()
+        for i in range(count):
+            store.append(payload, args.segment, now=origin + (i + 1) * args.segment)
+        build = time.perf_counter() - started
+        store.close()
+        index_bytes = sum(os.path.getsize(os.path.join(root, name)) for name in os.listdir(root)
+                          if name.endswith('.idx'))
+        print(f"built {count} segments in {build:.1f}s ({count / build:.0f} appends/s), "
+              f"index {index_bytes / 1e6:.1f} MB ({RECORD.size} B/segment)")
+
+        started = time.perf_counter()
+        store = DvrStore(root, max_age=span + 3600)
+        info = store.info()
+        print(f"reopened {info['chunks']} chunks in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+        print(f"\n{'range':>8} {'segments':>9} {'lookup us':>10} {'p99 us':>8} {'playlist ms':>12}")
+        for width in (60, 3600, 6 * 3600):
+            lookups, renders, sizes = [], [], []
+            for _ in range(args.lookups):
+                start = origin + random.uniform(0, span - width)
+                t = time.perf_counter()
+                entries = store.lookup(start, start + width)
+                lookups.append((time.perf_counter() - t) * 1e6)
+                sizes.append(len(entries))
+            for _ in range(max(1, args.lookups // 20)):
+                start = origin + random.uniform(0, span - width)
+                t = time.perf_counter()
+                store.playlist(start, start + width, lambda chunk: f'chunks/{chunk}.ts')
+                renders.append((time.perf_counter() - t) * 1000)
+            lookups.sort()
+            print(f"{width:>7}s {statistics.mean(sizes):>9.0f} {statistics.median(lookups):>10.0f} "
+                  f"{lookups[int(len(lookups) * 0.99)]:>8.0f} {statistics.median(renders):>12.1f}")
+
+        times = []
+        for _ in range(args.linear):
+            start = origin + random.uniform(0, span - 60)
+            t = time.perf_counter()
+            linear_lookup(store, start, start + 60)
+            times.append((time.perf_counter() - t) * 1e6)
+        print(f"\nlinear scan of every record for a 60s range: {statistics.median(times):.0f} us")
+        store.close()
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
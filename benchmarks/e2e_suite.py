@@ -0,0 +1,328 @@
+"""Hermetic end-to-end benchmark: stand-in camera, FFmpeg, Flask and viewers.
+
+Starts the RTSP stand-in from rtsp_standin.py, points `--cameras` cameras at
+it through a temporary CAMERAS_CONFIG and serves the app on a local port, so
+nothing outside this machine is touched. Then it measures:
+
+- start_to_first_playlist_s: start_ffmpeg() until the first playlist exists,
+  over `--starts` stop/start cycles of the first camera
+- encoder: speed and fps from /stream/<cam>/status, and FFmpeg CPU (% of one
+  core) per camera over the measurement window
+- glass_to_glass_s: age of the newest frame in each new segment of the first
+  camera when a viewer finishes downloading it; the frame number burned into
+  the test pattern is decoded and matched with the time the stand-in sent it.
+  The player's own hold-back comes on top.
+- serve_hls: requests/s, Mbit/s and latency of `--viewers` threads looping
+  over "fetch playlist, fetch newest segment", with the encoder and
+  glass-to-glass figures repeated under that load
+
+The app's usual environment (HLS_STORAGE, HLS_MODE, STREAM_MODE,
+ABR_LADDER, ...) applies, so configurations can be compared. Results are
+printed as JSON; --output saves them and --compare prints the change against
+an earlier file:
+
+    python benchmarks/e2e_suite.py --cameras 2 --viewers 50 --output e2e.json
+    HLS_STORAGE=disk python benchmarks/e2e_suite.py --cameras 2 --viewers 50 --compare e2e.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARKS)
+sys.path.insert(0, ROOT)
+
+from rtsp_standin import BLOCK, RtspStandIn, read_frame_number  # noqa: E402
+
+
+def request(url):
+    try:
+        with urllib.request.urlopen(url, timeout=30) as resp:
+            return resp.status, resp.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+def distribution(values):
+    if not values:
+        return {'samples': 0, 'median': None, 'p90': None, 'min': None, 'max': None}
+    values = sorted(values)
+    return {
+        'samples': len(values),
+        'median': round(statistics.median(values), 4),
+        'p90': round(values[min(len(values) - 1, int(len(values) * 0.9))], 4),
+        'min': round(values[0], 4),
+        'max': round(values[-1], 4),
+    }
+
+
+def newest_segment(text):
+    uris = [line for line in text.splitlines() if line and not line.startswith('#')]
+    return uris[-1] if uris else None
+
+
+def newest_frame_number(data, width, height):
+    """Burned-in number of the last frame of an MPEG-TS segment, or None."""
+    result = subprocess.run([
+        'ffmpeg', '-hide_banner', '-loglevel', 'error', '-f', 'mpegts', '-i', 'pipe:0',
+        '-vf', f'scale={width}:{height},crop={width}:{BLOCK}:0:0,format=gray',
+        '-f', 'rawvideo', 'pipe:1'
+    ], input=data, capture_output=True)
+    strip = width * BLOCK
+    if len(result.stdout) < strip:
+        return None
+    return read_frame_number(result.stdout[-strip:], width)
+
+
+def process_cpu_seconds(pid):
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+class GlassToGlass(threading.Thread):
+    """Watch one camera's playlist and time every new segment's newest frame."""
+
+    def __init__(self, base, playlist, camera, deadline):
+        super().__init__(daemon=True, name='e2e-glass')
+        self.base = base
+        self.playlist = playlist
+        self.camera = camera
+        self.deadline = deadline
+        self.latencies = []
+        self.undecoded = 0
+
+    def run(self):
+        seen = None
+        while time.time() < self.deadline:
+            status, body = request(f'{self.base}/{self.playlist}')
+            segment = newest_segment(body.decode(errors='replace')) if status == 200 else None
+            if segment is None or segment == seen:
+                time.sleep(0.02)
+                continue
+            seen = segment
+            directory = os.path.dirname(self.playlist)
+            status, data = request(f'{self.base}/{os.path.join(directory, segment)}')
+            arrived = time.time()
+            if status != 200:
+                continue
+            number = newest_frame_number(data, self.camera.width, self.camera.height)
+            sent = self.camera.frame_time(number) if number is not None else None
+            if sent is None:
+                self.undecoded += 1
+                continue
+            self.latencies.append(arrived - sent)
+
+
+def viewer(base, playlist, deadline, latencies, sizes, errors):
+    directory = os.path.dirname(playlist)
+    segment = None
+    while time.time() < deadline:
+        for path in (playlist, segment):
+            if path is None:
+                continue
+            started = time.perf_counter()
+            status, body = request(f'{base}/{path}')
+            if status != 200:
+                errors.append(status)
+                continue
+            latencies.append(time.perf_counter() - started)
+            sizes.append(len(body))
+            if path == playlist:
+                newest = newest_segment(body.decode(errors='replace'))
+                segment = os.path.join(directory, newest) if newest else None
+
+
+def steady_state(app_module, base, camera, duration, viewers):
+    """Encoder, CPU and glass-to-glass figures over `duration` s with `viewers` viewers."""
+    pipelines = list(app_module.pipelines.pipelines.values())
+    first = pipelines[0]
+    playlist = f"{first.ladder[0]['name']}/playlist.m3u8" if first.ladder else 'playlist.m3u8'
+    cpu_before = {p.name: process_cpu_seconds(p.process.pid) for p in pipelines if p.is_running()}
+    started = time.time()
+    deadline = started + duration
+    glass = GlassToGlass(f'{base}/hls/{first.name}', playlist, camera, deadline)
+    glass.start()
+    latencies, sizes, errors = [], [], []
+    threads = [threading.Thread(target=viewer, args=(f'{base}/hls/{first.name}', playlist, deadline,
+                                                     latencies, sizes, errors))
+               for _ in range(viewers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    glass.join()
+    elapsed = time.time() - started
+
+    speeds, fps, cpu = [], [], []
+    for pipeline in pipelines:
+        status, body = request(f'{base}/stream/{pipeline.name}/status')
+        encoder = json.loads(body).get('encoder') if status == 200 else None
+        if encoder and encoder['avg_speed'] is not None:
+            speeds.append(encoder['avg_speed'])
+        if encoder and encoder['latest'] and encoder['latest'].get('fps') is not None:
+            fps.append(encoder['latest']['fps'])
+        before = cpu_before.get(pipeline.name)
+        after = process_cpu_seconds(pipeline.process.pid) if pipeline.is_running() else None
+        if before is not None and after is not None:
+            cpu.append(100 * (after - before) / elapsed)
+    result = {
+        'encoder_speed': round(statistics.mean(speeds), 3) if speeds else None,
+        'encoder_fps': round(statistics.mean(fps), 1) if fps else None,
+        'cpu_percent_per_camera': round(statistics.mean(cpu), 1) if cpu else None,
+        'cameras_running': sum(1 for p in pipelines if p.is_running()),
+        'glass_to_glass_s': distribution(glass.latencies),
+        'undecoded_segments': glass.undecoded,
+    }
+    if viewers:
+        latencies.sort()
+        result['serve_hls'] = {
+            'viewers': viewers,
+            'requests_per_s': round(len(latencies) / elapsed, 1),
+            'mbit_per_s': round(sum(sizes) * 8 / elapsed / 1e6, 1),
+            'median_ms': round(statistics.median(latencies) * 1000, 2) if latencies else None,
+            'p99_ms': round(latencies[max(0, int(len(latencies) * 0.99) - 1)] * 1000, 2) if latencies else None,
+            'errors': len(errors),
+        }
+    return result
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    try:
+        ffmpeg = subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True).stdout.splitlines()[0]
+    except (OSError, IndexError):
+        ffmpeg = None
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'ffmpeg': ffmpeg,
+    }
+
+
+def flatten(data, prefix=''):
+    values = {}
+    for key, value in data.items():
+        name = f'{prefix}{key}'
+        if isinstance(value, dict):
+            values.update(flatten(value, f'{name}.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[name] = value
+    return values
+
+
+def compare(baseline, current):
+    old, new = flatten(baseline['results']), flatten(current['results'])
+    print(f"{'metric':<45} {'baseline':>10} {'current':>10} {'change':>8}", file=sys.stderr)
+    for name, value in new.items():
+        before = old.get(name)
+        change = f'{100 * (value - before) / before:+.0f}%' if before else ''
+        before = '' if before is None else f'{before:g}'
+        print(f'{name:<45} {before:>10} {value:>10g} {change:>8}', file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cameras', type=int, default=1)
+    parser.add_argument('--size', default='1280x720', help='stand-in camera resolution')
+    parser.add_argument('--fps', type=int, default=15, help='stand-in camera frame rate')
+    parser.add_argument('--gop', type=float, default=2.0, help='stand-in keyframe interval, s')
+    parser.add_argument('--starts', type=int, default=3, help='stop/start cycles timed')
+    parser.add_argument('--warmup', type=float, default=5, help='seconds before measuring')
+    parser.add_argument('--duration', type=float, default=15, help='seconds per measurement window')
+    parser.add_argument('--viewers', type=int, default=20)
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='e2e-bench-')
+    camera = RtspStandIn(args.size, args.fps, args.gop).start()
+    server = None
+    try:
+        config = os.path.join(workdir, 'cameras.json')
+        with open(config, 'w') as f:
+            json.dump({'cameras': {f'cam{i}': {'url': camera.url} for i in range(args.cameras)}}, f)
+        # FFmpeg PUTs memory-mode segments to HTTP_PORT, so it must be known up front
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        os.environ.update(
+            HTTP_PORT=str(port),
+            CAMERAS_CONFIG=config,
+            HLS_ROOT=os.path.join(workdir, 'hls'),
+            DVR_ROOT=os.path.join(workdir, 'dvr'),
+            PROBE_CACHE=os.path.join(workdir, 'probe_cache.json'),
+        )
+        import app as app_module
+        from werkzeug.serving import make_server
+        for name in ('', 'werkzeug'):
+            logging.getLogger(name).setLevel(logging.WARNING)
+        server = make_server('127.0.0.1', port, app_module.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base = f'http://127.0.0.1:{port}'
+
+        first = next(iter(app_module.pipelines.pipelines))
+        starts = []
+        for _ in range(args.starts):
+            app_module.stop_ffmpeg(first)
+            started = time.perf_counter()
+            if app_module.start_ffmpeg(first):
+                starts.append(time.perf_counter() - started)
+        for name in app_module.pipelines.pipelines:
+            app_module.start_ffmpeg(name)
+        time.sleep(args.warmup)
+
+        results = {
+            'start_to_first_playlist_s': {**distribution(starts), 'failed': args.starts - len(starts)},
+            'idle': steady_state(app_module, base, camera, args.duration, 0),
+            'loaded': steady_state(app_module, base, camera, args.duration, args.viewers),
+        }
+        settings = app_module.pipelines.get(first).settings
+        report = {
+            'environment': environment(),
+            'config': {
+                **{k: v for k, v in vars(args).items() if k not in ('output', 'compare')},
+                **{k: settings[k] for k in ('storage', 'hls_mode', 'stream_mode', 'ladder')},
+            },
+            'results': results,
+        }
+    finally:
+        if server is not None:
+            app_module.pipelines.stop_all()
+            server.shutdown()
+        camera.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == '__main__':
+    main()
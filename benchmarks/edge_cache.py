@@ -0,0 +1,169 @@
+"""Supervisor load behind an edge worker: plain forwarding versus EdgeCache.
+
+A stand-in supervisor publishes a new one-second segment every second and
+answers like the real one: playlists `public, max-age=1`, segments
+`immutable`, each after `--upstream-ms` of work. An edge worker in front of
+it either forwards every request (what edge workers did for in-memory HLS)
+or goes through EdgeCache. Each simulated viewer reloads the playlist once a
+target duration and fetches every new segment once, like hls.js. The script
+reports the requests and bytes that reached the supervisor and the latency
+viewers saw.
+
+    python benchmarks/edge_cache.py --viewers 50 200 --duration 20
+"""
+import argparse
+import logging
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, request  # noqa: E402
+from werkzeug.serving import make_server  # noqa: E402
+
+from edge import EdgeCache, SupervisorProxy  # noqa: E402
+from segment_store import CachedFile  # noqa: E402
+
+RUN = 'bench'
+
+
+class StandInSupervisor(BaseHTTPRequestHandler):
+    """Live playlist of the last three segments, one new segment a second."""
+
+    protocol_version = 'HTTP/1.1'
+    started = time.time()
+    segment_size = 250 * 1024
+    delay = 0.002
+    requests = 0
+    bytes = 0
+    lock = threading.Lock()
+
+    @classmethod
+    def newest(cls):
+        return int(time.time() - cls.started)
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        newest = self.newest()
+        if self.path.endswith('playlist.m3u8'):
+            first = max(0, newest - 2)
+            lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:1', f'#EXT-X-MEDIA-SEQUENCE:{first}']
+            for n in range(first, newest + 1):
+                lines += ['#EXTINF:1.000000,', f'segment_{RUN}_{n:03d}.ts']
+            item = CachedFile('playlist.m3u8', ('\n'.join(lines) + '\n').encode())
+            cache_control = 'public, max-age=1'
+        else:
+            n = int(self.path.rsplit('_', 1)[1].split('.')[0])
+            item = CachedFile(self.path, n.to_bytes(4, 'big') * (self.segment_size // 4))
+            cache_control = 'public, max-age=31536000, immutable'
+        with self.lock:
+            StandInSupervisor.requests += 1
+            StandInSupervisor.bytes += len(item.data)
+        self.send_response(200)
+        self.send_header('Content-Type', item.content_type)
+        self.send_header('Content-Length', str(len(item.data)))
+        self.send_header('ETag', item.etag)
+        self.send_header('Cache-Control', cache_control)
+        self.end_headers()
+        self.wfile.write(item.data)
+
+    def log_message(self, *args):
+        pass
+
+
+def edge_app(proxy, cache):
+    app = Flask(__name__)
+
+    @app.route('/hls/<cam>/<path:filename>')
+    def serve_hls(cam, filename):
+        return cache.get(request) if cache is not None else proxy.forward(request)
+
+    return app
+
+
+def viewer(base, deadline, latencies, errors):
+    fetched = set()
+    # Players join at different moments, so reloads are spread out
+    time.sleep(random.uniform(0, 1))
+    while time.time() < deadline:
+        reload_at = started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(f'{base}/playlist.m3u8', timeout=30) as resp:
+                segments = [line for line in resp.read().decode().splitlines() if line.endswith('.ts')]
+            latencies.append(time.perf_counter() - started)
+            # A joining player starts at the newest segment, then follows the playlist
+            for name in segments if fetched else segments[-1:]:
+                if name in fetched:
+                    continue
+                started = time.perf_counter()
+                with urllib.request.urlopen(f'{base}/{name}', timeout=30) as resp:
+                    resp.read()
+                latencies.append(time.perf_counter() - started)
+                fetched.add(name)
+        except (OSError, urllib.error.URLError):
+            errors.append(1)
+        time.sleep(max(0.0, 1 - (time.perf_counter() - reload_at)))
+
+
+def run(base, viewers, duration):
+    StandInSupervisor.requests = StandInSupervisor.bytes = 0
+    deadline = time.time() + duration
+    latencies, errors = [], []
+    threads = [threading.Thread(target=viewer, args=(base, deadline, latencies, errors), daemon=True)
+               for _ in range(viewers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'upstream': StandInSupervisor.requests,
+        'upstream_mb': StandInSupervisor.bytes / 1e6,
+        'median_ms': statistics.median(latencies) * 1000 if latencies else float('nan'),
+        'p99_ms': latencies[int(len(latencies) * 0.99)] * 1000 if latencies else float('nan'),
+        'errors': len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--viewers', type=int, nargs='+', default=[50, 200])
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--segment-kb', type=int, default=250, help='roughly one second at 2 Mbit/s')
+    parser.add_argument('--upstream-ms', type=float, default=2, help='supervisor time per request')
+    args = parser.parse_args()
+
+    random.seed(1)
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    StandInSupervisor.segment_size = args.segment_kb * 1024
+    StandInSupervisor.delay = args.upstream_ms / 1000
+    upstream = ThreadingHTTPServer(('127.0.0.1', 0), StandInSupervisor)
+    upstream.daemon_threads = True
+    threading.Thread(target=upstream.serve_forever, daemon=True).start()
+    proxy = SupervisorProxy(f'http://127.0.0.1:{upstream.server_address[1]}')
+
+    print(f"{'viewers':>8} {'edge':>8} {'requests':>9} {'upstream':>9} {'upstream MB':>12} "
+          f"{'median ms':>10} {'p99 ms':>8} {'errors':>7}")
+    for viewers in args.viewers:
+        for name in ('forward', 'cache'):
+            cache = EdgeCache(proxy) if name == 'cache' else None
+            server = make_server('127.0.0.1', 0, edge_app(proxy, cache), threaded=True)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            result = run(f'http://127.0.0.1:{server.server_port}/hls/default', viewers, args.duration)
+            server.shutdown()
+            print(f"{viewers:>8} {name:>8} {result['requests']:>9} {result['upstream']:>9} "
+                  f"{result['upstream_mb']:>12.1f} {result['median_ms']:>10.1f} {result['p99_ms']:>8.1f} "
+                  f"{result['errors']:>7}")
+    upstream.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""Compare disk and memory HLS delivery under concurrent viewers.
+
+Every simulated viewer loops over "fetch playlist, fetch newest segment" the
+way hls.js does for a live stream. Run from the repository root:
+
+    python benchmarks/hls_serving.py --viewers 50 200 --duration 10
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('ONVIF_USERNAME', 'bench')
+os.environ.setdefault('ONVIF_PASSWORD', 'bench')
+os.environ.setdefault('ONVIF_IP', '127.0.0.1')
+
+from werkzeug.serving import make_server  # noqa: E402
+
+import app as app_module  # noqa: E402
+
+SEGMENT_COUNT = 3
+SEGMENT_SIZE = 250 * 1024  # roughly one second at 2 Mbit/s
+
+
+def build_fixture(pipeline):
+    hls_dir = pipeline.hls_dir
+    playlist = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:1',
+                '#EXT-X-MEDIA-SEQUENCE:0']
+    os.makedirs(hls_dir, exist_ok=True)
+    for i in range(SEGMENT_COUNT):
+        name = f'segment_{i:03d}.ts'
+        data = os.urandom(SEGMENT_SIZE)
+        with open(os.path.join(hls_dir, name), 'wb') as f:
+            f.write(data)
+        pipeline.ring.put(name, data)
+        playlist += ['#EXTINF:1.000000,', name]
+    body = ('\n'.join(playlist) + '\n').encode()
+    with open(os.path.join(hls_dir, 'playlist.m3u8'), 'wb') as f:
+        f.write(body)
+    pipeline.ring.put('playlist.m3u8', body)
+
+
+def viewer(base, deadline, latencies, errors):
+    base = f'{base}/hls/{app_module.pipelines.default.name}'
+    segment = f'segment_{SEGMENT_COUNT - 1:03d}.ts'
+    while time.time() < deadline:
+        for path in ('playlist.m3u8', segment):
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(f'{base}/{path}', timeout=10) as resp:
+                    resp.read()
+            except Exception:
+                errors.append(path)
+                continue
+            latencies.append(time.perf_counter() - started)
+
+
+def run(storage, viewers, duration, port):
+    app_module.pipelines.default.storage = storage
+    latencies, errors = [], []
+    deadline = time.time() + duration
+    threads = [
+        threading.Thread(target=viewer, args=(f'http://127.0.0.1:{port}', deadline, latencies, errors))
+        for _ in range(viewers)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1] if latencies else 0.0
+    return {
+        'storage': storage,
+        'viewers': viewers,
+        'requests': len(latencies),
+        'errors': len(errors),
+        'req_per_sec': len(latencies) / duration,
+        'p50_ms': statistics.median(latencies) * 1000 if latencies else 0.0,
+        'p99_ms': p99 * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--viewers', type=int, nargs='+', default=[50, 200])
+    parser.add_argument('--duration', type=float, default=10.0)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='hls-bench-')
+    os.chdir(workdir)
+    # send_from_directory resolves static/hls/<camera> against the app root
+    app_module.app.root_path = workdir
+    build_fixture(app_module.pipelines.default)
+
+    server = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    print(f"{'storage':<8} {'viewers':>7} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'errors':>6}")
+    for viewers in args.viewers:
+        for storage in ('disk', 'memory'):
+            r = run(storage, viewers, args.duration, server.server_port)
+            print(f"{r['storage']:<8} {r['viewers']:>7} {r['req_per_sec']:>9.1f} "
+                  f"{r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f} {r['errors']:>6}")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+"""PTZ command round-trip latency and joystick coalescing against a fake camera.
+
+A local ONVIF PTZ endpoint stands in for the camera. It answers every SOAP
+request after `--delay` ms and charges `--connect-delay` ms for every new
+TCP connection, the handshake and accept cost a Wi-Fi camera adds.
+Round trips are measured for a new connection per command (the README's
+curl examples) and for the keep-alive PtzClient. The joystick test then
+sends ContinuousMove at `--rate` Hz and reports how stale the camera's
+velocity is when input stops, with the coalescing mailbox and with a plain
+FIFO of every move. Finally `--readers` threads poll the PTZ status for a few
+seconds, straight from the camera and from the PtzState cache, and the
+requests (and most parallel ones) the camera had to answer are counted.
+
+    python benchmarks/ptz_latency.py --commands 200 --delay 20 --connect-delay 30 --rate 60 --readers 50
+"""
+import argparse
+import os
+import queue
+import re
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ptz import PtzClient  # noqa: E402
+
+OPERATION = re.compile(rb'<(\w+) xmlns="http://www.onvif.org/ver20/ptz/wsdl">')
+VELOCITY_X = re.compile(rb'<Velocity><PanTilt [^>]*x="([-\d.]+)"')
+RESPONSE = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<s:Envelope xmlns:s="http://www.w3.org/2003/05/soap-envelope" '
+    'xmlns:tptz="http://www.onvif.org/ver20/ptz/wsdl" xmlns:tt="http://www.onvif.org/ver10/schema">'
+    '<s:Body>{}</s:Body></s:Envelope>'
+)
+BODIES = {
+    'GetStatus': '<tptz:GetStatusResponse><tptz:PTZStatus><tt:Position>'
+                 '<tt:PanTilt x="0.1" y="-0.2"/><tt:Zoom x="0"/></tt:Position>'
+                 '<tt:MoveStatus><tt:PanTilt>IDLE</tt:PanTilt><tt:Zoom>IDLE</tt:Zoom></tt:MoveStatus>'
+                 '</tptz:PTZStatus></tptz:GetStatusResponse>',
+    'GetPresets': '<tptz:GetPresetsResponse><tptz:Preset token="1"><tt:Name>Door</tt:Name>'
+                  '</tptz:Preset></tptz:GetPresetsResponse>',
+    'SetPreset': '<tptz:SetPresetResponse><tptz:PresetToken>2</tptz:PresetToken></tptz:SetPresetResponse>',
+}
+
+
+class FakeCamera(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, delay, connect_delay):
+        self.delay = delay
+        self.connect_delay = connect_delay
+        self.connections = 0
+        self.requests = 0
+        self.inflight = 0
+        self.max_inflight = 0
+        self.lock = threading.Lock()
+        # (monotonic time, x) of every ContinuousMove the camera acted on
+        self.velocities = []
+        super().__init__(('127.0.0.1', 0), FakeCameraHandler)
+
+
+class FakeCameraHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body in one segment; separate writes stall on delayed ACKs
+    wbufsize = 64 * 1024
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+        time.sleep(self.server.connect_delay)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            server.inflight += 1
+            server.max_inflight = max(server.max_inflight, server.inflight)
+        time.sleep(server.delay)
+        with server.lock:
+            server.inflight -= 1
+        op = OPERATION.search(body).group(1).decode()
+        velocity = VELOCITY_X.search(body)
+        if velocity:
+            self.server.velocities.append((time.monotonic(), float(velocity.group(1))))
+        data = RESPONSE.format(BODIES.get(op, f'<tptz:{op}Response/>')).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/soap+xml; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def round_trips(camera, commands, keep_alive):
+    port = camera.server_address[1]
+    client = PtzClient('127.0.0.1', 'admin', 'password', port=port)
+    ops = [lambda: client.call('Stop'), client.get_status, lambda: client.relative_move(0.1, 0.0)]
+    times = []
+    for index in range(commands):
+        if not keep_alive:
+            client.close()
+        started = time.perf_counter()
+        ops[index % len(ops)]()
+        times.append((time.perf_counter() - started) * 1000)
+    client.close()
+    return times
+
+
+def joystick(camera, rate, duration, coalesce):
+    """Sweep x from -1 to 1 at `rate` Hz; return (sent, lag_ms) once input stops."""
+    port = camera.server_address[1]
+    client = PtzClient('127.0.0.1', 'admin', 'password', port=port)
+    camera.velocities.clear()
+    fifo = queue.Queue()
+    if not coalesce:
+        def drain():
+            while True:
+                x = fifo.get()
+                if x is None:
+                    return
+                client.call('ContinuousMove', x, 0.0)
+        sender = threading.Thread(target=drain, daemon=True)
+        sender.start()
+    count = int(rate * duration)
+    for index in range(count):
+        x = round(-1 + 2 * index / (count - 1), 3)
+        if coalesce:
+            client.continuous_move(x, 0.0)
+        else:
+            fifo.put(x)
+        time.sleep(1 / rate)
+    released = time.monotonic()
+    final = x
+    deadline = released + 60
+    while time.monotonic() < deadline:
+        if camera.velocities and camera.velocities[-1][1] == final:
+            break
+        time.sleep(0.001)
+    if not coalesce:
+        fifo.put(None)
+    client.close()
+    return len(camera.velocities), (camera.velocities[-1][0] - released) * 1000
+
+
+def readers(camera, count, duration, cached):
+    """`count` threads reading the status for `duration` s; return (reads, camera requests, peak parallel)."""
+    port = camera.server_address[1]
+    client = PtzClient('127.0.0.1', 'admin', 'password', port=port)
+    clients = [client] if cached else [PtzClient('127.0.0.1', 'admin', 'password', port=port) for _ in range(count)]
+    if cached:
+        client.state.read(timeout=5)
+    with camera.lock:
+        camera.requests = camera.max_inflight = 0
+    reads = []
+    deadline = time.monotonic() + duration
+
+    def read(own):
+        done = 0
+        while time.monotonic() < deadline:
+            if cached:
+                client.state.read()
+                # A UI polling as fast as it can
+                time.sleep(0.01)
+            else:
+                own.get_status()
+            done += 1
+        reads.append(done)
+
+    threads = [threading.Thread(target=read, args=(clients[index % len(clients)],)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for own in clients:
+        own.close()
+    return sum(reads), camera.requests, camera.max_inflight
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--commands', type=int, default=200)
+    parser.add_argument('--delay', type=float, default=20, help='camera processing time per command, ms')
+    parser.add_argument('--connect-delay', type=float, default=30, help='cost of a new connection, ms')
+    parser.add_argument('--rate', type=float, default=60, help='joystick update rate, Hz')
+    parser.add_argument('--duration', type=float, default=2.0, help='joystick hold time, s')
+    parser.add_argument('--readers', type=int, default=50, help='concurrent status readers')
+    args = parser.parse_args()
+
+    camera = FakeCamera(args.delay / 1000, args.connect_delay / 1000)
+    threading.Thread(target=camera.serve_forever, daemon=True).start()
+
+    print(f"{'connection':>11} {'median ms':>10} {'p99 ms':>8} {'connects':>9}")
+    for keep_alive in (False, True):
+        before = camera.connections
+        times = round_trips(camera, args.commands, keep_alive)
+        print(f"{'keep-alive' if keep_alive else 'per command':>11} {statistics.median(times):>10.1f} "
+              f"{percentile(times, 0.99):>8.1f} {camera.connections - before:>9}")
+
+    print(f"\n{'joystick':>11} {'issued':>7} {'sent':>6} {'lag ms':>8}")
+    issued = int(args.rate * args.duration)
+    for coalesce in (False, True):
+        sent, lag = joystick(camera, args.rate, args.duration, coalesce)
+        print(f"{'coalesced' if coalesce else 'fifo':>11} {issued:>7} {sent:>6} {lag:>8.0f}")
+
+    print(f"\n{'status':>11} {'reads':>7} {'camera':>7} {'parallel':>9}")
+    for cached in (False, True):
+        reads, requests, parallel = readers(camera, args.readers, 3.0, cached)
+        print(f"{'cached' if cached else 'direct':>11} {reads:>7} {requests:>7} {parallel:>9}")
+    camera.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,294 @@
+"""A local stand-in for the camera: an FFmpeg test pattern served over RTSP.
+
+FFmpeg encodes `testsrc2` with the frame number burned into the top-left
+corner as a row of black and white blocks (bit k is the 16-pixel block at
+x = 16k), and sends RTP to a local UDP port. A small RTSP server answers
+OPTIONS/DESCRIBE/SETUP/PLAY and relays those packets to every client over
+the RTSP connection (interleaved TCP, what the app asks cameras for), so no
+media server has to be installed. The wall-clock time at which each frame
+left the "camera" is kept, so a viewer that reads the number back from a
+decoded frame knows how old it is.
+
+Run on its own to point a development server at it:
+
+    python benchmarks/rtsp_standin.py --port 8554 --size 1280x720 --fps 15
+    # rtsp://127.0.0.1:8554/live
+"""
+import argparse
+import os
+import socket
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+# Bits of the burned-in frame number and the size of one block
+FRAME_BITS = 24
+BLOCK = 16
+RTP_CLOCK = 90000
+
+
+def pattern_source(size, fps):
+    """lavfi graph: testsrc2 with the frame number as a FRAME_BITS block strip."""
+    strip = (f"color=c=black:s={FRAME_BITS * BLOCK}x{BLOCK}:r={fps},format=gray,"
+             f"geq=lum='255*gt(bitand(N,pow(2,trunc(X/{BLOCK}))),0)'")
+    return f"testsrc2=s={size}:r={fps}[base];{strip}[bits];[base][bits]overlay=0:0[out0]"
+
+
+def read_frame_number(strip, width):
+    """Frame number from the top BLOCK rows of a grayscale frame `width` pixels wide."""
+    row = (BLOCK // 2) * width
+    number = 0
+    for bit in range(FRAME_BITS):
+        if strip[row + bit * BLOCK + BLOCK // 2] > 128:
+            number |= 1 << bit
+    return number
+
+
+class RtspStandIn:
+    """Test-pattern camera on rtsp://127.0.0.1:<port>/live."""
+
+    def __init__(self, size='1280x720', fps=15, gop=2.0, bitrate='2M', port=0, history=100000):
+        self.size = size
+        self.width, self.height = (int(v) for v in size.split('x'))
+        self.fps = fps
+        self.gop = gop
+        self.bitrate = bitrate
+        self.history = history
+        self.process = None
+        self.sdp = None
+        self.clients = []
+        self.frames = 0
+        # Frame number -> wall-clock time its first packet was relayed
+        self.sent = OrderedDict()
+        self._lock = threading.Lock()
+        # Replies and relayed packets share each client's connection
+        self._send_lock = threading.Lock()
+        self._first_ts = None
+        self._last_ts = None
+        self._stopped = threading.Event()
+        self._server = socket.create_server(('127.0.0.1', port))
+        self.port = self._server.getsockname()[1]
+        self.url = f'rtsp://127.0.0.1:{self.port}/live'
+        # RTP on an even port and RTCP on the next one
+        self._rtp, self._rtcp = self._bind_pair()
+
+    @staticmethod
+    def _bind_pair():
+        for _ in range(100):
+            rtp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            rtp.bind(('127.0.0.1', 0))
+            port = rtp.getsockname()[1]
+            if port % 2 == 0:
+                rtcp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                try:
+                    rtcp.bind(('127.0.0.1', port + 1))
+                    return rtp, rtcp
+                except OSError:
+                    rtcp.close()
+            rtp.close()
+        raise RuntimeError("No free RTP port pair")
+
+    def start(self, timeout=10):
+        rtp_port = self._rtp.getsockname()[1]
+        sdp_path = os.path.join(tempfile.mkdtemp(prefix='rtsp-standin-'), 'stream.sdp')
+        self.process = subprocess.Popen([
+            'ffmpeg', '-hide_banner', '-loglevel', 'error', '-nostdin',
+            '-re', '-f', 'lavfi', '-i', pattern_source(self.size, self.fps),
+            '-c:v', 'libx264', '-preset', 'ultrafast', '-tune', 'zerolatency',
+            '-g', str(max(1, round(self.gop * self.fps))), '-bf', '0',
+            '-b:v', self.bitrate, '-pix_fmt', 'yuv420p',
+            # SPS/PPS in the SDP and in front of every keyframe, like a camera
+            '-flags:v', '+global_header', '-bsf:v', 'dump_extra=freq=keyframe',
+            '-f', 'rtp', '-sdp_file', sdp_path,
+            f'rtp://127.0.0.1:{rtp_port}?rtcpport={rtp_port + 1}&pkt_size=1200'
+        ], stdin=subprocess.DEVNULL)
+        deadline = time.monotonic() + timeout
+        while not (os.path.exists(sdp_path) and os.path.getsize(sdp_path)):
+            if self.process.poll() is not None or time.monotonic() > deadline:
+                raise RuntimeError("Test pattern publisher did not start")
+            time.sleep(0.01)
+        time.sleep(0.05)
+        with open(sdp_path) as f:
+            self.sdp = self._describe(f.read())
+        for target, channel in ((self._relay, 0), (self._relay, 1), (self._accept, None)):
+            args = (channel,) if channel is not None else ()
+            threading.Thread(target=target, args=args, daemon=True, name='rtsp-standin').start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        for sock in (self._server, self._rtp, self._rtcp):
+            sock.close()
+        with self._lock:
+            clients, self.clients = self.clients, []
+        for client in clients:
+            client.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def frame_time(self, number):
+        with self._lock:
+            return self.sent.get(number)
+
+    @staticmethod
+    def _describe(sdp):
+        # The RTP muxer writes a session for its UDP target; clients get
+        # a generic one with a control URL for the single track
+        lines = []
+        for line in sdp.strip().splitlines():
+            if line.startswith('c='):
+                line = 'c=IN IP4 0.0.0.0'
+            elif line.startswith('m=video'):
+                line = 'm=video 0 RTP/AVP ' + line.split()[-1]
+            lines.append(line)
+            if line.startswith('t='):
+                lines.append('a=control:*')
+        lines.append('a=control:trackID=0')
+        return '\r\n'.join(lines) + '\r\n'
+
+    # -- RTP relay -------------------------------------------------------
+
+    def _relay(self, channel):
+        sock = self._rtp if channel == 0 else self._rtcp
+        header = bytearray(b'$\x00\x00\x00')
+        header[1] = channel
+        while not self._stopped.is_set():
+            try:
+                packet = sock.recv(65536)
+            except OSError:
+                return
+            if channel == 0:
+                self._note_frame(packet)
+            struct.pack_into('!H', header, 2, len(packet))
+            frame = bytes(header) + packet
+            with self._lock:
+                clients = list(self.clients)
+            for client in clients:
+                try:
+                    with self._send_lock:
+                        client.sendall(frame)
+                except OSError:
+                    self._drop(client)
+
+    def _note_frame(self, packet):
+        ts = struct.unpack_from('!I', packet, 4)[0]
+        if ts == self._last_ts:
+            return
+        self._last_ts = ts
+        if self._first_ts is None:
+            self._first_ts = ts
+        number = round(((ts - self._first_ts) % 2 ** 32) * self.fps / RTP_CLOCK)
+        with self._lock:
+            self.frames += 1
+            self.sent[number] = time.time()
+            while len(self.sent) > self.history:
+                self.sent.popitem(last=False)
+
+    def _drop(self, client):
+        with self._lock:
+            if client in self.clients:
+                self.clients.remove(client)
+        client.close()
+
+    # -- RTSP ------------------------------------------------------------
+
+    def _accept(self):
+        while not self._stopped.is_set():
+            try:
+                client, _ = self._server.accept()
+            except OSError:
+                return
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self._session, args=(client,), daemon=True,
+                             name='rtsp-standin-session').start()
+
+    def _session(self, client):
+        session = uuid.uuid4().hex[:8]
+        stream = client.makefile('rb')
+        try:
+            while True:
+                first = stream.read(1)
+                if not first:
+                    break
+                if first == b'$':
+                    # RTCP receiver reports from the client
+                    length = struct.unpack('!xH', stream.read(3))[0]
+                    stream.read(length)
+                    continue
+                request = [(first + stream.readline()).decode('latin-1').strip()]
+                while request[-1]:
+                    request.append(stream.readline().decode('latin-1').strip())
+                method, url = request[0].split()[:2]
+                headers = dict(line.split(':', 1) for line in request[1:] if ':' in line)
+                headers = {k.strip().lower(): v.strip() for k, v in headers.items()}
+                if 'content-length' in headers:
+                    stream.read(int(headers['content-length']))
+                self._answer(client, method, url, headers, session)
+                if method == 'TEARDOWN':
+                    break
+        except (OSError, ValueError):
+            pass
+        self._drop(client)
+
+    def _answer(self, client, method, url, headers, session):
+        status, extra, body = '200 OK', [], b''
+        if method == 'OPTIONS':
+            extra.append('Public: OPTIONS, DESCRIBE, SETUP, PLAY, TEARDOWN, GET_PARAMETER')
+        elif method == 'DESCRIBE':
+            body = self.sdp.encode()
+            extra += [f"Content-Base: {url.rstrip('/')}/", 'Content-Type: application/sdp']
+        elif method == 'SETUP':
+            if 'TCP' not in headers.get('transport', ''):
+                status = '461 Unsupported Transport'
+            else:
+                extra += ['Transport: RTP/AVP/TCP;unicast;interleaved=0-1', f'Session: {session};timeout=60']
+        elif method == 'PLAY':
+            extra += [f'Session: {session}', 'Range: npt=0.000-']
+        elif method in ('TEARDOWN', 'GET_PARAMETER'):
+            extra.append(f'Session: {session}')
+        else:
+            status = '405 Method Not Allowed'
+        lines = [f'RTSP/1.0 {status}', f"CSeq: {headers.get('cseq', '0')}", *extra]
+        if body:
+            lines.append(f'Content-Length: {len(body)}')
+        with self._send_lock:
+            client.sendall(('\r\n'.join(lines) + '\r\n\r\n').encode() + body)
+        if method == 'PLAY':
+            with self._lock:
+                self.clients.append(client)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8554)
+    parser.add_argument('--size', default='1280x720')
+    parser.add_argument('--fps', type=int, default=15)
+    parser.add_argument('--gop', type=float, default=2.0, help='keyframe interval, s')
+    parser.add_argument('--bitrate', default='2M')
+    args = parser.parse_args()
+    with RtspStandIn(args.size, args.fps, args.gop, args.bitrate, args.port) as camera:
+        print(camera.url, flush=True)
+        try:
+            while camera.process.poll() is None:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
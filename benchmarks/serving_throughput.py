@@ -0,0 +1,96 @@
+"""Requests/sec and p99 latency of the playlist and segment routes under load.
+
+Each simulated viewer keeps one HTTP/1.1 connection and loops like a player:
+fetch the playlist, then its newest segment. Run it against a live server,
+e.g. the gunicorn setup versus `python app.py`:
+
+    gunicorn -c gunicorn.conf.py app:app
+    python benchmarks/serving_throughput.py --url http://localhost:8083 --camera default --viewers 10 50 200 500
+"""
+import argparse
+import http.client
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+def percentile(values, pct):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def newest_segment(playlist):
+    lines = [line for line in playlist.decode().splitlines() if line and not line.startswith('#')]
+    return lines[-1] if lines else None
+
+
+def viewer(host, port, playlist_path, deadline, results, errors):
+    conn = http.client.HTTPConnection(host, port, timeout=10)
+    base = playlist_path.rsplit('/', 1)[0]
+    while time.perf_counter() < deadline:
+        try:
+            started = time.perf_counter()
+            conn.request('GET', playlist_path)
+            resp = conn.getresponse()
+            body = resp.read()
+            results['playlist'].append(time.perf_counter() - started)
+            segment = newest_segment(body) if resp.status == 200 else None
+            if segment is None:
+                errors.append(resp.status)
+                time.sleep(0.1)
+                continue
+            started = time.perf_counter()
+            conn.request('GET', f'{base}/{segment}')
+            resp = conn.getresponse()
+            resp.read()
+            if resp.status != 200:
+                errors.append(resp.status)
+                continue
+            results['segment'].append(time.perf_counter() - started)
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(type(e).__name__)
+            conn.close()
+            conn = http.client.HTTPConnection(host, port, timeout=10)
+    conn.close()
+
+
+def run(host, port, playlist_path, viewers, seconds):
+    results = {'playlist': [], 'segment': []}
+    errors = []
+    deadline = time.perf_counter() + seconds
+    threads = [
+        threading.Thread(target=viewer, args=(host, port, playlist_path, deadline, results, errors), daemon=True)
+        for _ in range(viewers)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://localhost:8083')
+    parser.add_argument('--camera', default='default')
+    parser.add_argument('--playlist', default='playlist.m3u8')
+    parser.add_argument('--viewers', type=int, nargs='+', default=[10, 50, 200])
+    parser.add_argument('--seconds', type=float, default=10.0)
+    args = parser.parse_args()
+
+    parts = urlsplit(args.url)
+    playlist_path = f'/hls/{args.camera}/{args.playlist}'
+    print(f"{'viewers':>8} {'route':>9} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for count in args.viewers:
+        results, errors = run(parts.hostname, parts.port or 80, playlist_path, count, args.seconds)
+        for route in ('playlist', 'segment'):
+            latencies = results[route]
+            print(f"{count:>8} {route:>9} {len(latencies) / args.seconds:>9.0f} "
+                  f"{percentile(latencies, 50) * 1000:>8.1f} {percentile(latencies, 99) * 1000:>8.1f} "
+                  f"{len(errors) if route == 'playlist' else '':>7}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""Latency and decode count of /snapshot/<cam>.jpg under a dashboard refresh.
+
+Every round fires `--clients` simultaneous requests, as a wall of thumbnails
+refreshing at once would. Decodes are read from /stream/<cam>/status, so a
+coalesced round shows a single decode however many clients asked.
+
+    python benchmarks/snapshot_load.py --url http://localhost:8083 --camera default --clients 100 --rounds 5
+"""
+import argparse
+import json
+import threading
+import time
+import urllib.request
+
+
+def fetch(url, results):
+    started = time.perf_counter()
+    with urllib.request.urlopen(url, timeout=30) as resp:
+        resp.read()
+        results.append((time.perf_counter() - started, resp.headers.get('ETag')))
+
+
+def decodes(base, camera):
+    with urllib.request.urlopen(f'{base}/stream/{camera}/status', timeout=30) as resp:
+        return json.loads(resp.read())['snapshot_decodes']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://localhost:8083')
+    parser.add_argument('--camera', default='default')
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--width', type=int, default=320)
+    args = parser.parse_args()
+
+    base = args.url.rstrip('/')
+    url = f'{base}/snapshot/{args.camera}.jpg?width={args.width}'
+    print(f"{'round':>5} {'decodes':>8} {'frames':>7} {'p50 ms':>8} {'p99 ms':>8}")
+    for round_number in range(args.rounds):
+        before = decodes(base, args.camera)
+        results = []
+        threads = [threading.Thread(target=fetch, args=(url, results)) for _ in range(args.clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        latencies = sorted(latency * 1000 for latency, _ in results)
+        print(f"{round_number + 1:>5} {decodes(base, args.camera) - before:>8} "
+              f"{len({etag for _, etag in results}):>7} {latencies[len(latencies) // 2]:>8.1f} "
+              f"{latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]:>8.1f}")
+        # Let the next segment arrive so the following round needs a fresh decode
+        time.sleep(1.0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Measure start-to-first-playlist latency of a running server.
+
+Each run stops the camera, POSTs /stream/<cam>/start and then times two
+things: when the start job reports ready (long-poll), and when the playlist
+is first served to a viewer. Run against a live instance:
+
+    python benchmarks/startup_latency.py --url http://localhost:8083 --camera default --runs 5
+"""
+import argparse
+import json
+import statistics
+import time
+import urllib.error
+import urllib.request
+
+
+def request(url, method='GET'):
+    req = urllib.request.Request(url, method=method, data=b'' if method == 'POST' else None)
+    try:
+        with urllib.request.urlopen(req, timeout=60) as resp:
+            return resp.status, resp.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+def measure(base, camera, timeout):
+    request(f'{base}/stream/{camera}/stop', 'POST')
+    started = time.perf_counter()
+    status, body = request(f'{base}/stream/{camera}/start', 'POST')
+    returned = time.perf_counter() - started
+    job = json.loads(body)
+    if status >= 400:
+        raise RuntimeError(f"start failed: {job.get('message')}")
+    status, body = request(f"{base}/stream/jobs/{job['job_id']}?wait={timeout}")
+    job = json.loads(body)
+    ready = time.perf_counter() - started
+    if job['state'] != 'ready':
+        raise RuntimeError(f"job {job['state']}: {job.get('message')}")
+
+    playlist_url = f'{base}/hls/{camera}/playlist.m3u8'
+    deadline = started + timeout
+    while time.perf_counter() < deadline:
+        status, _ = request(playlist_url)
+        if status == 200:
+            break
+        time.sleep(0.01)
+    served = time.perf_counter() - started
+    return {
+        'start_returned_s': returned,
+        'job_ready_s': ready,
+        'server_startup_s': job['startup_seconds'],
+        'first_playlist_s': served,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://localhost:8083')
+    parser.add_argument('--camera', default='default')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--timeout', type=float, default=20.0)
+    args = parser.parse_args()
+
+    results = []
+    for run in range(args.runs):
+        result = measure(args.url.rstrip('/'), args.camera, args.timeout)
+        results.append(result)
+        print(f"run {run + 1}: " + ', '.join(f"{k}={v:.3f}" for k, v in result.items()))
+
+    print('median: ' + ', '.join(
+        f"{k}={statistics.median(r[k] for r in results):.3f}" for k in results[0]
+    ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""Stream status delivery: pages polling /status versus one SSE broadcaster.
+
+`--pages` simulated viewer pages watch the default camera for `--duration`
+seconds, either polling /stream/<cam>/status every `--poll` s the way the
+page used to or holding /stream/<cam>/events open. FFmpeg is not started;
+the camera is flipped between running and stopped every few seconds. For
+each mode the script reports the status computations the server did, the
+HTTP requests it answered, how long a page took to notice each flip, and
+how many flips pages never saw at all.
+
+    python benchmarks/status_push.py --pages 50 200 --duration 30
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('ONVIF_USERNAME', 'bench')
+os.environ.setdefault('ONVIF_PASSWORD', 'bench')
+os.environ.setdefault('ONVIF_IP', '127.0.0.1')
+
+from werkzeug.serving import make_server  # noqa: E402
+
+import app as app_module  # noqa: E402
+
+
+class FakeCamera:
+    """Makes the default pipeline look running or stopped on demand."""
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.running = False
+        self.flips = []
+        self.status_calls = 0
+        self.health_calls = 0
+        pipeline.is_running = self.is_running
+        pipeline.has_playlist = lambda: self.running
+        original_status, original_health = pipeline.status, pipeline.health
+
+        def status():
+            self.status_calls += 1
+            return original_status()
+
+        def health():
+            self.health_calls += 1
+            return original_health()
+        pipeline.status, pipeline.health = status, health
+
+    def is_running(self):
+        return self.running
+
+    def flip(self):
+        self.running = not self.running
+        self.pipeline.ready_at = time.time() if self.running else None
+        self.flips.append((time.time(), 'running' if self.running else 'stopped'))
+
+
+def detection_delays(flips, seen):
+    """Seconds from each flip to the first time a page saw the new state."""
+    delays = []
+    for (at, state), until in zip(flips, [f[0] for f in flips[1:]] + [float('inf')]):
+        first = next((t for t, s in seen if at <= t < until and s == state), None)
+        if first is not None:
+            delays.append(first - at)
+    return delays
+
+
+def poll_page(base, interval, deadline, seen, counter):
+    # Pages load at different moments, so their polls are spread out
+    time.sleep(random.uniform(0, interval))
+    while time.time() < deadline:
+        with urllib.request.urlopen(f'{base}/stream/default/status', timeout=10) as resp:
+            state = json.loads(resp.read())['status']
+        counter.append(1)
+        seen.append((time.time(), state))
+        time.sleep(interval)
+
+
+def sse_page(base, deadline, seen, counter):
+    with urllib.request.urlopen(f'{base}/stream/default/events', timeout=30) as resp:
+        counter.append(1)
+        for line in resp:
+            if time.time() >= deadline:
+                return
+            if line.startswith(b'data:'):
+                seen.append((time.time(), json.loads(line[5:])['state']))
+
+
+def run(camera, base, mode, pages, duration, poll):
+    camera.status_calls = camera.health_calls = 0
+    camera.flips.clear()
+    deadline = time.time() + duration
+    seen_by_page = [[] for _ in range(pages)]
+    requests = []
+    threads = []
+    for seen in seen_by_page:
+        if mode == 'poll':
+            target, args = poll_page, (base, poll, deadline, seen, requests)
+        else:
+            target, args = sse_page, (base, deadline, seen, requests)
+        threads.append(threading.Thread(target=target, args=args, daemon=True))
+    for thread in threads:
+        thread.start()
+    time.sleep(1)
+    while time.time() < deadline - 3:
+        camera.flip()
+        time.sleep(random.uniform(2, 4))
+    time.sleep(max(0.0, deadline - time.time()))
+    # /status only runs status(); the broadcaster only runs health()
+    calls = camera.status_calls if mode == 'poll' else camera.health_calls
+    flips = list(camera.flips)
+    # One more change wakes the SSE pages so they notice the deadline
+    camera.flip()
+    for thread in threads:
+        thread.join(timeout=20)
+    delays = [d for seen in seen_by_page for d in detection_delays(flips, seen)]
+    return {
+        'calls': calls,
+        'requests': len(requests),
+        'median_delay': statistics.median(delays) if delays else float('nan'),
+        'max_delay': max(delays) if delays else float('nan'),
+        # Changes a page never saw because they were undone between two polls
+        'missed': len(flips) * pages - len(delays),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pages', type=int, nargs='+', default=[50, 200])
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--poll', type=float, default=5, help="the old page's polling interval, s")
+    parser.add_argument('--port', type=int, default=18086)
+    args = parser.parse_args()
+
+    random.seed(1)
+    camera = FakeCamera(app_module.pipelines.default)
+    server = make_server('127.0.0.1', args.port, app_module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{args.port}'
+
+    print(f"{'pages':>6} {'mode':>5} {'status calls':>13} {'requests':>9} {'median delay s':>15} "
+          f"{'max delay s':>12} {'missed':>7}")
+    for pages in args.pages:
+        for mode in ('poll', 'sse'):
+            result = run(camera, base, mode, pages, args.duration, args.poll)
+            print(f"{pages:>6} {mode:>5} {result['calls']:>13} {result['requests']:>9} "
+                  f"{result['median_delay']:>15.2f} {result['max_delay']:>12.2f} {result['missed']:>7}")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
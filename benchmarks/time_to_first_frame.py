@@ -0,0 +1,148 @@
+"""Time-to-first-frame for viewers joining a live camera.
+
+A join fetches the playlist, picks a start position and downloads media
+until it holds a segment (or LL-HLS part) that begins with a keyframe, which
+is the earliest moment a player can show a frame. Two start rules are
+compared: 'edge' ignores EXT-X-START and starts at the live edge minus the
+web player's hold-back (the behaviour before the GOP cache), 'gop' starts
+where EXT-X-START points. --cold also stops the camera and times the start
+job, next to the old page flow that slept a fixed 3 s after starting.
+
+    python benchmarks/time_to_first_frame.py --url http://localhost:8083 --camera default --joins 20
+    python benchmarks/time_to_first_frame.py --url http://localhost:8083 --camera default --prefix llhls --cold
+"""
+import argparse
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import time
+import urllib.error
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from segment_store import parse_media_playlist, starts_with_keyframe  # noqa: E402
+
+# liveSyncDuration of the web player for standard HLS
+EDGE_HOLD_BACK = 0.5
+OLD_PAGE_SLEEP = 3.0
+PART_TAG = re.compile(r'#EXT-X-PART:.*DURATION=([\d.]+).*URI="([^"]+)"')
+HINT_TAG = re.compile(r'#EXT-X-PRELOAD-HINT:.*URI="([^"]+)"')
+START_TAG = re.compile(r'#EXT-X-START:TIME-OFFSET=(-?[\d.]+)')
+HOLD_BACK_TAG = re.compile(r'PART-HOLD-BACK=([\d.]+)')
+PART_INDEX = re.compile(r'(\d+)\.ts$')
+
+
+def request(url, method='GET'):
+    req = urllib.request.Request(url, method=method, data=b'' if method == 'POST' else None)
+    try:
+        with urllib.request.urlopen(req, timeout=30) as resp:
+            return resp.status, resp.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+def media_units(text, low_latency):
+    """(uri, duration) of the playlist's parts (LL-HLS) or segments, oldest first."""
+    if low_latency:
+        return [(m.group(2), float(m.group(1))) for m in map(PART_TAG.match, text.splitlines()) if m]
+    return parse_media_playlist(text)
+
+
+def start_index(units, offset):
+    """Index of the unit containing the position `offset` seconds before the end."""
+    remaining = offset
+    for index in range(len(units) - 1, -1, -1):
+        remaining -= units[index][1]
+        if remaining <= 1e-6:
+            return index
+    return 0
+
+
+def join(base, playlist_url, low_latency, rule):
+    started = time.perf_counter()
+    requests = 1
+    status, body = request(playlist_url)
+    if status != 200:
+        raise RuntimeError(f"playlist returned {status}")
+    text = body.decode()
+    units = media_units(text, low_latency)
+    start = START_TAG.search(text)
+    if rule == 'gop' and start:
+        index = start_index(units, -float(start.group(1)))
+    else:
+        hold_back = HOLD_BACK_TAG.search(text)
+        index = start_index(units, float(hold_back.group(1)) if low_latency and hold_back else EDGE_HOLD_BACK)
+    hint = HINT_TAG.search(text)
+    queue = [uri for uri, _ in units[index:]] + ([hint.group(1)] if hint else [])
+    seen = {uri for uri, _ in units}
+    while True:
+        if not queue:
+            if low_latency:
+                # Parts are numbered; the next one is held open by the server
+                last = int(PART_INDEX.search(uri).group(1))
+                queue.append(PART_INDEX.sub(f'{last + 1}.ts', uri))
+            else:
+                time.sleep(0.05)
+                requests += 1
+                _, body = request(playlist_url)
+                queue = [u for u, _ in media_units(body.decode(), False) if u not in seen]
+                seen.update(queue)
+                continue
+        uri = queue.pop(0)
+        requests += 1
+        status, data = request(f'{base}/{uri}')
+        if status == 200 and starts_with_keyframe(data):
+            return {'ttff_s': time.perf_counter() - started, 'requests': requests}
+
+
+def cold_start(url, camera, playlist_url, low_latency):
+    request(f'{url}/stream/{camera}/stop', 'POST')
+    started = time.perf_counter()
+    _, body = request(f'{url}/stream/{camera}/start', 'POST')
+    job = json.loads(body)
+    _, body = request(f"{url}/stream/jobs/{job['job_id']}?wait=30")
+    if json.loads(body)['state'] != 'ready':
+        raise RuntimeError("start job failed")
+    ready = time.perf_counter() - started
+    first = join(playlist_url.rsplit('/', 1)[0], playlist_url, low_latency, 'gop')['ttff_s']
+    return {'job_ready_s': ready, 'first_frame_s': ready + first, 'old_page_s': ready + OLD_PAGE_SLEEP + first}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://localhost:8083')
+    parser.add_argument('--camera', default='default')
+    parser.add_argument('--prefix', default='hls', choices=['hls', 'llhls'])
+    parser.add_argument('--joins', type=int, default=20)
+    parser.add_argument('--cold', action='store_true', help='also time cold starts')
+    args = parser.parse_args()
+
+    url = args.url.rstrip('/')
+    low_latency = args.prefix == 'llhls'
+    playlist_url = f'{url}/{args.prefix}/{args.camera}/playlist.m3u8'
+    base = playlist_url.rsplit('/', 1)[0]
+    results = {'edge': [], 'gop': []}
+    for _ in range(args.joins):
+        for rule in results:
+            # Land at a random point of the segment cycle
+            time.sleep(random.uniform(0, 1))
+            results[rule].append(join(base, playlist_url, low_latency, rule))
+    print(f"{'start':>6} {'median ms':>10} {'p90 ms':>8} {'requests':>9}")
+    for rule, joins in results.items():
+        times = sorted(j['ttff_s'] * 1000 for j in joins)
+        print(f"{rule:>6} {statistics.median(times):>10.0f} {times[int(len(times) * 0.9) - 1]:>8.0f} "
+              f"{statistics.mean(j['requests'] for j in joins):>9.1f}")
+
+    if args.cold:
+        runs = [cold_start(url, args.camera, playlist_url, low_latency) for _ in range(3)]
+        print('cold start median: ' + ', '.join(
+            f"{k}={statistics.median(r[k] for r in runs):.3f}" for k in runs[0]
+        ))
+
+
+if __name__ == '__main__':
+    main()
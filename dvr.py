@@ -0,0 +1,268 @@
+import bisect
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# One index record per segment: wall-clock start (ms), duration (ms), flags,
+# byte offset and length inside the chunk's media file
+RECORD = struct.Struct('<qIIQI')
+# The segment starts a new FFmpeg run (or follows a gap)
+DISCONTINUITY = 0x1
+# Starts closer together than this are treated as one continuous recording
+GAP_TOLERANCE_MS = 1000
+
+
+class Chunk:
+    """One chunk of a recording: `<start ms>.ts` with its `<start ms>.idx`.
+
+    Closed chunks map their index read-only; the chunk being written keeps
+    its index in a bytearray that is appended to the file as it grows.
+    """
+
+    def __init__(self, root, start_ms):
+        self.start_ms = start_ms
+        self.name = str(start_ms)
+        self.media_path = os.path.join(root, f'{start_ms}.ts')
+        self.index_path = os.path.join(root, f'{start_ms}.idx')
+        self.index = bytearray()
+        self.count = 0
+        self.size = 0
+        self._map = None
+        self._media = None
+        self._index_file = None
+
+    @classmethod
+    def load(cls, root, start_ms):
+        chunk = cls(root, start_ms)
+        with open(chunk.index_path, 'rb') as f:
+            # A record cut short by a crash is ignored
+            count = os.fstat(f.fileno()).st_size // RECORD.size
+            if count:
+                chunk._map = mmap.mmap(f.fileno(), count * RECORD.size, access=mmap.ACCESS_READ)
+                chunk.index = chunk._map
+        chunk.count = count
+        if count:
+            _, _, _, offset, length = chunk.record(count - 1)
+            chunk.size = offset + length
+        return chunk
+
+    def open_for_append(self):
+        self._media = open(self.media_path, 'ab')
+        self._index_file = open(self.index_path, 'ab')
+
+    def append(self, start_ms, duration_ms, flags, data):
+        record = RECORD.pack(start_ms, duration_ms, flags, self.size, len(data))
+        # Media first: an index record never points past the end of the data
+        self._media.write(data)
+        self._media.flush()
+        self._index_file.write(record)
+        self._index_file.flush()
+        self.index += record
+        self.size += len(data)
+        self.count += 1
+
+    def close(self):
+        """Stop writing and switch the index over to a read-only mapping."""
+        for f in (self._media, self._index_file):
+            if f is not None:
+                f.close()
+        self._media = self._index_file = None
+        if self.count and self._map is None:
+            with open(self.index_path, 'rb') as f:
+                self._map = mmap.mmap(f.fileno(), self.count * RECORD.size, access=mmap.ACCESS_READ)
+            self.index = self._map
+
+    def release(self):
+        self.close()
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def record(self, i):
+        return RECORD.unpack_from(self.index, i * RECORD.size)
+
+    def start_of(self, i):
+        return struct.unpack_from('<q', self.index, i * RECORD.size)[0]
+
+    def search(self, ms):
+        """Index of the first record starting after `ms` (bisect_right on start times)."""
+        low, high = 0, self.count
+        while low < high:
+            mid = (low + high) // 2
+            if self.start_of(mid) <= ms:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    @property
+    def end_ms(self):
+        if not self.count:
+            return self.start_ms
+        start, duration, _, _, _ = self.record(self.count - 1)
+        return start + duration
+
+
+class DvrStore:
+    """Rolling on-disk recording of one camera, indexed by wall-clock time.
+
+    Finished segments are appended to chunk files of `chunk_seconds` each, so
+    retention deletes whole files and never rewrites one. Chunks older than
+    `max_age` seconds, or beyond `max_bytes` in total, are dropped oldest
+    first. A time range is found with a binary search over the sorted chunk
+    starts and then over the fixed-size records of each chunk, so serving a
+    VOD playlist never lists or scans a directory after startup.
+    """
+
+    def __init__(self, root, max_age=7 * 86400, max_bytes=0, chunk_seconds=3600):
+        self.root = os.path.abspath(root)
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.chunk_seconds = chunk_seconds
+        self._chunks = []
+        # Chunk start times in ms, parallel to _chunks, for bisect
+        self._starts = []
+        self._active = None
+        self._bytes = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        # Called with _lock held; the directory is only listed once
+        if self._loaded:
+            return
+        os.makedirs(self.root, exist_ok=True)
+        starts = sorted(int(name[:-4]) for name in os.listdir(self.root)
+                        if name.endswith('.idx') and name[:-4].isdigit())
+        for start_ms in starts:
+            try:
+                chunk = Chunk.load(self.root, start_ms)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Skipping unreadable DVR chunk {start_ms} in {self.root}: {e}")
+                continue
+            if chunk.count:
+                self._chunks.append(chunk)
+                self._starts.append(start_ms)
+                self._bytes += chunk.size
+        self._loaded = True
+
+    def append(self, data, duration, discontinuity=False, now=None):
+        """Record a finished segment of `duration` seconds that ended at `now`."""
+        now = time.time() if now is None else now
+        duration_ms = max(1, round(duration * 1000))
+        start_ms = round(now * 1000) - duration_ms
+        with self._lock:
+            self._load()
+            last_end = self._chunks[-1].end_ms if self._chunks else None
+            flags = DISCONTINUITY if discontinuity else 0
+            if last_end is not None:
+                if not discontinuity and abs(start_ms - last_end) < GAP_TOLERANCE_MS:
+                    # Arrival jitter; keep the timeline contiguous
+                    start_ms = last_end
+                elif start_ms - last_end >= GAP_TOLERANCE_MS:
+                    flags |= DISCONTINUITY
+                # Start times must stay sorted for the binary search
+                start_ms = max(start_ms, last_end)
+            active = self._active
+            if active is None or start_ms - active.start_ms >= self.chunk_seconds * 1000:
+                if active is not None:
+                    active.close()
+                active = self._active = Chunk(self.root, start_ms)
+                active.open_for_append()
+                self._chunks.append(active)
+                self._starts.append(start_ms)
+            active.append(start_ms, duration_ms, flags, data)
+            self._bytes += len(data)
+            self._enforce_retention(now)
+
+    def _enforce_retention(self, now):
+        # Called with _lock held; the chunk being written is never dropped
+        while len(self._chunks) > 1:
+            oldest = self._chunks[0]
+            expired = self.max_age and oldest.end_ms < (now - self.max_age) * 1000
+            oversize = self.max_bytes and self._bytes > self.max_bytes
+            if not (expired or oversize):
+                break
+            self._chunks.pop(0)
+            self._starts.pop(0)
+            self._bytes -= oldest.size
+            oldest.release()
+            for path in (oldest.media_path, oldest.index_path):
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    logger.warning(f"Could not delete DVR chunk file {path}: {e}")
+
+    def close(self):
+        with self._lock:
+            if self._active is not None:
+                self._active.close()
+                self._active = None
+
+    def lookup(self, start, end):
+        """Segments overlapping [start, end) as (chunk, start_ms, duration_ms, flags, offset, length)."""
+        start_ms, end_ms = round(start * 1000), round(end * 1000)
+        entries = []
+        with self._lock:
+            self._load()
+            c = max(0, bisect.bisect_right(self._starts, start_ms) - 1)
+            # The segment containing `start` began at or before it
+            i = max(0, self._chunks[c].search(start_ms) - 1) if self._chunks else 0
+            while c < len(self._chunks):
+                chunk = self._chunks[c]
+                while i < chunk.count:
+                    record = chunk.record(i)
+                    if record[0] >= end_ms:
+                        return entries
+                    if record[0] + record[1] > start_ms:
+                        entries.append((chunk.name, *record))
+                    i += 1
+                c += 1
+                i = 0
+        return entries
+
+    def info(self):
+        with self._lock:
+            self._load()
+            if not self._chunks:
+                return {"oldest": None, "newest": None, "segments": 0, "bytes": 0, "chunks": 0}
+            return {
+                "oldest": self._chunks[0].start_ms / 1000,
+                "newest": self._chunks[-1].end_ms / 1000,
+                "segments": sum(chunk.count for chunk in self._chunks),
+                "bytes": self._bytes,
+                "chunks": len(self._chunks),
+            }
+
+    def playlist(self, start, end, chunk_url):
+        """VOD media playlist for [start, end), or None when nothing was recorded then.
+
+        Segments are byte ranges of the chunk files; `chunk_url` maps a chunk
+        name to its URL relative to the playlist.
+        """
+        entries = self.lookup(start, end)
+        if not entries:
+            return None
+        target = max(math.ceil(duration_ms / 1000) for _, _, duration_ms, _, _, _ in entries)
+        lines = ['#EXTM3U', '#EXT-X-VERSION:4', '#EXT-X-PLAYLIST-TYPE:VOD',
+                 f'#EXT-X-TARGETDURATION:{target}', '#EXT-X-MEDIA-SEQUENCE:0']
+        previous_end = None
+        for name, start_ms, duration_ms, flags, offset, length in entries:
+            if previous_end is not None and (flags & DISCONTINUITY or start_ms != previous_end):
+                lines.append('#EXT-X-DISCONTINUITY')
+            if previous_end is None or flags & DISCONTINUITY or start_ms != previous_end:
+                stamp = datetime.fromtimestamp(start_ms / 1000, timezone.utc)
+                lines.append(f"#EXT-X-PROGRAM-DATE-TIME:{stamp.isoformat(timespec='milliseconds')}")
+            lines.append(f'#EXTINF:{duration_ms / 1000:.3f},')
+            lines.append(f'#EXT-X-BYTERANGE:{length}@{offset}')
+            lines.append(chunk_url(name))
+            previous_end = start_ms + duration_ms
+        lines.append('#EXT-X-ENDLIST')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,519 @@
+import http.client
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+from flask import Response
+from simple_websocket import Client, ConnectionClosed
+from werkzeug.datastructures import ResponseCacheControl
+from werkzeug.http import parse_cache_control_header
+
+from fmp4 import FragmentBroadcaster
+from ptz import PtzState
+from stream_status import VOLATILE, StatusBroadcaster
+
+logger = logging.getLogger(__name__)
+
+# Hop-by-hop headers must not be forwarded by a proxy (RFC 7230 6.1)
+HOP_BY_HOP = {'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+              'te', 'trailers', 'transfer-encoding', 'upgrade', 'content-length'}
+# Answered per client by the edge, so a shared upstream request never carries them
+CONDITIONAL = {'if-none-match', 'if-modified-since', 'if-match', 'if-unmodified-since', 'if-range', 'range'}
+
+
+class SupervisorProxy:
+    """Forwards requests from an edge worker to the supervisor process.
+
+    The supervisor is the only process that owns FFmpeg pipelines, start
+    jobs and restart incidents, so every control request is answered there
+    no matter which worker accepted the connection.
+    """
+
+    def __init__(self, url, timeout=60, pool_size=64):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.timeout = timeout
+        self.pool_size = pool_size
+        # Keep-alive connections whose last response was read in full
+        self._idle = []
+        self._pool_lock = threading.Lock()
+
+    def request(self, method, path, body=None, headers=None):
+        """Send a request on an idle keep-alive connection, or on a new one."""
+        with self._pool_lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is not None:
+            try:
+                conn.request(method, path, body=body, headers=headers or {})
+                return conn, conn.getresponse()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                # The supervisor closed it while it was idle
+                conn.close()
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        conn.request(method, path, body=body, headers=headers or {})
+        return conn, conn.getresponse()
+
+    def release(self, conn, resp):
+        """Keep `conn` for the next request once `resp` has been read in full."""
+        with self._pool_lock:
+            if not resp.will_close and len(self._idle) < self.pool_size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    @staticmethod
+    def forwarded_headers(flask_request):
+        headers = {k: v for k, v in flask_request.headers.items() if k.lower() not in HOP_BY_HOP}
+        forwarded = flask_request.headers.get('X-Forwarded-For')
+        headers['X-Forwarded-For'] = f"{forwarded}, {flask_request.remote_addr}" if forwarded else flask_request.remote_addr
+        return headers
+
+    @staticmethod
+    def unreachable(error):
+        logger.error(f"Supervisor unreachable: {error}")
+        return Response(json.dumps({"status": "error", "message": "Supervisor unreachable"}),
+                        status=502, mimetype='application/json')
+
+    def forward(self, flask_request):
+        headers = self.forwarded_headers(flask_request)
+        path = flask_request.full_path if flask_request.query_string else flask_request.path
+        try:
+            conn, resp = self.request(flask_request.method, path, flask_request.get_data(), headers)
+        except OSError as e:
+            return self.unreachable(e)
+        response_headers = [(k, v) for k, v in resp.getheaders() if k.lower() not in HOP_BY_HOP]
+        if resp.getheader('Content-Type', '').startswith('text/event-stream'):
+            def stream():
+                try:
+                    for line in iter(resp.readline, b''):
+                        yield line
+                finally:
+                    conn.close()
+            return Response(stream(), status=resp.status, headers=response_headers)
+        body = resp.read()
+        self.release(conn, resp)
+        return Response(body, status=resp.status, headers=response_headers)
+
+    def events(self, path):
+        """Yield the decoded data of each event of the SSE stream at `path`.
+
+        Keepalive comments yield None. Ends when the supervisor closes the
+        stream, at once if it does not answer 200.
+        """
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            conn.request('GET', path, headers={'Accept': 'text/event-stream'})
+            resp = conn.getresponse()
+            if resp.status != 200:
+                return
+            for line in iter(resp.readline, b''):
+                if line.startswith(b'data:'):
+                    yield json.loads(line[5:])
+                elif line.startswith(b':'):
+                    yield None
+        finally:
+            conn.close()
+
+
+class RelayedFragments(FragmentBroadcaster):
+    """A camera's fMP4 push stream for an edge worker's WebSocket clients.
+
+    One upstream WebSocket to the supervisor feeds this broadcaster for all
+    of the worker's clients. It is opened by the first client and closed
+    `linger` seconds after the last one left. When the supervisor hangs up,
+    for instance because FFmpeg restarted, the local clients are dropped
+    too and reconnect as they would to the supervisor itself.
+    """
+
+    def __init__(self, proxy, path, linger=5.0, max_queue=32):
+        super().__init__(max_queue)
+        self.proxy = proxy
+        self.path = path
+        self.linger = linger
+        self._thread = None
+
+    def join(self, timeout):
+        """Subscribe a client, connecting upstream if needed.
+
+        Returns None when no init segment arrived within `timeout` seconds.
+        """
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True, name=f"push-relay{self.path}")
+                self._thread.start()
+        deadline = time.monotonic() + timeout
+        client = self.subscribe()
+        while client is None and self._thread is not None and time.monotonic() < deadline:
+            time.sleep(0.1)
+            client = self.subscribe()
+        return client
+
+    def _run(self):
+        upstream = None
+        try:
+            upstream = Client.connect(f"ws://{self.proxy.host}:{self.proxy.port}{self.path}")
+            last_client = time.monotonic()
+            while True:
+                data = upstream.receive(timeout=self.linger)
+                if isinstance(data, bytes):
+                    # The codec message is skipped; publish_init() reads it from the init segment
+                    if self.init is None:
+                        self.publish_init(data)
+                    else:
+                        self.publish(data)
+                if self.client_count():
+                    last_client = time.monotonic()
+                elif time.monotonic() - last_client > self.linger:
+                    break
+        except ConnectionClosed:
+            pass
+        except OSError as e:
+            logger.warning(f"Lost the supervisor's push stream {self.path}: {e}")
+        finally:
+            self.reset()
+            with self._lock:
+                self._thread = None
+            if upstream is not None and upstream.connected:
+                try:
+                    upstream.close()
+                except ConnectionClosed:
+                    pass
+
+
+class CachedResponse:
+    """A supervisor response kept by an edge worker."""
+
+    __slots__ = ('status', 'headers', 'body', 'max_age', 'fetched')
+
+    def __init__(self, status, headers, body, max_age):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.max_age = max_age
+        self.fetched = time.monotonic()
+
+    @property
+    def fresh(self):
+        return time.monotonic() - self.fetched < self.max_age
+
+    def response(self, flask_request):
+        response = Response(self.body, status=self.status, headers=self.headers)
+        if self.max_age:
+            # Downstream caches must not keep it longer than the supervisor allowed
+            response.headers['Age'] = str(int(time.monotonic() - self.fetched))
+        if self.status == 200:
+            # 304 for If-None-Match against the supervisor's ETag
+            response = response.make_conditional(flask_request)
+        return response
+
+
+class Flight:
+    """One upstream request that other requests for the same URL wait on."""
+
+    __slots__ = ('done', 'entry')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.entry = None
+
+
+class EdgeCache:
+    """Collapses and caches an edge worker's HLS requests to the supervisor.
+
+    Concurrent requests for the same URL wait for a single upstream request
+    and share its response, errors included. Responses the supervisor marks
+    `public` are then kept for their `max-age` (a second or so for playlists,
+    a year for segments, whose names are never reused), oldest first out
+    beyond `max_bytes`. Each playlist revision and segment therefore crosses
+    from the supervisor to a worker about once, however many viewers the
+    worker serves. Conditional requests are answered here from the shared
+    copy.
+    """
+
+    def __init__(self, proxy, max_bytes=64 * 1024 * 1024):
+        self.proxy = proxy
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.collapsed = 0
+        self.fetches = 0
+        self._entries = OrderedDict()
+        # URL -> upstream request in progress
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def get(self, flask_request):
+        path = flask_request.full_path if flask_request.query_string else flask_request.path
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry.fresh:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry.response(flask_request)
+            flight = self._flights.get(path)
+            if flight is None:
+                flight = self._flights[path] = Flight()
+                leader = True
+            else:
+                self.collapsed += 1
+                leader = False
+        if not leader:
+            # Blocking LL-HLS reloads are held upstream for a while, hence the long wait
+            if flight.done.wait(self.proxy.timeout) and flight.entry is not None:
+                return flight.entry.response(flask_request)
+            return self.proxy.forward(flask_request)
+        entry = None
+        try:
+            entry = self._fetch(path, flask_request)
+            return entry.response(flask_request)
+        finally:
+            with self._lock:
+                del self._flights[path]
+                if entry is not None and entry.max_age and entry.status == 200:
+                    self._store(path, entry)
+            flight.entry = entry
+            flight.done.set()
+
+    def _fetch(self, path, flask_request):
+        headers = {k: v for k, v in self.proxy.forwarded_headers(flask_request).items()
+                   if k.lower() not in CONDITIONAL}
+        with self._lock:
+            self.fetches += 1
+        try:
+            conn, resp = self.proxy.request('GET', path, None, headers)
+            body = resp.read()
+            self.proxy.release(conn, resp)
+        except OSError as e:
+            response = self.proxy.unreachable(e)
+            return CachedResponse(response.status_code, list(response.headers.items()), response.get_data(), 0)
+        cache_control = parse_cache_control_header(resp.getheader('Cache-Control'), cls=ResponseCacheControl)
+        max_age = 0
+        if cache_control.public and not (cache_control.no_store or cache_control.no_cache):
+            max_age = cache_control.max_age or 0
+        response_headers = [(k, v) for k, v in resp.getheaders() if k.lower() not in HOP_BY_HOP]
+        return CachedResponse(resp.status, response_headers, body, max_age)
+
+    def _store(self, path, entry):
+        # Called with _lock held
+        if len(entry.body) > self.max_bytes:
+            return
+        previous = self._entries.pop(path, None)
+        if previous is not None:
+            self.size -= len(previous.body)
+        self._entries[path] = entry
+        self.size += len(entry.body)
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted.body)
+
+
+class ViewerReporter:
+    """Batches viewer activity seen by an edge worker and reports it once a second.
+
+    Segments are served by the edge workers directly, so the supervisor would
+    otherwise never see the viewers it needs for on-demand shutdown and counts.
+    """
+
+    def __init__(self, proxy, interval=1.0):
+        self.proxy = proxy
+        self.interval = interval
+        self._seen = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def touch(self, cam, viewer):
+        with self._lock:
+            self._seen.setdefault(cam, set()).add(viewer)
+            if self._thread is None:
+                # Started lazily so it runs in the worker, not in a pre-fork parent
+                self._thread = threading.Thread(target=self._run, daemon=True, name="viewer-reporter")
+                self._thread.start()
+
+    def _run(self):
+        stop = threading.Event()
+        while not stop.wait(self.interval):
+            with self._lock:
+                seen, self._seen = self._seen, {}
+            if not seen:
+                continue
+            body = json.dumps({cam: sorted(viewers) for cam, viewers in seen.items()})
+            try:
+                conn, resp = self.proxy.request('POST', '/internal/viewers', body,
+                                                {'Content-Type': 'application/json'})
+                resp.read()
+                self.proxy.release(conn, resp)
+            except OSError as e:
+                logger.warning(f"Could not report viewers to the supervisor: {e}")
+
+
+# Errors that end one upstream event stream; the relay opens it again
+STREAM_ERRORS = (OSError, ValueError, http.client.HTTPException)
+
+
+class EventFollower:
+    """Fills a poller's state from a supervisor event stream instead of polling.
+
+    Mixed into StatusBroadcaster and PtzState, whose `_touch()` starts
+    `_run()` with the first reader. The stream is followed until no client
+    has read for `linger` seconds, and reopened a second after it breaks.
+    """
+
+    def _idle(self):
+        with self._cond:
+            if time.monotonic() - self._last_read > self.linger:
+                self._thread = None
+                return True
+            return False
+
+    def _follow(self, path, apply):
+        try:
+            while not self._idle():
+                try:
+                    for data in self.proxy.events(path):
+                        if self._idle():
+                            return
+                        if data:
+                            apply(data)
+                except STREAM_ERRORS as e:
+                    logger.warning(f"Lost the supervisor's event stream {path}: {e}")
+                time.sleep(1)
+        finally:
+            with self._cond:
+                if self._thread is threading.current_thread():
+                    self._thread = None
+
+
+class RelayedStatus(EventFollower, StatusBroadcaster):
+    """Camera states for an edge worker's SSE clients, from one supervisor stream.
+
+    Pipelines only run in the supervisor, so instead of polling them the
+    thread follows the supervisor's /stream/events and merges the cameras it
+    reports. A worker therefore holds one upstream stream, and one
+    supervisor thread, however many pages it serves. Versions are counted
+    here, so they keep increasing when the supervisor restarts.
+    """
+
+    def __init__(self, proxy, linger=30.0):
+        super().__init__(None, linger=linger)
+        self.proxy = proxy
+
+    def _run(self):
+        self._follow('/stream/events', self._merge)
+
+    def _merge(self, states):
+        with self._cond:
+            changed = False
+            for name, state in states.items():
+                previous = self._states.get(name)
+                # A reconnect repeats every camera, changed or not
+                if previous is not None and all(
+                        previous.get(key) == value for key, value in state.items()
+                        if key != 'version' and key not in VOLATILE):
+                    continue
+                state['version'] = previous['version'] + 1 if previous else 1
+                self._states[name] = state
+                changed = True
+            if changed:
+                self.version += 1
+                self._cond.notify_all()
+
+
+class RelayedPtzState(EventFollower, PtzState):
+    """A camera's PTZ state for an edge worker, from the supervisor's /ptz/<cam>/events.
+
+    Only the supervisor talks to the camera; each worker follows its event
+    stream once for all of its SSE clients, while any of them reads.
+    """
+
+    def __init__(self, client, proxy, path):
+        super().__init__(client)
+        self.proxy = proxy
+        self.path = path
+
+    def _run(self):
+        self._follow(self.path, self._apply)
+
+    def _apply(self, event):
+        data = {key: value for key, value in event.items() if key not in ('version', 'updated')}
+        with self._cond:
+            self.polls += 1
+            if data != self._data or self.version == 0:
+                self._data = data
+                self.version += 1
+            self._updated = event.get('updated')
+            self._cond.notify_all()
+
+
+class RelayedJob:
+    """A start job as seen by an edge worker, following its supervisor event stream.
+
+    Offers the to_dict()/wait() of StartJob. A stream that breaks before the
+    job finished reports the job as failed, so clients stop waiting on it.
+    """
+
+    def __init__(self, proxy, job_id):
+        self.proxy = proxy
+        self.path = f"/stream/jobs/{job_id}/events"
+        self.data = None
+        self.ended = False
+        self._cond = threading.Condition()
+        threading.Thread(target=self._run, daemon=True, name=f"job-{job_id}").start()
+
+    def _run(self):
+        try:
+            for data in self.proxy.events(self.path):
+                if data:
+                    with self._cond:
+                        self.data = data
+                        self._cond.notify_all()
+        except STREAM_ERRORS as e:
+            logger.warning(f"Lost the supervisor's job stream {self.path}: {e}")
+        finally:
+            with self._cond:
+                if self.data is not None and self.data['state'] == 'starting':
+                    self.data = {**self.data, 'state': 'failed', 'message': "Lost track of the job"}
+                self.ended = True
+                self._cond.notify_all()
+
+    def first(self, timeout):
+        """The job's first state, or None if the supervisor does not know it."""
+        with self._cond:
+            self._cond.wait_for(lambda: self.data is not None or self.ended, timeout)
+            return self.data
+
+    def to_dict(self):
+        with self._cond:
+            return self.data
+
+    def wait(self, timeout):
+        with self._cond:
+            self._cond.wait_for(lambda: self.data['state'] != 'starting', timeout)
+            return self.data
+
+
+class JobRelays:
+    """An edge worker's RelayedJob per start job, so its clients share one upstream stream."""
+
+    def __init__(self, proxy, keep=100):
+        self.proxy = proxy
+        self.keep = keep
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, job_id, timeout=5.0):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                job = self._jobs[job_id] = RelayedJob(self.proxy, job_id)
+                while len(self._jobs) > self.keep:
+                    self._jobs.popitem(last=False)
+        if job.first(timeout) is None:
+            with self._lock:
+                if self._jobs.get(job_id) is job:
+                    del self._jobs[job_id]
+            return None
+        return job
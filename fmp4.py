@@ -0,0 +1,248 @@
+import logging
+import queue
+import struct
+import threading
+
+logger = logging.getLogger(__name__)
+
+# trun/tfhd sample flags: sample_is_non_sync_sample
+NON_SYNC_SAMPLE = 0x10000
+
+
+def iter_boxes(data, offset=0, end=None):
+    """Yield (type, payload_start, box_end) for the ISO BMFF boxes in data[offset:end]."""
+    end = len(data) if end is None else end
+    while offset + 8 <= end:
+        size, kind = struct.unpack_from('>I4s', data, offset)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', data, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header or offset + size > end:
+            return
+        yield kind.decode('latin-1'), offset + header, offset + size
+        offset += size
+
+
+def find_box(data, path, offset=0, end=None):
+    """Return (payload_start, box_end) of the box at `path`, e.g. ['moov', 'trak']."""
+    # Bytes to skip before the children of container boxes with a header
+    skip = {'stsd': 8, 'avc1': 78, 'avc3': 78}
+    for kind, start, box_end in iter_boxes(data, offset, end):
+        if kind != path[0]:
+            continue
+        if len(path) == 1:
+            return start, box_end
+        found = find_box(data, path[1:], start + skip.get(kind, 0), box_end)
+        if found:
+            return found
+    return None
+
+
+def codec_string(init):
+    """RFC 6381 codec string of the H.264 track in an init segment, for MSE."""
+    for entry in ('avc1', 'avc3'):
+        found = find_box(init, ['moov', 'trak', 'mdia', 'minf', 'stbl', 'stsd', entry, 'avcC'])
+        if found:
+            start, _ = found
+            profile, compat, level = init[start + 1:start + 4]
+            return f'{entry}.{profile:02x}{compat:02x}{level:02x}'
+    return None
+
+
+def is_keyframe_fragment(moof):
+    """Whether the first sample of a moof box is a sync sample."""
+    for _, moof_start, moof_end in (box for box in iter_boxes(moof) if box[0] == 'moof'):
+        default_flags = None
+        for kind, start, box_end in iter_boxes(moof, moof_start, moof_end):
+            if kind != 'traf':
+                continue
+            for child, child_start, _ in iter_boxes(moof, start, box_end):
+                flags = struct.unpack_from('>I', moof, child_start)[0] & 0xFFFFFF
+                if child == 'tfhd' and flags & 0x20:
+                    # Optional fields in front of default_sample_flags
+                    position = child_start + 8
+                    position += 8 if flags & 0x01 else 0
+                    position += 4 if flags & 0x02 else 0
+                    position += 4 if flags & 0x08 else 0
+                    position += 4 if flags & 0x10 else 0
+                    default_flags = struct.unpack_from('>I', moof, position)[0]
+                elif child == 'trun':
+                    position = child_start + 8 + (4 if flags & 0x01 else 0)
+                    if flags & 0x04:
+                        sample_flags = struct.unpack_from('>I', moof, position)[0]
+                    elif flags & 0x400:
+                        position += (4 if flags & 0x100 else 0) + (4 if flags & 0x200 else 0)
+                        sample_flags = struct.unpack_from('>I', moof, position)[0]
+                    else:
+                        sample_flags = default_flags
+                    return sample_flags is not None and not sample_flags & NON_SYNC_SAMPLE
+    return False
+
+
+class Fmp4Reader:
+    """Splits FFmpeg's fragmented MP4 output into init segment and fragments."""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def _read_exactly(self, size):
+        chunks = []
+        while size:
+            chunk = self.stream.read(size)
+            if not chunk:
+                return None
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b''.join(chunks)
+
+    def boxes(self):
+        while True:
+            header = self._read_exactly(8)
+            if header is None:
+                return
+            size, kind = struct.unpack('>I4s', header)
+            if size == 1:
+                extended = self._read_exactly(8)
+                if extended is None:
+                    return
+                header += extended
+                size = struct.unpack('>Q', extended)[0]
+            body = self._read_exactly(size - len(header))
+            if body is None:
+                return
+            yield kind.decode('latin-1'), header + body
+
+    def __iter__(self):
+        """Yield ('init', bytes) once, then ('fragment', bytes) for every moof+mdat."""
+        pending = []
+        for kind, box in self.boxes():
+            pending.append(box)
+            if kind == 'moov':
+                yield 'init', b''.join(pending)
+                pending = []
+            elif kind == 'mdat':
+                yield 'fragment', b''.join(pending)
+                pending = []
+
+
+class PushClient:
+    """One WebSocket viewer: a bounded queue of shared fragment buffers."""
+
+    def __init__(self, maxsize, primed):
+        self.queue = queue.Queue(maxsize=maxsize)
+        # False until the client has been sent a keyframe to decode from
+        self.primed = primed
+
+    def offer(self, data):
+        try:
+            self.queue.put_nowait(data)
+            return True
+        except queue.Full:
+            return False
+
+    def close(self):
+        # Wake the sender; None tells it to hang up
+        try:
+            self.queue.put_nowait(None)
+        except queue.Full:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                pass
+            self.queue.put_nowait(None)
+
+    def get(self, timeout=None):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return b''
+
+
+class FragmentBroadcaster:
+    """Fans FFmpeg's fMP4 fragments out to every WebSocket client of a camera.
+
+    Every client receives the same bytes objects; the only per-client cost is
+    a slot in its queue. A client whose queue is full is disconnected rather
+    than allowed to hold up the others. Late joiners get the init segment and
+    the fragments since the last keyframe, so they can start decoding at once.
+    """
+
+    def __init__(self, max_queue=32):
+        self.max_queue = max_queue
+        self.init = None
+        self.codec = None
+        self._gop = []
+        self._clients = set()
+        self._lock = threading.Lock()
+
+    def reset(self):
+        """Forget the previous FFmpeg run and hang up on its clients."""
+        with self._lock:
+            clients, self._clients = self._clients, set()
+            self.init = None
+            self.codec = None
+            self._gop = []
+        for client in clients:
+            client.close()
+
+    def publish_init(self, data):
+        codec = codec_string(data)
+        with self._lock:
+            self.init = data
+            self.codec = codec
+            self._gop = []
+
+    def publish(self, fragment):
+        keyframe = is_keyframe_fragment(fragment)
+        with self._lock:
+            if keyframe:
+                self._gop = [fragment]
+            elif self._gop:
+                self._gop.append(fragment)
+            slow = []
+            for client in self._clients:
+                if not client.primed:
+                    if not keyframe:
+                        continue
+                    client.primed = True
+                if not client.offer(fragment):
+                    slow.append(client)
+            for client in slow:
+                self._clients.discard(client)
+        for client in slow:
+            logger.info("Dropping a push client that fell behind")
+            client.close()
+
+    def subscribe(self):
+        """Register a client primed with the init segment and the current GOP.
+
+        Returns None until FFmpeg has produced its init segment.
+        """
+        with self._lock:
+            if self.init is None:
+                return None
+            client = PushClient(max(self.max_queue, len(self._gop) + 1), primed=bool(self._gop))
+            client.offer(self.init)
+            for fragment in self._gop:
+                client.offer(fragment)
+            self._clients.add(client)
+            return client
+
+    def unsubscribe(self, client):
+        with self._lock:
+            self._clients.discard(client)
+
+    def client_count(self):
+        with self._lock:
+            return len(self._clients)
+
+    def feed(self, stream):
+        """Read FFmpeg's fMP4 output until EOF."""
+        for kind, data in Fmp4Reader(stream):
+            if kind == 'init':
+                self.publish_init(data)
+            else:
+                self.publish(data)
@@ -0,0 +1,130 @@
+"""Production server: gunicorn edge workers in front of one supervisor process.
+
+    gunicorn -c gunicorn.conf.py app:app
+
+The supervisor is a second gunicorn, started from this file with
+APP_ROLE=supervisor on a loopback port, with a single threaded worker. It
+owns every FFmpeg pipeline, the watchdog and the start jobs, so control
+routes behave the same whichever worker a request lands on. FFmpeg uploads
+to a separate loopback listener (INGEST_PORT), so viewer requests holding
+the supervisor's threads never stall ingest. Its own master replaces the
+worker if it dies, and a small keeper process, started by the edge master as
+`python gunicorn.conf.py`, starts the supervisor again if the whole
+supervisor exits. Edge workers send disk segments with sendfile, cache
+in-memory segments and playlists, and forward everything else to the
+supervisor.
+"""
+import logging
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SUPERVISOR_PORT = os.getenv('SUPERVISOR_PORT', '8084')
+INGEST_PORT = str(int(os.getenv('INGEST_PORT', '0')) or 8085)
+ROLE = os.getenv('APP_ROLE', 'edge')
+# Long enough for the supervisor to stop every FFmpeg process on shutdown
+SUPERVISOR_GRACEFUL_TIMEOUT = 30
+
+# Threads keep long-polls, blocking LL-HLS reloads and SSE streams from
+# occupying a whole worker
+worker_class = 'gthread'
+keepalive = 5
+
+if ROLE == 'supervisor':
+    bind = f"127.0.0.1:{SUPERVISOR_PORT}"
+    # Pipelines live in one process; SSE streams, long-polls and relayed
+    # WebSockets each hold a thread for as long as they last
+    workers = 1
+    threads = int(os.getenv('SUPERVISOR_THREADS', '128'))
+    graceful_timeout = SUPERVISOR_GRACEFUL_TIMEOUT
+
+    def post_worker_init(worker):
+        # Started in the worker, after the ingest listener exists, so
+        # FFmpeg's first PUT to /ingest is accepted
+        from app import pipelines, serve_ingest, watchdog
+        serve_ingest()
+        pipelines.start_all()
+        watchdog.start()
+
+    def post_fork(server, worker):
+        # FFmpeg processes inherit the worker's own process group...
+        os.setpgrp()
+
+    def child_exit(server, worker):
+        # ...so if the worker dies without stopping them they go with it,
+        # instead of PUTting into the replacement worker next to its FFmpeg
+        try:
+            os.killpg(worker.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+else:
+    bind = f"0.0.0.0:{os.getenv('HTTP_PORT', '8083')}"
+    workers = int(os.getenv('WEB_WORKERS', '0')) or multiprocessing.cpu_count() * 2 + 1
+    threads = int(os.getenv('WEB_THREADS', '32'))
+    # Zero-copy .ts delivery through wsgi.file_wrapper
+    sendfile = True
+    graceful_timeout = 10
+    raw_env = [
+        'APP_ROLE=edge',
+        f'SUPERVISOR_URL=http://127.0.0.1:{SUPERVISOR_PORT}',
+    ]
+
+    _keeper = None
+
+    def on_starting(server):
+        # The keeper is a process of its own, started before any worker is
+        # forked: this master reaps every child it has as a worker, and a
+        # worker forked during Popen would inherit the spawn's pipes
+        global _keeper
+        _keeper = subprocess.Popen([sys.executable, __file__])
+
+    def on_exit(server):
+        if _keeper is not None and _keeper.poll() is None:
+            _keeper.terminate()
+            try:
+                _keeper.wait(timeout=SUPERVISOR_GRACEFUL_TIMEOUT + 10)
+            except subprocess.TimeoutExpired:
+                _keeper.kill()
+
+
+def keep_supervisor():
+    """Run the supervisor, and start it again whenever it exits."""
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] [%(process)d] [%(levelname)s] %(message)s')
+    log = logging.getLogger('supervisor-keeper')
+    # docker stop and the edge master's on_exit stop the supervisor with us
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    # FFmpeg PUTs its output to the supervisor's own INGEST_PORT listener
+    env = dict(os.environ, APP_ROLE='supervisor', HTTP_PORT=SUPERVISOR_PORT, INGEST_PORT=INGEST_PORT)
+    command = [sys.executable, '-m', 'gunicorn', '-c', __file__, 'app:app']
+    supervisor = None
+    delay = 1.0
+    try:
+        while True:
+            log.info(f"Starting supervisor on 127.0.0.1:{SUPERVISOR_PORT}")
+            started = time.monotonic()
+            supervisor = subprocess.Popen(command, env=env)
+            code = supervisor.wait()
+            # Back off while it keeps crashing, from 1 s again once it stayed up
+            if time.monotonic() - started > 60:
+                delay = 1.0
+            log.error(f"Supervisor exited with code {code}, restarting in {delay:.0f}s")
+            time.sleep(delay)
+            delay = min(delay * 2, 30.0)
+    finally:
+        if supervisor is not None and supervisor.poll() is None:
+            supervisor.terminate()
+            try:
+                supervisor.wait(timeout=SUPERVISOR_GRACEFUL_TIMEOUT + 5)
+            except subprocess.TimeoutExpired:
+                supervisor.kill()
+
+
+if __name__ == '__main__':
+    keep_supervisor()
@@ -0,0 +1,280 @@
+import math
+import re
+import threading
+from collections import deque
+
+from segment_store import CachedFile, parse_media_playlist, starts_with_keyframe
+
+# part_<run>_<index>.ts from FFmpeg and llseg_<run>_<msn>.ts made from them
+PART_NAME = re.compile(r'part_([0-9a-z]*)_(\d+)\.ts$')
+SEGMENT_NAME = re.compile(r'llseg_([0-9a-z]*)_(\d+)\.ts$')
+
+
+class BlockingRequestError(Exception):
+    """Raised when a blocking playlist request can never be satisfied."""
+
+
+class Part:
+    __slots__ = ('index', 'file', 'duration', 'independent')
+
+    def __init__(self, index, file, duration, independent):
+        self.index = index
+        self.file = file
+        self.duration = duration
+        self.independent = independent
+
+
+class Segment:
+    __slots__ = ('run', 'msn', 'parts', 'complete', '_file')
+
+    def __init__(self, run, msn):
+        self.run = run
+        self.msn = msn
+        self.parts = []
+        self.complete = False
+        self._file = None
+
+    @property
+    def duration(self):
+        return sum(part.duration for part in self.parts)
+
+    @property
+    def file(self):
+        # MPEG-TS is concatenable, so a full segment is just its parts back to back
+        if self._file is None and self.complete:
+            data = b''.join(part.file.data for part in self.parts)
+            self._file = CachedFile(self.name, data)
+        return self._file
+
+    @property
+    def name(self):
+        return f'llseg_{self.run}_{self.msn}.ts'
+
+
+class LowLatencyPlaylist:
+    """Builds an LL-HLS media playlist out of FFmpeg's short HLS segments.
+
+    FFmpeg is run with `-hls_time <part target>` and `split_by_time`, so every
+    file it PUTs is treated as an `#EXT-X-PART`. Parts are grouped into full
+    segments of roughly `segment_target` seconds, always cut on a keyframe.
+    Readers can block until a given media sequence number and part exist.
+
+    Part and segment names carry the id of the FFmpeg run, so the media
+    sequence restarting at 0 never gives a name new content.
+    """
+
+    def __init__(self, part_target=0.2, segment_target=1.0, window=4):
+        self.part_target = part_target
+        self.segment_target = segment_target
+        self.window = window
+        self.run = ''
+        self._pending = {}
+        self._segments = deque()
+        self._next_part = None
+        self._version = 0
+        self._rendered = None
+        self._cond = threading.Condition()
+
+    def clear(self, run=''):
+        with self._cond:
+            self.run = run
+            self._pending.clear()
+            self._segments.clear()
+            self._next_part = None
+            self._version += 1
+            self._rendered = None
+            self._cond.notify_all()
+
+    def ingest(self, name, data):
+        """Handle a PUT from FFmpeg: a part body or a playlist revision."""
+        if name.endswith('.m3u8'):
+            self._publish(self._parse_durations(data.decode('utf-8', 'replace')))
+            return
+        index = self._index(PART_NAME, name)
+        if index is None:
+            return
+        with self._cond:
+            self._pending[index] = CachedFile(name, data)
+            # Wake readers waiting on the preload hint for this part
+            self._cond.notify_all()
+
+    def _index(self, pattern, name):
+        """Number in a part or segment name of the current run, else None."""
+        match = pattern.search(name)
+        # A late PUT from the previous FFmpeg run must not land in this one
+        if match is None or match.group(1) != self.run:
+            return None
+        return int(match.group(2))
+
+    def _parse_durations(self, text):
+        durations = {}
+        for uri, duration in parse_media_playlist(text):
+            index = self._index(PART_NAME, uri)
+            if index is not None:
+                durations[index] = duration
+        return durations
+
+    def _publish(self, durations):
+        with self._cond:
+            for index in sorted(durations):
+                if self._next_part is not None and index < self._next_part:
+                    continue
+                file = self._pending.pop(index, None)
+                if file is None:
+                    continue
+                self._append(Part(index, file, durations[index], starts_with_keyframe(file.data)))
+                self._next_part = index + 1
+            # Drop bodies FFmpeg has already rotated out of its own playlist
+            for index in [i for i in self._pending if self._next_part and i < self._next_part]:
+                del self._pending[index]
+            self._version += 1
+            self._rendered = None
+            self._cond.notify_all()
+
+    def _append(self, part):
+        current = self._segments[-1] if self._segments else None
+        if current is None or (part.independent and current.duration >= self.segment_target - self.part_target / 2):
+            if current is not None:
+                current.complete = True
+            msn = current.msn + 1 if current is not None else 0
+            current = Segment(self.run, msn)
+            self._segments.append(current)
+            while len(self._segments) > self.window + 1:
+                self._segments.popleft()
+        current.parts.append(part)
+
+    # -- readers --------------------------------------------------------
+
+    @property
+    def ready(self):
+        # Joinable once a part starting with a keyframe has been published
+        with self._cond:
+            return self._join_offset() is not None
+
+    def _join_offset(self):
+        """Seconds from the newest independent part to the live edge, or None."""
+        offset = 0.0
+        for segment in reversed(self._segments):
+            for part in reversed(segment.parts):
+                offset += part.duration
+                if part.independent:
+                    return offset
+        return None
+
+    def keyframe_part(self):
+        """The newest published part that starts with a keyframe."""
+        with self._cond:
+            for segment in reversed(self._segments):
+                for part in reversed(segment.parts):
+                    if part.independent:
+                        return part.file
+        return None
+
+    def completed_segments(self, after=-1):
+        """(msn, file, duration) of the finished segments with msn > `after`."""
+        with self._cond:
+            segments = [segment for segment in self._segments if segment.complete and segment.msn > after]
+        return [(segment.msn, segment.file, segment.duration) for segment in segments]
+
+    def newest_msn(self):
+        """Media sequence number of the newest finished segment, or None."""
+        with self._cond:
+            for segment in reversed(self._segments):
+                if segment.complete:
+                    return segment.msn
+        return None
+
+    def _last_position(self):
+        current = self._segments[-1]
+        return current.msn, len(current.parts) - 1
+
+    def _has(self, msn, part):
+        if not self._segments:
+            return False
+        last_msn, last_part = self._last_position()
+        if part is None:
+            # Without _HLS_part the whole segment has to be finished
+            return msn < last_msn
+        return (msn, part) <= (last_msn, last_part)
+
+    def wait_for(self, msn, part=None, timeout=3.0):
+        """Block until segment `msn` (and part `part` of it) is published.
+
+        Returns False on timeout. Raises BlockingRequestError when the request
+        is too far in the future to ever be answered, per the LL-HLS spec.
+        """
+        with self._cond:
+            if self._segments and msn > self._segments[-1].msn + 2:
+                raise BlockingRequestError(f"_HLS_msn={msn} is too far ahead")
+            return self._cond.wait_for(lambda: self._has(msn, part), timeout=timeout)
+
+    def wait_for_part(self, name, timeout=3.0):
+        """Block on a preload hint until the named part has been received."""
+        index = self._index(PART_NAME, name)
+        if index is None:
+            return None
+        with self._cond:
+            if self._next_part is not None and index > self._next_part:
+                return None
+            self._cond.wait_for(lambda: self._find_part(index) is not None, timeout=timeout)
+            return self._find_part(index)
+
+    def _find_part(self, index):
+        if index in self._pending:
+            return self._pending[index]
+        for segment in self._segments:
+            for part in segment.parts:
+                if part.index == index:
+                    return part.file
+        return None
+
+    def get(self, name):
+        with self._cond:
+            msn = self._index(SEGMENT_NAME, name)
+            if msn is not None:
+                for segment in self._segments:
+                    if segment.msn == msn:
+                        return segment.file
+                return None
+            index = self._index(PART_NAME, name)
+            if index is not None:
+                return self._find_part(index)
+        return None
+
+    def playlist(self):
+        with self._cond:
+            if self._rendered is None:
+                self._rendered = CachedFile('playlist.m3u8', self._render().encode())
+            return self._rendered
+
+    def _render(self):
+        segments = list(self._segments)
+        # EXTINF values rounded to the nearest integer must not exceed the target
+        target = max([round(s.duration) for s in segments if s.complete] + [math.ceil(self.segment_target)])
+        lines = [
+            '#EXTM3U',
+            '#EXT-X-VERSION:9',
+            f'#EXT-X-TARGETDURATION:{target}',
+            f'#EXT-X-SERVER-CONTROL:CAN-BLOCK-RELOAD=YES,PART-HOLD-BACK={self.part_target * 3:.3f}',
+            f'#EXT-X-PART-INF:PART-TARGET={self.part_target:.3f}',
+            f'#EXT-X-MEDIA-SEQUENCE:{segments[0].msn if segments else 0}',
+            '#EXT-X-INDEPENDENT-SEGMENTS',
+        ]
+        join_offset = self._join_offset()
+        if join_offset is not None:
+            # Joining players start at the newest keyframe instead of PART-HOLD-BACK
+            lines.append(f'#EXT-X-START:TIME-OFFSET=-{join_offset:.3f},PRECISE=YES')
+        for position, segment in enumerate(segments):
+            # Parts are only advertised for the segments close to the live edge
+            if position >= len(segments) - 3:
+                for part in segment.parts:
+                    attrs = f'DURATION={part.duration:.5f},URI="{part.file.name}"'
+                    if part.independent:
+                        attrs += ',INDEPENDENT=YES'
+                    lines.append(f'#EXT-X-PART:{attrs}')
+            if segment.complete:
+                lines.append(f'#EXTINF:{segment.duration:.5f},')
+                lines.append(segment.name)
+        if self._next_part is not None:
+            lines.append(f'#EXT-X-PRELOAD-HINT:TYPE=PART,URI="part_{self.run}_{self._next_part}.ts"')
+        return '\n'.join(lines) + '\n'
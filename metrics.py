@@ -0,0 +1,119 @@
+import threading
+import time
+from collections import deque
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_progress_block(fields):
+    """Turn one `key=value` block from `-progress` into a metrics sample."""
+    bitrate = fields.get('bitrate', '')
+    speed = fields.get('speed', '')
+    out_time_us = _number(fields.get('out_time_us') or fields.get('out_time_ms'))
+    return {
+        'frame': _number(fields.get('frame')),
+        'fps': _number(fields.get('fps')),
+        'bitrate_kbps': _number(bitrate[:-len('kbits/s')]) if bitrate.endswith('kbits/s') else None,
+        'total_size': _number(fields.get('total_size')),
+        'out_time_s': out_time_us / 1e6 if out_time_us is not None else None,
+        'dup_frames': _number(fields.get('dup_frames')),
+        'drop_frames': _number(fields.get('drop_frames')),
+        'speed': _number(speed.rstrip('x')) if speed else None,
+    }
+
+
+class EncoderMetrics:
+    """Bounded time series of FFmpeg progress samples for one pipeline.
+
+    FFmpeg reports roughly every 0.5 s, so the default of 600 samples keeps
+    about five minutes of history.
+    """
+
+    def __init__(self, maxlen=600, behind_threshold=0.95):
+        self.behind_threshold = behind_threshold
+        self._samples = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def add(self, fields):
+        sample = parse_progress_block(fields)
+        sample['time'] = time.time()
+        with self._lock:
+            self._samples.append(sample)
+        return sample
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+
+    @property
+    def latest(self):
+        with self._lock:
+            return self._samples[-1] if self._samples else None
+
+    def series(self, since=None):
+        with self._lock:
+            samples = list(self._samples)
+        if since is not None:
+            samples = [s for s in samples if s['time'] > since]
+        return samples
+
+    def summary(self, window=10):
+        """Latest values plus whether the encoder is slower than real time."""
+        with self._lock:
+            recent = list(self._samples)[-window:]
+        if not recent:
+            return {'samples': 0, 'latest': None, 'avg_speed': None, 'behind_realtime': False}
+        speeds = [s['speed'] for s in recent if s['speed'] is not None]
+        avg_speed = sum(speeds) / len(speeds) if speeds else None
+        return {
+            'samples': len(self._samples),
+            'latest': recent[-1],
+            'avg_speed': round(avg_speed, 3) if avg_speed is not None else None,
+            'behind_realtime': avg_speed is not None and avg_speed < self.behind_threshold,
+        }
+
+
+class ViewerActivity:
+    """When each viewer last fetched something from a camera.
+
+    Viewers are keyed by the caller (address and user agent); anyone silent
+    for longer than `window` seconds no longer counts as watching.
+    """
+
+    def __init__(self, window=30.0):
+        self.window = window
+        self.last_seen = None
+        self._viewers = {}
+        self._lock = threading.Lock()
+
+    def touch(self, viewer):
+        now = time.time()
+        with self._lock:
+            self._viewers[viewer] = now
+            self.last_seen = now
+            if len(self._viewers) > 1000:
+                self._prune(now)
+
+    def _prune(self, now):
+        cutoff = now - self.window
+        for viewer in [v for v, seen in self._viewers.items() if seen < cutoff]:
+            del self._viewers[viewer]
+
+    def count(self):
+        with self._lock:
+            self._prune(time.time())
+            return len(self._viewers)
+
+    def idle_for(self, since=None):
+        """Seconds since the last viewer request or `since`, whichever is later.
+
+        `since` is when the stream became ready, so viewers of an earlier run
+        do not make a stream that was just started look idle.
+        """
+        last = max(self.last_seen or 0, since or 0)
+        return time.time() - last if last else 0.0
@@ -0,0 +1,1068 @@
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import signal
+import subprocess
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+from segment_store import CachedFile, SegmentRing, media_sequence, parse_media_playlist
+from llhls import LowLatencyPlaylist
+from probe import camera_key, probe_stream, passthrough_verdict
+from metrics import EncoderMetrics, ViewerActivity
+from fmp4 import FragmentBroadcaster
+from snapshot import SnapshotCache
+from dvr import DvrStore
+from motion import MotionDetector, motion_output_args, np
+
+logger = logging.getLogger(__name__)
+
+CAMERA_NAME = re.compile(r'^[A-Za-z0-9_-]+$')
+# Number of the media file in FFmpeg's "Opening '...segment_18f3a2c4e01_007.ts' for writing"
+OPENED_SEGMENT = re.compile(r"(\d+)\.ts'")
+HLS_ROOT = os.path.join('static', 'hls')
+DVR_ROOT = os.path.join('static', 'dvr')
+
+# Per-camera settings; every key can be overridden in the cameras file
+DEFAULT_SETTINGS = {
+    'storage': 'memory',
+    'hls_mode': 'standard',
+    'ring_size': 8,
+    'll_part_target': 0.2,
+    'll_segment_target': 1.0,
+    'stream_mode': 'encode',
+    'max_passthrough_gop': 2.0,
+    'autostart': True,
+    # Start on the first playlist request and stop after idle_timeout seconds
+    # without viewer requests
+    'on_demand': False,
+    'idle_timeout': 60.0,
+    # Adaptive bitrate renditions encoded from one decode, see parse_ladder()
+    'ladder': [],
+    # Also push fragmented MP4 to WebSocket clients (/ws/<camera>)
+    'push': False,
+    # Keep finished segments in the rolling DVR store (/dvr/<camera>/...)
+    'record': False,
+    # Analyse a small grayscale copy of the video for motion (/motion/<camera>):
+    # frames per second, grey-level change per pixel, and moving share of the frame
+    'motion': False,
+    'motion_fps': 5,
+    'motion_threshold': 25,
+    'motion_min_area': 0.01,
+}
+
+
+def v380_stream_url(username, password, ip, port=554, path='/ch01/0'):
+    return f"rtsp://{username}:{password}@{ip}:{port}{path}"
+
+
+def run_id():
+    """Millisecond timestamp in hex, e.g. '18f3a2c4e01', unique per FFmpeg run."""
+    return f'{int(time.time() * 1000):x}'
+
+
+def parse_ladder(value):
+    """Normalise an ABR ladder to a list of {name, height, bitrate} rungs.
+
+    Accepts the cameras file form (a list of objects) or the ABR_LADDER
+    environment form "1080p:1080:4500k,720p:720:2500k,360p:360:800k".
+    """
+    if not value:
+        return []
+    if isinstance(value, str):
+        rungs = []
+        for item in value.split(','):
+            name, height, bitrate = item.strip().split(':')
+            rungs.append({'name': name, 'height': height, 'bitrate': bitrate})
+        value = rungs
+    ladder = []
+    for rung in value:
+        name = str(rung['name'])
+        if not CAMERA_NAME.match(name):
+            raise ValueError(f"Invalid rendition name {name!r}")
+        bitrate = str(rung['bitrate'])
+        kbps = int(bitrate[:-1]) if bitrate.lower().endswith('k') else int(bitrate) // 1000
+        ladder.append({'name': name, 'height': int(rung['height']), 'kbps': kbps})
+    return ladder
+
+
+def load_camera_config(path):
+    """Read the cameras file: {"cameras": {"<name>": {"url": ..., ...}}}.
+
+    A camera gives either a full `url` or the V380 `ip`, `username` and
+    `password`. Any other key overrides the matching DEFAULT_SETTINGS entry.
+    """
+    with open(path) as f:
+        data = json.load(f)
+    cameras = OrderedDict()
+    for name, entry in data.get('cameras', {}).items():
+        if not CAMERA_NAME.match(name):
+            raise ValueError(f"Invalid camera name {name!r}")
+        entry = dict(entry)
+        if 'url' not in entry:
+            try:
+                entry['url'] = v380_stream_url(entry['username'], entry['password'], entry['ip'])
+            except KeyError as e:
+                raise ValueError(f"Camera {name!r} needs a url or ip/username/password (missing {e})")
+        cameras[name] = entry
+    if not cameras:
+        raise ValueError(f"No cameras defined in {path}")
+    return cameras
+
+
+class Pipeline:
+    """One camera: its FFmpeg process, HLS output namespace and probe state."""
+
+    def __init__(self, registry, name, url, settings, config=None):
+        self.registry = registry
+        self.name = name
+        self.url = url
+        self.settings = settings
+        # The raw cameras file entry, e.g. credentials for other services
+        self.config = config or {}
+        self.storage = settings['storage']
+        self.hls_mode = settings['hls_mode']
+        self.ladder = parse_ladder(settings['ladder'])
+        if self.ladder and self.hls_mode == 'll':
+            logger.warning(f"[{name}] LL-HLS does not support an ABR ladder, using standard HLS")
+            self.hls_mode = 'standard'
+        self.push = bool(settings['push'])
+        if self.push and self.ladder:
+            logger.warning(f"[{name}] WebSocket push does not support an ABR ladder, disabling push")
+            self.push = False
+        if self.hls_mode == 'll' and self.storage != 'memory':
+            logger.warning(f"[{name}] hls_mode=ll needs memory storage, falling back to memory storage")
+            self.storage = 'memory'
+        self.hls_dir = os.path.join(registry.hls_root, name)
+        # Rolling recording of finished segments, only used when record is enabled
+        self.dvr = None
+        if settings['record']:
+            self.dvr = DvrStore(os.path.join(registry.dvr_root, name), max_age=registry.dvr_max_age,
+                                max_bytes=registry.dvr_max_bytes, chunk_seconds=registry.dvr_chunk_seconds)
+            if settings['on_demand']:
+                logger.warning(f"[{name}] Recording keeps the camera running, disabling on_demand")
+                settings['on_demand'] = False
+        # Motion events from the grayscale side output, only used when motion is enabled
+        self.motion = None
+        if settings['motion']:
+            if np is None:
+                logger.warning(f"[{name}] Motion detection needs numpy, disabling motion")
+            else:
+                self.motion = MotionDetector(threshold=settings['motion_threshold'],
+                                             min_area=settings['motion_min_area'])
+        # Sequence number of the last segment recorded in this FFmpeg run
+        self._recorded = None
+        self._record_lock = threading.Lock()
+        self.ingest_base = f"{registry.ingest_base}/{name}"
+        # In-memory segments and playlist, only used with memory storage
+        self.ring = SegmentRing(capacity=settings['ring_size'] * max(1, len(self.ladder)))
+        self._master = None
+        # Part/segment index for Low-Latency HLS, only used when hls_mode is 'll'
+        self.ll_playlist = LowLatencyPlaylist(part_target=settings['ll_part_target'],
+                                              segment_target=settings['ll_segment_target'])
+        # Part of every media file name, new for each FFmpeg run so a name is
+        # never reused for different content and caches may keep it forever
+        self.run_id = run_id()
+        # fMP4 fragments for WebSocket viewers, only used when push is enabled
+        self.fragments = FragmentBroadcaster()
+        # JPEGs of the latest keyframe, keyed by source segment
+        self.snapshots = SnapshotCache()
+        self.process = None
+        # 'copy' or 'encode', whichever path the running FFmpeg process uses
+        self.active_pipeline = None
+        self._holds_encoder_slot = False
+        self._slot_lock = threading.Lock()
+        # Signalled when the first playlist appears or FFmpeg exits
+        self._startup = threading.Condition()
+        self.ready_at = None
+        self._exited = False
+        self._stderr_tail = deque(maxlen=50)
+        self._job = None
+        # Live encoder statistics parsed from FFmpeg's -progress output
+        self.metrics = EncoderMetrics()
+        # Supervision: whether someone asked for the stream, when media last
+        # moved, and the restart incident currently being handled
+        self.desired_running = False
+        self.last_segment_at = None
+        self.last_media_at = None
+        self._last_out_time = None
+        # Number of the newest media file FFmpeg has finished this run
+        self.last_segment = None
+        self.incident = None
+        # Watchdog incidents (and failed restarts) since the stream last stayed
+        # healthy; the watchdog resets it, and it drives the restart backoff
+        self.restart_failures = 0
+        self.last_restart_at = 0.0
+        self._incident_lock = threading.Lock()
+        self._cancel_restart = threading.Event()
+        # Viewer requests seen by the HLS routes, used for on-demand shutdown
+        self.viewers = ViewerActivity()
+        # Serialises start/stop; status readers never take it
+        self._lock = threading.RLock()
+
+    @property
+    def key(self):
+        return camera_key(self.url)
+
+    # -- command line ---------------------------------------------------
+
+    def _probe(self):
+        try:
+            logger.info(f"[{self.name}] Probing camera stream for passthrough compatibility...")
+            info = probe_stream(self.url)
+        except Exception as e:
+            logger.error(f"[{self.name}] Probe failed: {e}")
+            return None
+        compatible, reason = passthrough_verdict(info, max_gop=self.settings['max_passthrough_gop'])
+        return self.registry.probe_cache.update(self.key, probe=info, probed_at=time.time(),
+                                                compatible=compatible, reason=reason)
+
+    def choose_pipeline(self):
+        mode = self.settings['stream_mode']
+        if self.ladder:
+            # Every rung is a scaled re-encode of the single decode
+            return 'encode'
+        if mode in ('encode', 'copy'):
+            return mode
+        cache = self.registry.probe_cache
+        # On-demand cold starts reuse the last probe even when it has expired
+        # and refresh it in the background, keeping ffprobe off the start path
+        entry = cache.get(self.key, allow_stale=self.settings['on_demand'])
+        if entry is None:
+            entry = self._probe()
+            if entry is None:
+                logger.error(f"[{self.name}] Falling back to encode")
+                return 'encode'
+        else:
+            logger.info(f"[{self.name}] Using cached probe result")
+            if cache.is_stale(entry):
+                threading.Thread(target=self._probe, daemon=True, name=f"probe-{self.name}").start()
+        logger.info(f"[{self.name}] Passthrough {'enabled' if entry['compatible'] else 'disabled'}: {entry['reason']}")
+        return 'copy' if entry['compatible'] else 'encode'
+
+    def video_args(self, pipeline):
+        if pipeline == 'copy':
+            return ['-c:v', 'copy']
+        if self.ladder:
+            return self.ladder_args(self.ladder)
+        return [
+            '-c:v', 'libx264',
+            '-preset', 'ultrafast',
+            '-tune', 'zerolatency',
+            '-profile:v', 'baseline',
+            '-level', '3.0',
+            '-fps_mode', 'cfr',
+            '-r', '30',
+            '-g', '30',
+            '-keyint_min', '30',
+            '-sc_threshold', '0',
+            '-bufsize', '2000k',
+            '-maxrate', '2000k',
+            '-crf', '28',
+            '-pix_fmt', 'yuv420p',
+            '-x264-params', 'no-scenecut=1:rc-lookahead=0:sync-lookahead=0:ref=1:bframes=0:b-adapt=0:force-cfr=1',
+        ]
+
+    @staticmethod
+    def ladder_args(ladder):
+        """Decode once, split the frames and encode one stream per rung."""
+        labels = ''.join(f'[v{i}]' for i in range(len(ladder)))
+        graph = [f'[0:v]split={len(ladder)}{labels}']
+        graph += [f'[v{i}]scale=-2:{rung["height"]}[o{i}]' for i, rung in enumerate(ladder)]
+        args = ['-filter_complex', ';'.join(graph)]
+        for i, rung in enumerate(ladder):
+            args += [
+                '-map', f'[o{i}]',
+                f'-b:v:{i}', f'{rung["kbps"]}k',
+                f'-maxrate:v:{i}', f'{rung["kbps"]}k',
+                f'-bufsize:v:{i}', f'{rung["kbps"]}k',
+            ]
+        return args + [
+            '-c:v', 'libx264',
+            '-preset', 'ultrafast',
+            '-tune', 'zerolatency',
+            '-profile:v', 'baseline',
+            '-fps_mode', 'cfr',
+            '-r', '30',
+            '-g', '30',
+            '-keyint_min', '30',
+            '-sc_threshold', '0',
+            '-pix_fmt', 'yuv420p',
+            '-x264-params', 'no-scenecut=1:rc-lookahead=0:sync-lookahead=0:ref=1:bframes=0:b-adapt=0:force-cfr=1',
+        ]
+
+    def master_playlist(self):
+        """Master playlist for the ladder, generated once from the configuration."""
+        if self._master is None:
+            lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-INDEPENDENT-SEGMENTS']
+            for rung in self.ladder:
+                # Assume 16:9 since scale=-2 keeps the camera's aspect ratio
+                width = round(rung['height'] * 16 / 9 / 2) * 2
+                bandwidth = int(rung['kbps'] * 1000 * 1.1)
+                lines.append(f'#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},RESOLUTION={width}x{rung["height"]}')
+                lines.append(f'{rung["name"]}/playlist.m3u8')
+            self._master = CachedFile('master.m3u8', ('\n'.join(lines) + '\n').encode())
+        return self._master
+
+    def hls_output_args(self):
+        if self.hls_mode == 'll':
+            part_target = str(self.settings['ll_part_target'])
+            # Short split_by_time segments become the LL-HLS parts; the server
+            # groups them into full segments and writes the real playlist
+            return [
+                '-f', 'hls',
+                '-method', 'PUT',
+                '-hls_time', part_target,
+                '-hls_init_time', part_target,
+                '-hls_list_size', '10',
+                '-hls_flags', 'split_by_time+discont_start+omit_endlist',
+                '-hls_segment_type', 'mpegts',
+                '-hls_allow_cache', '0',
+                '-start_number', '0',
+                '-hls_segment_filename', f'{self.ingest_base}/part_{self.run_id}_%d.ts',
+                f'{self.ingest_base}/parts.m3u8'
+            ]
+        base = self.ingest_base if self.storage == 'memory' else self.hls_dir
+        variants = []
+        if self.ladder:
+            # %v expands to the rendition name: <base>/<rendition>/segment_<run>_000.ts
+            variants = ['-var_stream_map', ' '.join(f'v:{i},name:{rung["name"]}' for i, rung in enumerate(self.ladder))]
+            base = f'{base}/%v'
+        return [
+            '-f', 'hls',
+            '-method', 'PUT',
+            '-hls_time', '1',
+            '-hls_init_time', '1',
+            '-hls_list_size', '3',
+            '-hls_flags', 'delete_segments+discont_start+omit_endlist+independent_segments',
+            '-hls_segment_type', 'mpegts',
+            '-hls_allow_cache', '0',
+            '-start_number', '0',
+            *variants,
+            '-hls_segment_filename', f'{base}/segment_{self.run_id}_%03d.ts',
+            f'{base}/playlist.m3u8'
+        ]
+
+    @staticmethod
+    def tee_slave(args):
+        """Turn ['-f', 'hls', '-opt', 'value', ..., target] into a tee muxer slave."""
+        *options, target = args
+        pairs = []
+        for i in range(0, len(options), 2):
+            # Escaped for the option parser, then again for the slave list
+            value = options[i + 1].replace('\\', '\\\\').replace(':', '\\:').replace(']', '\\]')
+            value = value.replace('\\', '\\\\').replace('|', '\\|')
+            pairs.append(f"{options[i].lstrip('-')}={value}")
+        return f"[{':'.join(pairs)}]{target}"
+
+    def output_args(self, push_fd=None):
+        if push_fd is None:
+            return self.hls_output_args()
+        # The tee muxer writes one encode twice: HLS as usual plus a
+        # fragmented MP4 stream on the push pipe, a fragment per keyframe
+        # and at most every half second in between
+        push = self.tee_slave([
+            '-f', 'mp4',
+            '-select', 'v',
+            '-onfail', 'ignore',
+            '-movflags', 'frag_keyframe+empty_moov+default_base_moof',
+            '-frag_duration', '500000',
+            f'pipe:{push_fd}'
+        ])
+        # Global headers give the MP4 avcC its SPS/PPS; dump_extra puts them
+        # back in front of every keyframe for the MPEG-TS segments
+        hls = self.hls_output_args()
+        hls = self.tee_slave([*hls[:2], '-bsfs/v', 'dump_extra=freq=keyframe', *hls[2:]])
+        return ['-map', '0:v', '-map', '0:a?', '-flags:v', '+global_header', '-f', 'tee', f'{hls}|{push}']
+
+    def build_command(self, pipeline, push_fd=None, motion_fd=None):
+        motion = motion_output_args(motion_fd, self.settings['motion_fps']) if motion_fd is not None else []
+        return [
+            'ffmpeg',
+            '-y',
+            # Machine readable progress on stdout instead of the stats line
+            '-progress', 'pipe:1',
+            '-nostats',
+            '-fflags', 'nobuffer+genpts+igndts+discardcorrupt+flush_packets',
+            '-flags', 'low_delay',
+            '-rtsp_transport', 'tcp',
+            '-rtsp_flags', 'prefer_tcp',
+            '-probesize', '32',
+            '-analyzeduration', '0',
+            '-timeout', '5000000',
+            '-use_wallclock_as_timestamps', '1',
+            '-i', self.url,
+            *self.video_args(pipeline),
+            '-max_muxing_queue_size', '1024',
+            *self.output_args(push_fd),
+            *motion
+        ]
+
+    # -- state ----------------------------------------------------------
+
+    def is_running(self):
+        process = self.process
+        if process is None:
+            return False
+        if process.poll() is None:
+            return True
+        # Died on its own: hand the encoder slot back
+        self._release_encoder_slot()
+        return False
+
+    def has_playlist(self):
+        if self.hls_mode == 'll':
+            return self.ll_playlist.ready
+        if self.storage == 'memory':
+            return self.ring.playlist is not None
+        first = os.path.join(self.ladder[0]['name'], 'playlist.m3u8') if self.ladder else 'playlist.m3u8'
+        return os.path.exists(os.path.join(self.hls_dir, first))
+
+    def cpu_percent(self):
+        """Average CPU usage of FFmpeg since it started, in % of one core."""
+        process = self.process
+        if not process or process.poll() is not None:
+            return None
+        try:
+            with open(f'/proc/{process.pid}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            ticks = os.sysconf('SC_CLK_TCK')
+            cpu_seconds = (int(fields[11]) + int(fields[12])) / ticks
+            with open('/proc/uptime') as f:
+                uptime = float(f.read().split()[0])
+            elapsed = uptime - int(fields[19]) / ticks
+        except (OSError, ValueError, IndexError):
+            return None
+        return round(100 * cpu_seconds / elapsed, 1) if elapsed > 0 else None
+
+    def health(self):
+        """Compact live state for the status broadcaster, cheap enough to read every second."""
+        is_running = self.is_running()
+        incident = self.incident
+        if incident and incident['state'] in ('pending', 'restarting'):
+            state = 'restarting'
+        elif is_running and self.ready_at is not None:
+            state = 'running'
+        elif is_running or (self._job is not None and self._job.state == 'starting'):
+            state = 'starting'
+        else:
+            state = 'stopped'
+        summary = self.metrics.summary() if is_running else None
+        speed = summary['avg_speed'] if summary else None
+        segment_at = self.last_segment_at if is_running else None
+        if self.hls_mode == 'll':
+            segment = self.ll_playlist.newest_msn() if is_running else None
+        else:
+            segment = self.last_segment if is_running else None
+        return {
+            "camera": self.name,
+            "state": state,
+            "segment": segment,
+            "segment_age": round(time.time() - segment_at, 1) if segment_at else None,
+            "speed": round(speed, 2) if speed is not None else None,
+            "behind_realtime": bool(summary and summary['behind_realtime']),
+            "viewers": self.viewers.count(),
+        }
+
+    def status(self):
+        is_running = self.is_running()
+        playlist_ready = self.has_playlist()
+        cpu_percent = self.cpu_percent()
+        cpu_saved = None
+        if self.active_pipeline == 'copy' and cpu_percent is not None:
+            encode_cpu = self.registry.probe_cache.entry(self.key).get('encode_cpu_percent')
+            if encode_cpu is not None:
+                cpu_saved = round(encode_cpu - cpu_percent, 1)
+        return {
+            "camera": self.name,
+            "status": "running" if is_running and playlist_ready else "stopped",
+            "has_playlist": playlist_ready,
+            "process_running": is_running,
+            "storage": self.storage,
+            "mode": self.hls_mode,
+            "renditions": [rung['name'] for rung in self.ladder],
+            "pipeline": self.active_pipeline if is_running else None,
+            "cpu_percent": cpu_percent,
+            "cpu_saved_percent": cpu_saved,
+            "segments_cached": len(self.ring),
+            "encoder": self.metrics.summary() if is_running else None,
+            "incident": dict(self.incident) if self.incident else None,
+            "restart_failures": self.restart_failures,
+            "on_demand": self.settings['on_demand'],
+            "viewers": self.viewers.count(),
+            "push_clients": self.fragments.client_count() if self.push else None,
+            "snapshot_decodes": self.snapshots.decodes,
+            "dvr": self.dvr.info() if self.dvr is not None else None,
+            "motion_frames": self.motion.frames if self.motion is not None else None
+        }
+
+    def _keyframe_source(self):
+        """(name, load) for the newest media file that starts with a keyframe, or None."""
+        if self.hls_mode == 'll':
+            item = self.ll_playlist.keyframe_part()
+        elif self.storage == 'memory':
+            item = self.ring.keyframe_segment()
+        else:
+            # Standard HLS segments on disk always begin with a keyframe
+            rendition = self.ladder[0]['name'] if self.ladder else ''
+            playlist = os.path.join(self.hls_dir, rendition, 'playlist.m3u8')
+            try:
+                with open(playlist) as f:
+                    entries = parse_media_playlist(f.read())
+            except FileNotFoundError:
+                return None
+            if not entries:
+                return None
+            name = os.path.join(rendition, entries[-1][0])
+
+            def load():
+                with open(os.path.join(self.hls_dir, name), 'rb') as f:
+                    return f.read()
+            return name, load
+        if item is None:
+            return None
+        return item.name, lambda: item.data
+
+    def snapshot(self, width=0):
+        """JPEG of the latest keyframe as a CachedFile, or None before the first one."""
+        source = self._keyframe_source()
+        if source is None:
+            return None
+        name, load = source
+        return self.snapshots.get(name, load, width)
+
+    # -- lifecycle ------------------------------------------------------
+
+    def _reset_output(self):
+        if self.storage == 'disk':
+            # Ensure the hls directory exists and has proper permissions
+            os.makedirs(self.hls_dir, exist_ok=True)
+            os.chmod(self.hls_dir, 0o777)
+            # Clean up any existing HLS files
+            for file in os.listdir(self.hls_dir):
+                file_path = os.path.join(self.hls_dir, file)
+                try:
+                    if os.path.isdir(file_path):
+                        shutil.rmtree(file_path)
+                    else:
+                        os.remove(file_path)
+                    logger.info(f"Cleaned up {file_path}")
+                except Exception as e:
+                    logger.error(f"Error cleaning up {file_path}: {e}")
+        self.run_id = run_id()
+        self.ring.clear()
+        self.ll_playlist.clear(self.run_id)
+        self.fragments.reset()
+        # Frames of the previous run's segments are never asked for again
+        self.snapshots.clear()
+        with self._record_lock:
+            self._recorded = None
+        if self.motion is not None:
+            self.motion.reset()
+
+    def _release_encoder_slot(self):
+        with self._slot_lock:
+            if self._holds_encoder_slot:
+                self._holds_encoder_slot = False
+                self.registry.encoder_slots.release()
+
+    def _mark_ready(self):
+        with self._startup:
+            if self.ready_at is None and self.has_playlist():
+                self.ready_at = time.time()
+                self._startup.notify_all()
+
+    def _read_stderr(self, process):
+        # The HLS muxer logs "Opening '...' for writing" for every file it
+        # creates, which is how disk output learns that a playlist exists
+        for line in process.stderr:
+            self._stderr_tail.append(line.rstrip())
+            if 'Opening ' in line:
+                if ".ts" in line:
+                    self.last_segment_at = time.time()
+                    opened = OPENED_SEGMENT.search(line)
+                    if opened and int(opened.group(1)) > 0:
+                        # Opening file n means file n - 1 is complete
+                        self.last_segment = int(opened.group(1)) - 1
+                    # The previous segment and the playlist listing it are complete
+                    if self.dvr is not None and self.storage == 'disk':
+                        self._record_new_segments()
+                if self.ready_at is None:
+                    self._mark_ready()
+        with self._startup:
+            if process is self.process:
+                self._exited = True
+            self._startup.notify_all()
+
+    def _read_progress(self, process):
+        # Both pipes are drained for the whole life of the process; a full
+        # pipe buffer would otherwise block FFmpeg's writes and stall encoding
+        fields = {}
+        for line in process.stdout:
+            key, sep, value = line.strip().partition('=')
+            if not sep:
+                continue
+            fields[key] = value
+            if key == 'progress':
+                sample = self.metrics.add(fields)
+                out_time = sample['out_time_s']
+                if out_time is not None and (self._last_out_time is None or out_time > self._last_out_time):
+                    self._last_out_time = out_time
+                    self.last_media_at = sample['time']
+                fields = {}
+
+    def _read_fragments(self, process, push_read):
+        with os.fdopen(push_read, 'rb') as stream:
+            self.fragments.feed(stream)
+        # FFmpeg is gone: disconnect its WebSocket clients so they rejoin the
+        # next run, unless that run has already started publishing
+        if self.process in (process, None):
+            self.fragments.reset()
+
+    def _read_motion(self, process, motion_read):
+        with os.fdopen(motion_read, 'rb') as stream:
+            self.motion.feed(stream)
+        if self.process in (process, None):
+            self.motion.reset()
+
+    def wait_ready(self, timeout):
+        """Block until the first playlist exists or FFmpeg exits; True if ready."""
+        with self._startup:
+            self._startup.wait_for(lambda: self.ready_at is not None or self._exited, timeout=timeout)
+            return self.ready_at is not None
+
+    def start(self, max_wait=10):
+        """Start FFmpeg and wait for the first playlist. Returns (ok, message)."""
+        with self._lock:
+            self.desired_running = True
+            if self.is_running():
+                return True, "Stream already running"
+            self.process = None
+            # Side outputs written to inherited pipes: name -> [read fd, write fd]
+            pipes = {}
+            try:
+                logger.info(f"[{self.name}] Starting FFmpeg process...")
+                self._reset_output()
+                pipeline = self.choose_pipeline()
+                if pipeline == 'encode':
+                    if not self.registry.encoder_slots.acquire(timeout=self.registry.encoder_wait):
+                        logger.error(f"[{self.name}] All {self.registry.encoder_limit} encoder slots are busy")
+                        return False, "Encoder limit reached"
+                    self._holds_encoder_slot = True
+                if self.push:
+                    pipes['push'] = list(os.pipe())
+                if self.motion is not None:
+                    pipes['motion'] = list(os.pipe())
+                command = self.build_command(pipeline, push_fd=pipes['push'][1] if 'push' in pipes else None,
+                                             motion_fd=pipes['motion'][1] if 'motion' in pipes else None)
+                logger.info(f"[{self.name}] FFmpeg command: %s", ' '.join(command).replace(self.url, '<camera>'))
+
+                self.registry.wait_for_spawn_turn()
+                with self._startup:
+                    self.ready_at = None
+                    self._exited = False
+                    self._stderr_tail.clear()
+                    self.metrics.clear()
+                    self.last_segment_at = None
+                    self.last_media_at = None
+                    self._last_out_time = None
+                    self.last_segment = None
+                    # Start ffmpeg process and capture output
+                    self.process = subprocess.Popen(
+                        command,
+                        stdout=subprocess.PIPE,
+                        stderr=subprocess.PIPE,
+                        universal_newlines=True,
+                        pass_fds=tuple(write for _, write in pipes.values())
+                    )
+                self.active_pipeline = pipeline
+                threading.Thread(target=self._read_stderr, args=(self.process,), daemon=True,
+                                 name=f"stderr-{self.name}").start()
+                threading.Thread(target=self._read_progress, args=(self.process,), daemon=True,
+                                 name=f"progress-{self.name}").start()
+                readers = {'push': self._read_fragments, 'motion': self._read_motion}
+                for name, fds in pipes.items():
+                    # Only FFmpeg keeps the write end, so the reader sees EOF when it exits
+                    os.close(fds[1])
+                    fds[1] = None
+                    threading.Thread(target=readers[name], args=(self.process, fds[0]), daemon=True,
+                                     name=f"{name}-{self.name}").start()
+                    fds[0] = None
+
+                # Woken by the first playlist PUT/open or by FFmpeg exiting
+                if self.wait_ready(max_wait):
+                    logger.info(f"[{self.name}] Playlist file created successfully")
+                    return True, "Stream started"
+                if self._exited:
+                    error = '\n'.join(self._stderr_tail) or "No error output"
+                    logger.error(f"[{self.name}] FFmpeg process died: {error}")
+                    self._terminate()
+                    return False, "FFmpeg process died"
+
+                logger.error(f"[{self.name}] Timeout waiting for playlist file")
+                self._terminate()
+                return False, "Timeout waiting for playlist"
+            except Exception as e:
+                logger.error(f"[{self.name}] Error starting FFmpeg: {e}")
+                self._terminate()
+                return False, str(e)
+            finally:
+                for fds in pipes.values():
+                    for fd in fds:
+                        if fd is not None:
+                            os.close(fd)
+
+    def start_async(self, max_wait=10):
+        """Start FFmpeg in the background and return the StartJob tracking it.
+
+        Repeated calls while a start is still in flight return the same job.
+        """
+        with self._startup:
+            if self._job is not None and self._job.state == 'starting':
+                return self._job
+            job = StartJob(self.name)
+            self._job = job
+        self.registry.remember_job(job)
+        if self.is_running() and self.ready_at is not None:
+            job.finish(True, "Stream already running", self.ready_at)
+            return job
+
+        def run():
+            ok, message = self.start(max_wait=max_wait)
+            job.finish(ok, message, self.ready_at)
+
+        threading.Thread(target=run, daemon=True, name=f"start-{self.name}").start()
+        return job
+
+    def stop(self):
+        """Stop the stream on request; the watchdog leaves it stopped."""
+        self.desired_running = False
+        self._cancel_restart.set()
+        with self._incident_lock:
+            if self.incident and self.incident['state'] in ('pending', 'restarting'):
+                self.incident['state'] = 'cancelled'
+        return self._terminate()
+
+    def _terminate(self):
+        with self._lock:
+            process = self.process
+            if process is None:
+                self._release_encoder_slot()
+                logger.info(f"[{self.name}] No FFmpeg process was running")
+                return True
+            try:
+                logger.info(f"[{self.name}] Stopping FFmpeg process...")
+                self.record_encode_cpu()
+                process.send_signal(signal.SIGTERM)
+                try:
+                    process.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    logger.warning(f"[{self.name}] FFmpeg process did not terminate within timeout, forcing kill")
+                    process.kill()
+                    process.wait()
+            except Exception as e:
+                logger.error(f"[{self.name}] Error stopping FFmpeg: {e}")
+                try:
+                    process.kill()
+                except Exception:
+                    pass
+            finally:
+                self.process = None
+                self.ready_at = None
+                self._release_encoder_slot()
+                logger.info(f"[{self.name}] FFmpeg process stopped")
+            return True
+
+    # -- supervision ----------------------------------------------------
+
+    def starting(self):
+        job = self._job
+        return job is not None and job.state == 'starting'
+
+    def health_problem(self, stall_timeout):
+        """Return why a wanted stream is unhealthy, or None if it is fine."""
+        if not self.desired_running or self.starting() or self._lock_is_busy():
+            return None
+        if not self.is_running():
+            return "FFmpeg process exited"
+        now = time.time()
+        if self.ready_at is None:
+            return None
+        # Both clocks start at readiness so a fresh process gets a grace period
+        last_segment = max(self.last_segment_at or 0, self.ready_at)
+        if now - last_segment > stall_timeout:
+            return f"no new segment for {now - last_segment:.0f}s"
+        last_media = max(self.last_media_at or 0, self.ready_at)
+        if now - last_media > stall_timeout:
+            return f"RTSP input stalled for {now - last_media:.0f}s"
+        return None
+
+    def _lock_is_busy(self):
+        # A start or stop is in progress in another thread
+        if self._lock.acquire(blocking=False):
+            self._lock.release()
+            return False
+        return True
+
+    def idle_expired(self):
+        """True when an on-demand stream has had no viewers for idle_timeout."""
+        if not self.settings['on_demand'] or not self.desired_running or self.starting():
+            return False
+        return self.viewers.idle_for(since=self.ready_at) > self.settings['idle_timeout']
+
+    def request_restart(self, reason, source='watchdog'):
+        """Open a restart incident unless one is already being handled.
+
+        Any number of callers reporting the same problem share one incident,
+        and client requests arriving within the cooldown after a restart are
+        answered with the previous incident instead of restarting again.
+        """
+        registry = self.registry
+        now = time.time()
+        with self._incident_lock:
+            incident = self.incident
+            if incident and incident['state'] in ('pending', 'restarting'):
+                incident['reports'] += 1
+                return dict(incident, duplicate=True)
+            if source != 'watchdog' and now - self.last_restart_at < registry.restart_cooldown:
+                return dict(incident or {}, throttled=True,
+                            retry_after=round(registry.restart_cooldown - (now - self.last_restart_at), 1))
+            # Exponential backoff with jitter; the first restart is immediate
+            delay = 0.0
+            if self.restart_failures:
+                delay = min(registry.restart_backoff_max,
+                            registry.restart_backoff * 2 ** (self.restart_failures - 1))
+                delay *= 0.5 + random.random() / 2
+            self.incident = {
+                'id': uuid.uuid4().hex[:12],
+                'camera': self.name,
+                'reason': reason,
+                'source': source,
+                'state': 'pending',
+                'detected_at': now,
+                'restart_at': now + delay,
+                'attempt': self.restart_failures + 1,
+                'reports': 1,
+            }
+            if source == 'watchdog':
+                # A run that produced a playlist and then dropped is no success:
+                # every incident backs off until the watchdog sees a healthy run
+                self.restart_failures += 1
+            self._cancel_restart.clear()
+            logger.warning(f"[{self.name}] Restart scheduled in {delay:.1f}s: {reason}")
+            threading.Thread(target=self._run_restart, args=(self.incident, delay), daemon=True,
+                             name=f"restart-{self.name}").start()
+            return dict(self.incident)
+
+    def _run_restart(self, incident, delay):
+        if self._cancel_restart.wait(delay):
+            return
+        with self._incident_lock:
+            if incident['state'] != 'pending':
+                return
+            incident['state'] = 'restarting'
+        self.desired_running = True
+        self._terminate()
+        ok, message = self.start()
+        with self._incident_lock:
+            self.last_restart_at = time.time()
+            if incident['state'] == 'restarting':
+                incident['state'] = 'resolved' if ok else 'failed'
+                incident['message'] = message
+            if not ok and incident['source'] != 'watchdog':
+                # Watchdog incidents were counted when they were opened
+                self.restart_failures += 1
+        logger.info(f"[{self.name}] Restart {'succeeded' if ok else 'failed'}: {message}")
+
+    def record_encode_cpu(self):
+        # Remember what re-encoding costs so passthrough runs can report the saving
+        cpu = self.cpu_percent()
+        if self.active_pipeline == 'encode' and cpu is not None:
+            self.registry.probe_cache.update(self.key, encode_cpu_percent=cpu)
+
+    # -- HLS data -------------------------------------------------------
+
+    def ingest(self, filename, method, data):
+        if self.hls_mode == 'll':
+            # The LL index trims its own window, so FFmpeg's DELETEs are ignored
+            if method != 'DELETE':
+                self.ll_playlist.ingest(filename, data)
+        elif method == 'DELETE':
+            self.ring.delete(filename)
+        else:
+            self.ring.put(filename, data)
+        if method != 'DELETE' and not filename.endswith('.m3u8'):
+            self.last_segment_at = time.time()
+        if self.ready_at is None and method != 'DELETE':
+            self._mark_ready()
+        if self.dvr is not None and method != 'DELETE' and filename.endswith('.m3u8'):
+            self._record_new_segments()
+
+    def _finished_segments(self):
+        """[(sequence number, load, duration)] of the recorded rendition's current segments."""
+        if self.hls_mode == 'll':
+            return [(msn, lambda file=file: file.data, duration)
+                    for msn, file, duration in self.ll_playlist.completed_segments()]
+        # With a ladder only the first rendition is recorded
+        prefix = f"{self.ladder[0]['name']}/" if self.ladder else ''
+        if self.storage == 'memory':
+            item = self.ring.get(f'{prefix}playlist.m3u8')
+            if item is None:
+                return []
+            text = item.data.decode('utf-8', 'replace')
+
+            def load(uri):
+                segment = self.ring.get(prefix + uri)
+                return segment.data if segment is not None else None
+        else:
+            try:
+                with open(os.path.join(self.hls_dir, prefix, 'playlist.m3u8')) as f:
+                    text = f.read()
+            except FileNotFoundError:
+                return []
+
+            def load(uri):
+                try:
+                    with open(os.path.join(self.hls_dir, prefix, uri), 'rb') as f:
+                        return f.read()
+                except FileNotFoundError:
+                    return None
+        sequence = media_sequence(text)
+        return [(sequence + i, lambda uri=uri: load(uri), duration)
+                for i, (uri, duration) in enumerate(parse_media_playlist(text))]
+
+    def _record_new_segments(self):
+        """Append the segments finished since the last call to the DVR store."""
+        with self._record_lock:
+            try:
+                pending = [entry for entry in self._finished_segments()
+                           if self._recorded is None or entry[0] > self._recorded]
+                # Each segment ended when the ones after it began
+                end = time.time() - sum(duration for _, _, duration in pending)
+                for number, load, duration in pending:
+                    end += duration
+                    data = load()
+                    if data is None:
+                        continue
+                    self.dvr.append(data, duration, discontinuity=self._recorded is None, now=end)
+                    self._recorded = number
+            except OSError as e:
+                logger.error(f"[{self.name}] Could not record segments: {e}")
+
+
+class StartJob:
+    """Tracks one asynchronous pipeline start so clients can wait on it."""
+
+    def __init__(self, camera):
+        self.id = uuid.uuid4().hex[:12]
+        self.camera = camera
+        self.state = 'starting'
+        self.message = None
+        self.created = time.time()
+        self.ready_at = None
+        self._cond = threading.Condition()
+
+    def finish(self, ok, message, ready_at=None):
+        with self._cond:
+            self.state = 'ready' if ok else 'failed'
+            self.message = message
+            self.ready_at = ready_at if ok else None
+            self._cond.notify_all()
+
+    def wait(self, timeout):
+        with self._cond:
+            self._cond.wait_for(lambda: self.state != 'starting', timeout=timeout)
+        return self.to_dict()
+
+    def to_dict(self):
+        startup = None
+        if self.ready_at is not None:
+            startup = round(max(0.0, self.ready_at - self.created), 3)
+        return {
+            "job_id": self.id,
+            "camera": self.camera,
+            "state": self.state,
+            "message": self.message,
+            "startup_seconds": startup
+        }
+
+
+class PipelineRegistry:
+    """All configured cameras plus the limits shared between their encoders.
+
+    At most `encoder_limit` pipelines may run libx264 at once, and process
+    spawns are spaced `startup_stagger` seconds apart so a host bringing up
+    dozens of cameras does not start every encoder in the same instant.
+    """
+
+    def __init__(self, probe_cache, ingest_base, encoder_limit=None, encoder_wait=0.0, startup_stagger=0.5,
+                 restart_backoff=1.0, restart_backoff_max=60.0, restart_cooldown=15.0, hls_root=HLS_ROOT,
+                 dvr_root=DVR_ROOT, dvr_max_age=7 * 86400, dvr_max_bytes=0, dvr_chunk_seconds=3600):
+        self.probe_cache = probe_cache
+        self.ingest_base = ingest_base
+        # Absolute, so FFmpeg and every web worker agree on where disk segments live
+        self.hls_root = os.path.abspath(hls_root)
+        # Retention of the cameras that record: seconds, bytes per camera (0 = no limit)
+        self.dvr_root = os.path.abspath(dvr_root)
+        self.dvr_max_age = dvr_max_age
+        self.dvr_max_bytes = dvr_max_bytes
+        self.dvr_chunk_seconds = dvr_chunk_seconds
+        self.encoder_limit = encoder_limit or os.cpu_count() or 1
+        self.encoder_wait = encoder_wait
+        self.encoder_slots = threading.BoundedSemaphore(self.encoder_limit)
+        self.startup_stagger = startup_stagger
+        self.restart_backoff = restart_backoff
+        self.restart_backoff_max = restart_backoff_max
+        self.restart_cooldown = restart_cooldown
+        self._spawn_lock = threading.Lock()
+        self._next_spawn = 0.0
+        self.pipelines = OrderedDict()
+        self.jobs = OrderedDict()
+        self._jobs_lock = threading.Lock()
+
+    def add(self, name, url, config=None, **overrides):
+        settings = dict(DEFAULT_SETTINGS)
+        settings.update({k: v for k, v in overrides.items() if k in DEFAULT_SETTINGS})
+        pipeline = Pipeline(self, name, url, settings, config=config)
+        self.pipelines[name] = pipeline
+        return pipeline
+
+    def get(self, name):
+        return self.pipelines.get(name)
+
+    @property
+    def default(self):
+        return next(iter(self.pipelines.values()), None)
+
+    def wait_for_spawn_turn(self):
+        with self._spawn_lock:
+            now = time.time()
+            turn = max(now, self._next_spawn)
+            self._next_spawn = turn + self.startup_stagger
+        if turn > now:
+            time.sleep(turn - now)
+
+    def remember_job(self, job, keep=100):
+        with self._jobs_lock:
+            self.jobs[job.id] = job
+            while len(self.jobs) > keep:
+                self.jobs.popitem(last=False)
+
+    def get_job(self, job_id):
+        with self._jobs_lock:
+            return self.jobs.get(job_id)
+
+    def start_all(self, autostart_only=True):
+        for pipeline in self.pipelines.values():
+            if autostart_only and (not pipeline.settings['autostart'] or pipeline.settings['on_demand']):
+                continue
+            pipeline.start_async()
+
+    def stop_all(self):
+        for pipeline in self.pipelines.values():
+            pipeline.stop()
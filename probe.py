@@ -0,0 +1,136 @@
+import json
+import logging
+import os
+import subprocess
+import threading
+import time
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+PASSTHROUGH_PROFILES = {'Baseline', 'Constrained Baseline', 'Main', 'High'}
+
+
+def camera_key(url):
+    """Identify a camera by host, port and path, leaving the credentials out."""
+    parts = urlsplit(url)
+    host = parts.hostname or ''
+    port = f':{parts.port}' if parts.port else ''
+    return f"{host}{port}{parts.path}"
+
+
+def probe_stream(url, seconds=4, timeout=20):
+    """Describe the first video stream of `url` and measure its GOP length.
+
+    Reads `seconds` worth of packets so the keyframe interval can be measured
+    rather than trusted from the stream headers.
+    """
+    command = [
+        'ffprobe',
+        '-v', 'error',
+        '-rtsp_transport', 'tcp',
+        '-timeout', '5000000',
+        '-select_streams', 'v:0',
+        '-show_entries', 'stream=codec_name,profile,level,pix_fmt,width,height,avg_frame_rate'
+                         ':packet=pts_time,flags',
+        '-read_intervals', f'%+{seconds}',
+        '-of', 'json',
+        url
+    ]
+    output = subprocess.run(command, capture_output=True, text=True, timeout=timeout, check=True).stdout
+    data = json.loads(output)
+    streams = data.get('streams') or []
+    if not streams:
+        raise ValueError("No video stream found")
+    stream = streams[0]
+    keyframes = [
+        float(p['pts_time']) for p in data.get('packets', [])
+        if 'K' in p.get('flags', '') and p.get('pts_time') not in (None, 'N/A')
+    ]
+    gop = None
+    if len(keyframes) >= 2:
+        gop = (keyframes[-1] - keyframes[0]) / (len(keyframes) - 1)
+    return {
+        'codec': stream.get('codec_name'),
+        'profile': stream.get('profile'),
+        'level': stream.get('level'),
+        'pix_fmt': stream.get('pix_fmt'),
+        'width': stream.get('width'),
+        'height': stream.get('height'),
+        'frame_rate': stream.get('avg_frame_rate'),
+        'gop_seconds': gop,
+    }
+
+
+def passthrough_verdict(info, max_gop=2.0):
+    """Return (compatible, reason) for remuxing `info` into HLS without re-encoding."""
+    if info.get('codec') != 'h264':
+        return False, f"codec {info.get('codec')} is not h264"
+    if info.get('profile') not in PASSTHROUGH_PROFILES:
+        return False, f"profile {info.get('profile')} is not supported by browsers"
+    if info.get('pix_fmt') not in (None, 'yuv420p', 'yuvj420p'):
+        return False, f"pixel format {info.get('pix_fmt')} is not 4:2:0"
+    gop = info.get('gop_seconds')
+    if gop is None:
+        return False, "could not measure the keyframe interval"
+    if gop > max_gop:
+        return False, f"keyframe interval {gop:.2f}s exceeds {max_gop:.2f}s"
+    return True, "stream is browser compatible H.264"
+
+
+class ProbeCache:
+    """Probe results per camera, persisted as JSON so restarts skip ffprobe.
+
+    Besides the probe itself each entry remembers the CPU usage measured the
+    last time the camera was re-encoded, which is what passthrough saves.
+    """
+
+    def __init__(self, path, ttl=86400):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable probe cache {self.path}: {e}")
+            return {}
+
+    def _save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self._entries, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def get(self, key, allow_stale=False):
+        """Return the cached probe, or None if missing (or expired unless `allow_stale`)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry.get('probe') and (allow_stale or not self.is_stale(entry)):
+                return entry
+            return None
+
+    def is_stale(self, entry):
+        return time.time() - entry.get('probed_at', 0) >= self.ttl
+
+    def update(self, key, **fields):
+        with self._lock:
+            entry = self._entries.setdefault(key, {})
+            entry.update(fields)
+            try:
+                self._save()
+            except Exception as e:
+                logger.warning(f"Could not write probe cache {self.path}: {e}")
+            return dict(entry)
+
+    def entry(self, key):
+        with self._lock:
+            return dict(self._entries.get(key, {}))
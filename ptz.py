@@ -0,0 +1,403 @@
+import base64
+import http.client
+import logging
+import threading
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import Future
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+PTZ_PORT = 8899
+PTZ_PATH = '/onvif/ptz_service'
+PROFILE_TOKEN = 'PROFILE_000'
+
+NS = {
+    's': 'http://www.w3.org/2003/05/soap-envelope',
+    'tptz': 'http://www.onvif.org/ver20/ptz/wsdl',
+    'tt': 'http://www.onvif.org/ver10/schema',
+}
+
+# The envelope around every request; only the operation body varies
+ENVELOPE = (
+    '<?xml version="1.0" encoding="utf-8"?>'
+    '<s:Envelope xmlns:s="http://www.w3.org/2003/05/soap-envelope">'
+    '<s:Body xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:xsd="http://www.w3.org/2001/XMLSchema">'
+    '<{op} xmlns="http://www.onvif.org/ver20/ptz/wsdl"><ProfileToken>{profile}</ProfileToken>{body}</{op}>'
+    '</s:Body></s:Envelope>'
+)
+SPACES = 'http://www.onvif.org/ver10/tptz/'
+PAN_TILT = ('<PanTilt xmlns="http://www.onvif.org/ver10/schema" x="%.3f" y="%.3f" '
+            'space="' + SPACES + 'PanTiltSpaces/{space}"/>')
+ZOOM = '<Zoom xmlns="http://www.onvif.org/ver10/schema" x="%.3f" space="' + SPACES + 'ZoomSpaces/{space}"/>'
+VECTORS = {
+    'ContinuousMove': ('Velocity', 'VelocityGenericSpace'),
+    'AbsoluteMove': ('Position', 'PositionGenericSpace'),
+    'RelativeMove': ('Translation', 'TranslationGenericSpace'),
+}
+
+# Request body per operation; the values left are %-placeholders filled per
+# call. Moves have a '+zoom' variant, since fixed-lens models such as the
+# V380 Pro may fault on a Zoom element they do not support.
+OPERATIONS = {
+    'Stop': '<PanTilt>true</PanTilt><Zoom>true</Zoom>',
+    'GetStatus': '',
+    'SetPreset': '<PresetName>%s</PresetName>',
+    'GetPresets': '',
+    'GotoPreset': '<PresetToken>%s</PresetToken>',
+}
+for _op, (_element, _space) in VECTORS.items():
+    OPERATIONS[_op] = f'<{_element}>{PAN_TILT.format(space=_space)}</{_element}>'
+    OPERATIONS[f'{_op}+zoom'] = f'<{_element}>{PAN_TILT.format(space=_space)}{ZOOM.format(space=_space)}</{_element}>'
+
+
+# Commands after which the cached state is out of date
+MOVES = ('ContinuousMove', 'Stop', 'AbsoluteMove', 'RelativeMove', 'GotoPreset')
+
+
+class PtzError(Exception):
+    """The camera refused a PTZ command or could not be reached."""
+
+
+def compile_templates(profile):
+    """Full request templates for one profile, so a call only fills in its values."""
+    profile = xml_escape(profile).replace('%', '%%')
+    return {
+        key: ENVELOPE.format(op=key.split('+')[0], profile=profile, body=body)
+        for key, body in OPERATIONS.items()
+    }
+
+
+def xml_escape(text):
+    return (str(text).replace('&', '&amp;').replace('<', '&lt;')
+            .replace('>', '&gt;').replace('"', '&quot;'))
+
+
+def clamp(value, low=-1.0, high=1.0):
+    return max(low, min(high, float(value)))
+
+
+def move_command(op, x, y, zoom=None):
+    """(template, values...) for a move, with Zoom only when one is given."""
+    if zoom is None:
+        return op, clamp(x), clamp(y)
+    return f'{op}+zoom', clamp(x), clamp(y), clamp(zoom, 0.0 if op == 'AbsoluteMove' else -1.0)
+
+
+def parse_vector(element):
+    """{'x', 'y', 'zoom'} of a Position/Velocity element, None when absent."""
+    if element is None:
+        return None
+    pan_tilt = element.find('tt:PanTilt', NS)
+    zoom = element.find('tt:Zoom', NS)
+    return {
+        'x': float(pan_tilt.get('x', 0)) if pan_tilt is not None else None,
+        'y': float(pan_tilt.get('y', 0)) if pan_tilt is not None else None,
+        'zoom': float(zoom.get('x', 0)) if zoom is not None else None,
+    }
+
+
+class PtzClient:
+    """ONVIF PTZ client for one camera over a single keep-alive connection.
+
+    Requests are serialized on the connection, which is reopened when the
+    camera drops it. ContinuousMove calls go through a one-slot mailbox: a
+    sender thread always delivers the newest velocity, so a held joystick
+    never queues behind moves that are already out of date. Readers use
+    `state`, whose poller is the only caller of get_status() and
+    get_presets().
+    """
+
+    def __init__(self, host, username, password, port=PTZ_PORT, profile=PROFILE_TOKEN, timeout=5.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.templates = compile_templates(profile)
+        credentials = base64.b64encode(f"{username or ''}:{password or ''}".encode()).decode()
+        self.headers = {
+            'Content-Type': 'application/soap+xml; charset=utf-8',
+            'Authorization': f'Basic {credentials}',
+        }
+        self.commands = 0
+        self.coalesced = 0
+        self._conn = None
+        self._conn_lock = threading.Lock()
+        # Latest move waiting to be sent, with the Future of its caller
+        self._pending = None
+        self._cond = threading.Condition()
+        self._sender = None
+        self.state = PtzState(self)
+
+    @classmethod
+    def from_config(cls, config, url=None, **poll_settings):
+        """Client for a camera entry; the host falls back to the stream URL's."""
+        host = config.get('ip')
+        username, password = config.get('username'), config.get('password')
+        if not host and url:
+            parts = urlsplit(url)
+            host = parts.hostname
+            username = username or parts.username
+            password = password or parts.password
+        if not host:
+            return None
+        client = cls(host, username, password, port=int(config.get('ptz_port', PTZ_PORT)),
+                     profile=config.get('ptz_profile', PROFILE_TOKEN))
+        client.state.configure(**poll_settings)
+        return client
+
+    def close(self):
+        with self._conn_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def call(self, op, *values):
+        """Send one operation and return the parsed SOAP body element."""
+        template = self.templates[op]
+        body = (template % values if values else template).encode()
+        op = op.split('+')[0]
+        with self._conn_lock:
+            self.commands += 1
+            while True:
+                fresh = self._conn is None
+                if fresh:
+                    self._conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+                try:
+                    self._conn.request('POST', PTZ_PATH, body=body, headers=self.headers)
+                    resp = self._conn.getresponse()
+                    data = resp.read()
+                except (http.client.HTTPException, OSError) as e:
+                    self._conn.close()
+                    self._conn = None
+                    # A kept-alive connection the camera closed while idle fails
+                    # before the command is read; resend once on a new one
+                    stale = isinstance(e, (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError))
+                    if fresh or not stale:
+                        raise PtzError(f"PTZ {op} failed: {e}")
+                    continue
+                if resp.will_close:
+                    self._conn.close()
+                    self._conn = None
+                break
+        body = self._parse(op, resp.status, data)
+        if op in MOVES:
+            self.state.invalidate()
+        elif op == 'SetPreset':
+            self.state.invalidate(presets=True)
+        return body
+
+    @staticmethod
+    def _parse(op, status, data):
+        try:
+            root = ET.fromstring(data)
+        except ET.ParseError:
+            root = None
+        if root is not None:
+            fault = root.find('.//s:Fault', NS)
+            if fault is not None:
+                reason = fault.find('.//s:Reason', NS)
+                raise PtzError(f"PTZ {op} rejected: "
+                               f"{''.join(reason.itertext()).strip() if reason is not None else 'SOAP fault'}")
+        if status != 200 or root is None:
+            raise PtzError(f"PTZ {op} failed with HTTP {status}")
+        body = root.find('s:Body', NS)
+        if body is None:
+            # e.g. a SOAP 1.1 envelope, which uses another namespace
+            raise PtzError(f"PTZ {op} reply has no SOAP 1.2 Body")
+        return body
+
+    def _submit(self, command):
+        future = Future()
+        with self._cond:
+            if self._pending is not None:
+                self.coalesced += 1
+                self._pending[1].set_result({'coalesced': True})
+            self._pending = (command, future)
+            if self._sender is None:
+                self._sender = threading.Thread(target=self._send_moves, daemon=True, name=f"ptz-{self.host}")
+                self._sender.start()
+            self._cond.notify()
+        return future
+
+    def continuous_move(self, x, y, zoom=None):
+        """Queue a velocity, replacing one not sent yet; returns a Future.
+
+        The Future resolves to {'coalesced': True} when a newer command
+        replaced this one before it reached the camera.
+        """
+        return self._submit(move_command('ContinuousMove', x, y, zoom))
+
+    def stop(self):
+        """Stop pan, tilt and zoom, superseding any velocity not sent yet."""
+        # Through the same mailbox, so a move already taken by the sender
+        # cannot reach the camera after this Stop
+        return self._submit(('Stop',)).result(timeout=self.timeout * 2 + 1)
+
+    def _send_moves(self):
+        while True:
+            with self._cond:
+                while self._pending is None:
+                    self._cond.wait()
+                command, future = self._pending
+                self._pending = None
+            try:
+                self.call(*command)
+                future.set_result({'coalesced': False})
+            except Exception as e:
+                future.set_exception(e)
+
+    def absolute_move(self, x, y, zoom=None):
+        self.call(*move_command('AbsoluteMove', x, y, zoom))
+
+    def relative_move(self, x, y, zoom=None):
+        self.call(*move_command('RelativeMove', x, y, zoom))
+
+    def get_status(self):
+        body = self.call('GetStatus')
+        status = body.find('.//tptz:PTZStatus', NS)
+        if status is None:
+            return {'position': None, 'moving': None}
+        move = status.find('tt:MoveStatus', NS)
+        return {
+            'position': parse_vector(status.find('tt:Position', NS)),
+            'moving': {child.tag.split('}')[-1].lower(): child.text for child in move}
+            if move is not None else None,
+            'error': status.findtext('tt:Error', None, NS),
+            'utc_time': status.findtext('tt:UtcTime', None, NS),
+        }
+
+    def set_preset(self, name):
+        body = self.call('SetPreset', xml_escape(name))
+        return body.findtext('.//tptz:PresetToken', None, NS)
+
+    def get_presets(self):
+        body = self.call('GetPresets')
+        return [
+            {
+                'token': preset.get('token'),
+                'name': preset.findtext('tt:Name', None, NS),
+                'position': parse_vector(preset.find('tt:PTZPosition', NS)),
+            }
+            for preset in body.iter(f"{{{NS['tptz']}}}Preset")
+        ]
+
+    def goto_preset(self, token):
+        self.call('GotoPreset', xml_escape(token))
+
+
+class PtzState:
+    """Cached position, move status and presets of one camera.
+
+    One poller thread asks the camera, every `fast_interval` seconds while it
+    moves (and for `settle` seconds after any move command) and every
+    `idle_interval` seconds otherwise. Presets are fetched again after
+    SetPreset and every `presets_interval` seconds. Readers and SSE streams
+    only ever see this cache. The poller starts with the first reader and
+    exits after `linger` seconds without one.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.configure()
+        self.version = 0
+        self.polls = 0
+        self._data = {'position': None, 'moving': None, 'presets': None, 'error': None}
+        self._updated = None
+        self._fast_until = 0.0
+        self._presets_due = 0.0
+        self._last_read = 0.0
+        self._cond = threading.Condition()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def configure(self, fast_interval=0.25, idle_interval=5.0, presets_interval=60.0, settle=3.0, linger=60.0):
+        self.fast_interval = fast_interval
+        self.idle_interval = idle_interval
+        self.presets_interval = presets_interval
+        self.settle = settle
+        self.linger = linger
+
+    def to_dict(self):
+        return {**self._data, 'version': self.version, 'updated': self._updated}
+
+    def _touch(self):
+        # Called with _cond held
+        self._last_read = time.monotonic()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True, name=f"ptz-poll-{self.client.host}")
+            self._thread.start()
+
+    def read(self, timeout=None):
+        """Current state; the first reader waits up to `timeout` for the first poll."""
+        with self._cond:
+            self._touch()
+            self._cond.wait_for(lambda: self.version > 0, timeout)
+            return self.to_dict()
+
+    def wait(self, version, timeout):
+        """Block until the state differs from `version`, for at most `timeout` seconds."""
+        with self._cond:
+            self._touch()
+            self._cond.wait_for(lambda: self.version != version, timeout)
+            return self.to_dict()
+
+    def invalidate(self, presets=False):
+        with self._cond:
+            self._fast_until = time.monotonic() + self.settle
+            if presets:
+                self._presets_due = 0.0
+        self._wake.set()
+
+    def _interval(self):
+        with self._cond:
+            return self.fast_interval if time.monotonic() < self._fast_until else self.idle_interval
+
+    def _run(self):
+        try:
+            while True:
+                with self._cond:
+                    if time.monotonic() - self._last_read > self.linger:
+                        self._thread = None
+                        return
+                self._wake.clear()
+                self._poll()
+                self._wake.wait(self._interval())
+        finally:
+            # If the poller dies, the next reader starts a new one
+            with self._cond:
+                if self._thread is threading.current_thread():
+                    self._thread = None
+
+    def _poll(self):
+        now = time.monotonic()
+        with self._cond:
+            fetch_presets = now >= self._presets_due
+            if fetch_presets:
+                self._presets_due = now + self.presets_interval
+        update = {}
+        try:
+            status = self.client.get_status()
+            update = {'position': status['position'], 'moving': status['moving'], 'error': None}
+            if fetch_presets:
+                update['presets'] = self.client.get_presets()
+        except Exception as e:
+            if not isinstance(e, PtzError):
+                logger.exception(f"Unexpected PTZ reply from {self.client.host}")
+            update['error'] = str(e)
+            if fetch_presets:
+                # Try the presets again on the next poll
+                with self._cond:
+                    self._presets_due = 0.0
+        with self._cond:
+            self.polls += 1
+            moving = any(value == 'MOVING' for value in (update.get('moving') or {}).values())
+            if moving or ('position' in update and update['position'] != self._data['position'] and self.version):
+                # Keep polling fast until the camera has come to rest
+                self._fast_until = max(self._fast_until, time.monotonic() + self.fast_interval * 4)
+            data = {**self._data, **update}
+            if data != self._data or self.version == 0:
+                self._data = data
+                self.version += 1
+            self._updated = time.time()
+            self._cond.notify_all()
@@ -0,0 +1,180 @@
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+MIME_TYPES = {
+    '.m3u8': 'application/vnd.apple.mpegurl',
+    '.ts': 'video/mp2t',
+    '.jpg': 'image/jpeg',
+}
+
+
+def content_type_for(filename):
+    for ext, mime in MIME_TYPES.items():
+        if filename.endswith(ext):
+            return mime
+    return 'application/octet-stream'
+
+
+TS_PACKET_SIZE = 188
+
+
+def starts_with_keyframe(data, max_packets=64):
+    """Return True if the first video PES in an MPEG-TS blob is a keyframe.
+
+    FFmpeg's mpegts muxer sets the random access indicator on the packet that
+    starts a keyframe, so only the first few packet headers have to be read.
+    """
+    end = min(len(data), max_packets * TS_PACKET_SIZE)
+    for offset in range(0, end - TS_PACKET_SIZE + 1, TS_PACKET_SIZE):
+        if data[offset] != 0x47:
+            return False
+        if not data[offset + 1] & 0x40:  # payload_unit_start_indicator
+            continue
+        adaptation = (data[offset + 3] >> 4) & 0x3
+        payload = offset + 4
+        random_access = False
+        if adaptation & 0x2:
+            length = data[offset + 4]
+            random_access = bool(length and data[offset + 5] & 0x40)
+            payload += 1 + length
+        # PES start code followed by a video stream id; audio PES are skipped
+        # because the muxer flags every audio frame as random access
+        if data[payload:payload + 3] == b'\x00\x00\x01' and 0xE0 <= data[payload + 3] <= 0xEF:
+            return random_access
+    return False
+
+
+class CachedFile:
+    """An immutable blob held in memory together with its HTTP metadata."""
+
+    __slots__ = ('name', 'data', 'etag', 'content_type', 'created')
+
+    def __init__(self, name, data):
+        self.name = name
+        self.data = data
+        self.etag = f'"{zlib.crc32(data):08x}-{len(data):x}"'
+        self.content_type = content_type_for(name)
+        self.created = time.time()
+
+
+def parse_media_playlist(text):
+    """Return [(uri, duration), ...] for the segments of a media playlist."""
+    entries = []
+    duration = None
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith('#EXTINF:'):
+            duration = float(line[8:].split(',', 1)[0])
+        elif line and not line.startswith('#') and duration is not None:
+            entries.append((line, duration))
+            duration = None
+    return entries
+
+
+def media_sequence(text):
+    """EXT-X-MEDIA-SEQUENCE of a media playlist, 0 when absent."""
+    for line in text.splitlines():
+        if line.startswith('#EXT-X-MEDIA-SEQUENCE:'):
+            return int(line.split(':', 1)[1])
+    return 0
+
+
+class SegmentRing:
+    """Fixed-size ring of HLS segments plus the current playlists.
+
+    FFmpeg PUTs every segment and playlist revision to the ingest route; the
+    ring keeps the newest `capacity` segments so viewers are answered from
+    memory without touching the filesystem. Playlists are kept by name, one
+    per rendition when an ABR ladder writes `<rendition>/playlist.m3u8`.
+
+    It also acts as a GOP cache: every playlist revision is stored as a
+    snapshot whose EXT-X-START points at the newest segment that begins with
+    a keyframe, so a joining player decodes from there instead of guessing.
+    """
+
+    def __init__(self, capacity=8):
+        self.capacity = capacity
+        self._segments = OrderedDict()
+        self._keyframes = set()
+        self._playlists = {}
+        # Playlist name -> name of its newest keyframe segment
+        self._join = {}
+        self._lock = threading.Lock()
+
+    def put(self, name, data):
+        if name.endswith('.m3u8'):
+            item, join = self._snapshot(name, data)
+            with self._lock:
+                self._playlists[name] = item
+                if join is not None:
+                    self._join[name] = join
+            return item
+        item = CachedFile(name, data)
+        keyframe = starts_with_keyframe(data)
+        with self._lock:
+            self._segments.pop(name, None)
+            self._segments[name] = item
+            if keyframe:
+                self._keyframes.add(name)
+            while len(self._segments) > self.capacity:
+                evicted, _ = self._segments.popitem(last=False)
+                self._keyframes.discard(evicted)
+        return item
+
+    def _snapshot(self, name, data):
+        """Playlist revision with EXT-X-START at the newest keyframe segment."""
+        text = data.decode('utf-8', 'replace')
+        entries = parse_media_playlist(text)
+        # Segment URIs are relative to the playlist, e.g. inside "720p/"
+        prefix = name.rpartition('/')[0]
+        with self._lock:
+            start = None
+            for index, (uri, _) in enumerate(entries):
+                if (f'{prefix}/{uri}' if prefix else uri) in self._keyframes:
+                    start = index
+        if start is None:
+            return CachedFile(name, data), None
+        offset = sum(duration for _, duration in entries[start:])
+        lines = text.splitlines()
+        lines.insert(1, f'#EXT-X-START:TIME-OFFSET=-{offset:.3f},PRECISE=YES')
+        uri = entries[start][0]
+        return CachedFile(name, ('\n'.join(lines) + '\n').encode()), f'{prefix}/{uri}' if prefix else uri
+
+    def get(self, name):
+        with self._lock:
+            if name.endswith('.m3u8'):
+                return self._playlists.get(name)
+            return self._segments.get(name)
+
+    def delete(self, name):
+        with self._lock:
+            if name.endswith('.m3u8'):
+                self._playlists.pop(name, None)
+                self._join.pop(name, None)
+            else:
+                self._segments.pop(name, None)
+                self._keyframes.discard(name)
+
+    def clear(self):
+        with self._lock:
+            self._segments.clear()
+            self._keyframes.clear()
+            self._playlists.clear()
+            self._join.clear()
+
+    @property
+    def playlist(self):
+        """The single-rendition playlist, or any rendition's when using a ladder."""
+        with self._lock:
+            return self._playlists.get('playlist.m3u8') or next(iter(self._playlists.values()), None)
+
+    def keyframe_segment(self, playlist='playlist.m3u8'):
+        """The newest cached segment of `playlist` that starts with a keyframe."""
+        with self._lock:
+            name = self._join.get(playlist) or next(iter(self._join.values()), None)
+            return self._segments.get(name) if name else None
+
+    def __len__(self):
+        return len(self._segments)
@@ -0,0 +1,76 @@
+import logging
+import os
+import subprocess
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from segment_store import CachedFile
+
+logger = logging.getLogger(__name__)
+
+# Decodes running at once across all cameras, so a dashboard refreshing
+# every tile together cannot fork one FFmpeg per camera simultaneously
+_decode_slots = threading.BoundedSemaphore(os.cpu_count() or 1)
+
+
+def decode_jpeg(data, width=0, timeout=10):
+    """Decode the first video frame of an MPEG-TS blob into a JPEG."""
+    command = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-f', 'mpegts', '-i', 'pipe:0', '-frames:v', '1']
+    if width:
+        command += ['-vf', f'scale={width}:-2']
+    command += ['-q:v', '5', '-f', 'mjpeg', 'pipe:1']
+    with _decode_slots:
+        result = subprocess.run(command, input=data, capture_output=True, timeout=timeout, check=True)
+    if not result.stdout:
+        raise ValueError("No frame could be decoded")
+    return result.stdout
+
+
+class SnapshotCache:
+    """JPEG snapshots of one camera, decoded at most once per source segment.
+
+    Entries are keyed by the segment the keyframe came from, so every request
+    until the next segment is served from memory. Concurrent requests for a
+    frame that is not decoded yet wait on the one decode already running.
+    """
+
+    def __init__(self, keep=4):
+        self.keep = keep
+        self.decodes = 0
+        self._cache = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def get(self, key, load, width=0):
+        """Return the CachedFile for (`key`, `width`), calling `load()` for the segment bytes once."""
+        cache_key = (key, width)
+        with self._lock:
+            item = self._cache.get(cache_key)
+            if item is not None:
+                return item
+            future = self._inflight.get(cache_key)
+            owner = future is None
+            if owner:
+                future = self._inflight[cache_key] = Future()
+        if not owner:
+            return future.result(timeout=15)
+        try:
+            self.decodes += 1
+            item = CachedFile(f'{key}.jpg', decode_jpeg(load(), width))
+            with self._lock:
+                self._cache[cache_key] = item
+                while len(self._cache) > self.keep:
+                    self._cache.popitem(last=False)
+            future.set_result(item)
+            return item
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(cache_key, None)
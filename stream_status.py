@@ -0,0 +1,108 @@
+import threading
+import time
+
+# Fields that change on every poll and so never count as a state change
+VOLATILE = ('segment_age',)
+
+
+def unknown_state(name):
+    """Stand-in for a camera the poller has not reported yet."""
+    return {'camera': name, 'state': 'unknown', 'segment': None, 'segment_age': None, 'speed': None,
+            'behind_realtime': False, 'viewers': 0, 'version': 0}
+
+
+class StatusBroadcaster:
+    """Live health of every camera, polled once and pushed to SSE subscribers.
+
+    One poller thread reads `Pipeline.health()` for every camera every
+    `interval` seconds. A camera's `version` only increases when something
+    other than the segment age changed, so subscribers are woken for new
+    segments, state changes, encoder speed and viewer count changes, not for
+    every poll. Any number of pages therefore cost one poll per camera per
+    interval. The poller starts with the first reader and exits after
+    `linger` seconds without one.
+    """
+
+    def __init__(self, registry, interval=1.0, linger=30.0):
+        self.registry = registry
+        self.interval = interval
+        self.linger = linger
+        # Increases whenever any camera's state changes
+        self.version = 0
+        self.polls = 0
+        self._states = {}
+        self._last_read = 0.0
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def _touch(self):
+        # Called with _cond held
+        self._last_read = time.monotonic()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True, name="stream-status")
+            self._thread.start()
+
+    def read(self, name, timeout=5.0):
+        """Current state of camera `name`; the first reader waits for the first poll.
+
+        Without a poll within `timeout` the state is 'unknown', with version 0.
+        """
+        with self._cond:
+            self._touch()
+            self._cond.wait_for(lambda: name in self._states, timeout)
+            return self._state(name)
+
+    def wait(self, name, version, timeout):
+        """Block until camera `name` differs from `version`, for at most `timeout` seconds."""
+        with self._cond:
+            self._touch()
+            self._cond.wait_for(lambda: self._state(name)['version'] != version, timeout)
+            return self._state(name)
+
+    def _state(self, name):
+        # Called with _cond held
+        state = self._states.get(name)
+        return dict(state) if state is not None else unknown_state(name)
+
+    def read_all(self, timeout=5.0):
+        """(version, {camera: state}) for every camera."""
+        with self._cond:
+            self._touch()
+            self._cond.wait_for(lambda: self.version > 0, timeout)
+            return self.version, {name: dict(state) for name, state in self._states.items()}
+
+    def wait_all(self, version, timeout):
+        """Like read_all() once any camera differs from overall `version`."""
+        with self._cond:
+            self._touch()
+            self._cond.wait_for(lambda: self.version != version, timeout)
+            return self.version, {name: dict(state) for name, state in self._states.items()}
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if time.monotonic() - self._last_read > self.linger:
+                    self._thread = None
+                    return
+            self.poll()
+            time.sleep(self.interval)
+
+    def poll(self):
+        # Health is read outside the lock; it only looks at pipeline attributes
+        healths = [pipeline.health() for pipeline in list(self.registry.pipelines.values())]
+        with self._cond:
+            self.polls += 1
+            changed = False
+            for health in healths:
+                name = health['camera']
+                previous = self._states.get(name)
+                if previous is not None and all(
+                        previous[key] == value for key, value in health.items() if key not in VOLATILE):
+                    previous.update((key, health[key]) for key in VOLATILE)
+                    continue
+                health['version'] = previous['version'] + 1 if previous else 1
+                self._states[name] = health
+                changed = True
+            if changed:
+                self.version += 1
+                self._cond.notify_all()
@@ -0,0 +1,54 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Watchdog:
+    """Background supervisor that restarts unhealthy pipelines.
+
+    Every `interval` seconds each pipeline that should be running is checked
+    for a dead FFmpeg process, segments that stopped advancing, and an RTSP
+    input whose timestamps no longer move. Problems become restart incidents
+    on the pipeline, which apply the backoff and de-duplication. On-demand
+    pipelines nobody has watched for their idle timeout are stopped.
+    """
+
+    def __init__(self, registry, interval=2.0, stall_timeout=10.0, healthy_reset=60.0):
+        self.registry = registry
+        self.interval = interval
+        self.stall_timeout = stall_timeout
+        self.healthy_reset = healthy_reset
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True, name="watchdog")
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.tick()
+            except Exception:
+                logger.exception("Watchdog check failed")
+
+    def tick(self):
+        now = time.time()
+        for pipeline in list(self.registry.pipelines.values()):
+            if pipeline.idle_expired():
+                logger.info(f"[{pipeline.name}] No viewers for {pipeline.settings['idle_timeout']:.0f}s, stopping")
+                pipeline.stop()
+                continue
+            problem = pipeline.health_problem(self.stall_timeout)
+            if problem:
+                pipeline.request_restart(problem)
+            elif pipeline.restart_failures and pipeline.ready_at and now - pipeline.ready_at > self.healthy_reset:
+                # Healthy long enough: the next incident starts from the base delay again
+                pipeline.restart_failures = 0